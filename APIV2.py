@@ -4,6 +4,9 @@ import os
 import db # type: ignore
 import time
 import UploadAPI
+import SessionManifest
+import ClipPreviews
+import StorageManager
 #from SessionHandler import create_session_directories
 from flask import Flask, jsonify, request, make_response
 import threading
@@ -21,6 +24,19 @@ def validID(id):
     except:
         return False
 
+CLIP_WAIT_TIMEOUT = 60 # Max seconds stop_session waits for the clips still being extracted
+
+def wait_for_clips(manifest, timeout=CLIP_WAIT_TIMEOUT):
+    '''
+    Waits until the Camera finished every clip of the session (done, failed or dropped in the manifest)
+    '''
+    end = time.time() + timeout
+    while manifest.in_progress() and time.time() < end:
+        time.sleep(0.5)
+        manifest.reload()
+    if manifest.in_progress():
+        print(f"{manifest.in_progress()} clips still being extracted, not counted")
+
 def verifyAuthentication(r):
     try:
         headers = r.headers
@@ -47,7 +63,7 @@ def start_session():
     Route to start a new session.
     Receives:
     {'SessionID': , 'SessionType':}
-    Returns: JSON containing a boolean to indicate success or not and in case of error an error message ("Invalid SessionID", "Session Already Established") 
+    Returns: JSON containing a boolean to indicate success or not and in case of error an error message ("Invalid SessionID", "Session Already Established", "Not Enough Storage") 
     {'success': , 'message': } 
     """
     
@@ -69,6 +85,10 @@ def start_session():
     if not validID(SESSIONID):
         print("Invalid SessionID Received")
         return jsonify({ "success": False, "message": "Invalid SessionID" }), 400
+    has_room, reason = StorageManager.session_headroom(camera_state.storage_stats)
+    if not has_room:
+        print(f"Not Enough Storage: {reason}")
+        return jsonify({ "success": False, "message": "Not Enough Storage" }), 400
     
     webapp.SessionID = SESSIONID
     webapp.SessionStartTime = time.time()
@@ -98,8 +118,9 @@ def stop_session():
     Receives: SessionID associated with the current session
     {'SessionID': }
     Returns: JSON containing a boolean to indicate success or not and in case of error an error message ("No Current Session", "Invalid SessionID", "Wrong SessionID") 
-    Also responds with how many videos were recorded in this session and theyr format (mp4, avi, etc).
-    {'success': , 'message':, 'content_type': , 'video_count': } 
+    Also responds with how many videos were recorded in this session and theyr format (mp4, avi, etc), and the previews
+    and telemetry files made of each clip (upload routes for them can be sent with upload_session).
+    {'success': , 'message':, 'content_type': , 'video_count': , 'previews': } 
     """ 
     
     if not request.is_json:
@@ -126,16 +147,20 @@ def stop_session():
     commands.tracking_enabled = False 
     commands.cancel_pairing = True
     time.sleep(0.5)
-    ensure_no_temp(f"/home/idmind/surfcamera_deploy_test/videos/{SessionID}")
-    time.sleep(0.5)
-    file_count = get_file_count(f"/home/idmind/surfcamera_deploy_test/videos/{SessionID}")
+    manifest = SessionManifest.SessionManifest(SessionID)
+    wait_for_clips(manifest)
+    manifest.remove_incomplete()
+    file_count = manifest.clip_count()
     webapp.client.dump(["SessionID"], "db.txt")
-    return jsonify({ "success": True, "message": "", "content_type": "video/mp4", "video_count": file_count}), 200
+    return jsonify({ "success": True, "message": "", "content_type": "video/mp4", "video_count": file_count,
+                    "previews": [o for o in SessionManifest.CLIP_OUTPUTS if o != "proxy" or ClipPreviews.MAKE_PROXY]}), 200
 
 @app.route('/upload_session', methods=['POST'])
 def upload_session():
     """
     Route to send the upload_urls for the camera to upload the stopped session videos.
+    Optional thumbnail_route, preview_route, proxy_route, telemetry_route and gpx_route (one URL per video, like
+    uploading_route): the clip previews and telemetry are uploaded before the videos.
     Returns: JSON containing a boolean to indicate success or not and in case of error an error message ("Invalid SessionID", "Session Already Established") 
     {'success': , 'message': }
     """
@@ -148,6 +173,7 @@ def upload_session():
     
     SessionID = request.json.get('SessionID', -1)
     UPLOADURL = request.json.get('uploading_route', None)
+    PREVIEWURLS = {o: request.json.get(f'{o}_route') for o in SessionManifest.CLIP_OUTPUTS if request.json.get(f'{o}_route')}
     
     if UPLOADURL is None:
         print("No uploading_route field received")
@@ -163,7 +189,7 @@ def upload_session():
         return jsonify({"success":True, "message": ""}), 200
     
     def background_upload():
-        UploadAPI.upload_videos_in_directory(UPLOADURL, f"/home/idmind/surfcamera_deploy_test/videos/{SessionID}")
+        UploadAPI.upload_session_clips(UPLOADURL, SessionManifest.SessionManifest(SessionID), PREVIEWURLS)
         
     threading.Thread(target=background_upload, daemon=True).start()
     
@@ -251,34 +277,6 @@ def main(d):
     p_server.terminate()
     p_server.join()
 
-def ensure_no_temp(path: str, valid_exts=('.mp4', '.mkv', '.avi', '.mov')):
-    """
-    Ensure that a folder only contains videos with numeric names and valid extensions.
-    Example of valid: 0.mp4, 1.mkv, 2.avi, 3.mov
-    Deletes anything else (like temp_0.mp4, abc.mp4, foo.txt).
-    """
-    if not os.path.isdir(path):
-        raise ValueError(f"{path} is not a valid directory")
-
-    for fname in os.listdir(path):
-        fpath = os.path.join(path, fname)
-        if not os.path.isfile(fpath):
-            continue  # skip subfolders
-
-        name, ext = os.path.splitext(fname)
-
-        # keep only if filename is a number and extension is valid
-        if not (name.isdigit() and ext.lower() in valid_exts):
-            print(f"Deleting unexpected file: {fname}")
-            os.remove(fpath)
-    
-def get_file_count(path):
-    # Get a list of video files in the directory
-    video_files = [file_name for file_name in os.listdir(path)
-                   if os.path.isfile(os.path.join(path, file_name)) and file_name.lower().endswith(('.mp4', '.mkv', '.avi', '.mov'))]
-
-    return len(video_files)
-
 def get_session_directory(sessionID, folder):
     return f"/home/idmind/surfcamera_deploy_test/{folder}/{sessionID}"
 
@@ -33,11 +33,12 @@ class AutoRecordingController:
         else:                           
             self.timeflag_stop_hyster = time.time()
 
-        if not self.cam_state.is_recording and time.time() - self.timeflag_start_hyster > self.threshold_start_hyster:
+        # start_recording is this controller's own wave (is_recording is set while any wave is open, WaveEvents.py)
+        if not self.cam_state.start_recording and time.time() - self.timeflag_start_hyster > self.threshold_start_hyster:
             print("AutoRecording Start Triggered")
             self.cam_state.start_recording = True
 
-        if self.cam_state.is_recording and time.time() - self.timeflag_stop_hyster > self.threshold_stop_hyster:
+        if self.cam_state.start_recording and time.time() - self.timeflag_stop_hyster > self.threshold_stop_hyster:
             print("AutoRecording Stop Triggered")
             self.cam_state.start_recording = False
 
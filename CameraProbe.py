@@ -0,0 +1,145 @@
+import time
+import socket
+import threading
+from urllib.parse import urlsplit
+
+'''
+Reachability of the IP camera, checked on its RTSP server rather than with ping.
+
+A background thread sends an RTSP OPTIONS request to the camera (port 554) every PROBE_PERIOD seconds, on a socket
+with a PROBE_TIMEOUT, no process spawned. Any RTSP reply (even 401 Unauthorized) means the stream server is alive.
+The state changes with hysteresis: down after DOWN_AFTER failed probes in a row, up after UP_AFTER good ones, so one
+lost reply doesn't flap it. Changes go to webapp.ErrorStates (source "camera").
+
+Stats: round trip and CPU time of the probes (cost), and the detection latency of the last change (from the first
+probe that disagreed with the state to the change).
+'''
+
+PROBE_PERIOD = 2
+PROBE_TIMEOUT = 1
+DOWN_AFTER = 3
+UP_AFTER = 2
+
+class CameraProbe():
+
+    def __init__(self, rtsp_url, webapp=None, period=PROBE_PERIOD, timeout=PROBE_TIMEOUT):
+        url = urlsplit(rtsp_url)
+        self.host = url.hostname
+        self.port = url.port or 554
+        self.url = f"rtsp://{self.host}:{self.port}{url.path or '/'}"    # Without the credentials
+        self.webapp = webapp
+        self.period = period
+        self.timeout = timeout
+        self.state = "unknown"
+        self.streak = 0             # Probes in a row disagreeing with the state
+        self.streak_start = None
+        self.up = threading.Event()
+        self.thread = None
+        self.run = False
+        self.cseq = 0
+        self.stats = {"probes": 0, "failures": 0, "changes": 0, "last_error": None, "last_rtt_ms": None,
+                      "mean_rtt_ms": None, "mean_cpu_us": None, "last_detection_seconds": None}
+        self.rtt_total = 0
+        self.cpu_total = 0
+
+    @property
+    def reachable(self):
+        return self.state == "up"
+
+    def start(self):
+        self.run = True
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.run = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def wait_up(self, timeout=None):
+        return self.up.wait(timeout)
+
+    def probe(self):
+        '''
+        One RTSP OPTIONS exchange: None when the camera answered, else the error
+        '''
+        self.cseq += 1
+        request = f"OPTIONS {self.url} RTSP/1.0\r\nCSeq: {self.cseq}\r\nUser-Agent: surfcam-probe\r\n\r\n".encode()
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout) as s:
+                s.sendall(request)
+                reply = s.recv(1024)
+        except OSError as e:
+            return str(e) or type(e).__name__
+        if not reply.startswith(b"RTSP/1."):
+            return f"unexpected reply {reply[:20]!r}" if reply else "connection closed"
+        return None
+
+    def worker(self):
+        next_probe = time.monotonic()
+        while self.run:
+            if time.monotonic() < next_probe:
+                time.sleep(0.05)
+                continue
+            next_probe = max(next_probe + self.period, time.monotonic())   # No burst after slow probes
+            t, cpu = time.perf_counter(), time.thread_time()
+            error = self.probe()
+            self.update(error, time.perf_counter() - t, time.thread_time() - cpu)
+
+    def update(self, error, rtt, cpu):
+        now = time.monotonic()
+        self.stats["probes"] += 1
+        self.cpu_total += cpu
+        self.stats["mean_cpu_us"] = round(1e6 * self.cpu_total / self.stats["probes"])
+        if error is None:
+            self.rtt_total += rtt
+            ok = self.stats["probes"] - self.stats["failures"]
+            self.stats["last_rtt_ms"] = round(1000 * rtt, 1)
+            self.stats["mean_rtt_ms"] = round(1000 * self.rtt_total / ok, 1)
+        else:
+            self.stats["failures"] += 1
+            self.stats["last_error"] = error
+
+        # "unknown" (boot) disagrees with both outcomes, so a camera down at boot is reported too
+        if self.state != "unknown" and (error is None) == self.reachable:
+            self.streak = 0
+            return
+        if self.streak == 0:
+            self.streak_start = now
+        self.streak += 1
+        if error is None and (self.streak >= UP_AFTER or self.state == "unknown"):
+            self.change("up", now)
+        elif error is not None and (self.streak >= DOWN_AFTER or self.state == "unknown"):
+            self.change("down", now, error)
+
+    def change(self, state, now, error=None):
+        if self.state != "unknown":
+            self.stats["changes"] += 1
+            self.stats["last_detection_seconds"] = round(now - self.streak_start, 2)
+        self.state = state
+        self.streak = 0
+        if state == "up":
+            print(f"Camera is reachable ({self.host}:{self.port})")
+            self.up.set()
+            if self.webapp is not None:
+                self.webapp.clear_error("camera")
+        else:
+            print(f"Camera not reachable ({self.host}:{self.port}): {error}")
+            self.up.clear()
+            if self.webapp is not None:
+                self.webapp.set_error("camera", f"IP camera not reachable ({error})")
+
+    def getStats(self):
+        return dict(self.stats, state=self.state)
+
+if __name__ == "__main__":
+    import Camera
+    probe = CameraProbe(Camera.RTSP_URL)
+    probe.start()
+    try:
+        while True:
+            time.sleep(probe.period)
+            print(probe.getStats())
+    except KeyboardInterrupt:
+        probe.stop()
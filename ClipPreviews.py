@@ -0,0 +1,176 @@
+import os
+import time
+import queue
+import shutil
+import threading
+import subprocess
+
+'''
+Light versions of every finished clip, so the WebApp can show what was caught before the full clip is uploaded:
+a poster thumbnail (JPEG, middle of the wave), an animated preview (a few seconds from the take off, small muted MP4)
+and optionally a low bitrate proxy of the whole clip.
+
+They are made by a single worker thread in the Camera process, one ffmpeg at a time, at the lowest CPU (nice) and
+IO (ionice idle class) priority with a single encoder thread, and only while no clip is being extracted (busy()), so
+they never compete with the recording or the clips. Outputs go to <session folder>/previews and are recorded in the
+session manifest: previews (queued, running, done, failed, skipped) and, per output, {"path", "bytes", "seconds"}
+under thumbnail / preview / proxy, with their own upload state (thumbnail_upload, ...).
+'''
+
+THUMBNAIL_WIDTH = 640
+PREVIEW_WIDTH = 480
+PREVIEW_SECONDS = 4
+PREVIEW_FPS = 12
+MAKE_PROXY = False
+PROXY_WIDTH = 960
+PROXY_BITRATE = "1500k"
+NICE = 19
+QUEUE_SIZE = 32         # Clips waiting for their previews, past this new clips get none (skipped)
+BUSY_WAIT = 0.5
+OUTPUTS = ("thumbnail", "preview", "proxy")
+IONICE = ['ionice', '-c', '3'] if shutil.which('ionice') else []
+
+def output_paths(clip_path):
+    folder, name = os.path.split(clip_path)
+    stem = os.path.splitext(name)[0]
+    previews = os.path.join(folder, "previews")
+    return {
+        "thumbnail": os.path.join(previews, f"{stem}_thumb.jpg"),
+        "preview": os.path.join(previews, f"{stem}_preview.mp4"),
+        "proxy": os.path.join(previews, f"{stem}_proxy.mp4"),
+    }
+
+def low_priority():
+    os.nice(NICE)
+
+class PreviewJob():
+    '''
+    Previews of one finished clip (ClipWorkers.ClipJob), with the wave times relative to the clip start
+    '''
+    def __init__(self, clip_job):
+        self.clip = clip_job.clip
+        self.path = clip_job.output_file
+        self.manifest = clip_job.manifest
+        duration = clip_job.duration() or 0
+        clip_start = clip_job.start - (clip_job.start_offset or 0)
+        wave_start = min(max(clip_job.wave_start - clip_start, 0), duration)
+        self.poster_time = min((wave_start + duration) / 2, max(duration - 0.5, 0))
+        self.preview_start = max(min(wave_start - 1, duration - PREVIEW_SECONDS), 0)
+        self.outputs = output_paths(self.path)
+
+    def commands(self):
+        base = IONICE + ['ffmpeg', '-y', '-nostats', '-loglevel', 'error', '-threads', '1']
+        commands = {
+            "thumbnail": base + ['-ss', f'{self.poster_time:.2f}', '-i', self.path, '-frames:v', '1',
+                                 '-vf', f'scale={THUMBNAIL_WIDTH}:-2', '-q:v', '4'],
+            "preview": base + ['-ss', f'{self.preview_start:.2f}', '-t', str(PREVIEW_SECONDS), '-i', self.path, '-an',
+                               '-vf', f'fps={PREVIEW_FPS},scale={PREVIEW_WIDTH}:-2', '-c:v', 'libx264',
+                               '-preset', 'veryfast', '-crf', '30', '-pix_fmt', 'yuv420p', '-threads', '1',
+                               '-movflags', '+faststart'],
+        }
+        if MAKE_PROXY:
+            commands["proxy"] = base + ['-i', self.path, '-vf', f'scale={PROXY_WIDTH}:-2', '-c:v', 'libx264',
+                                        '-preset', 'veryfast', '-b:v', PROXY_BITRATE, '-maxrate', PROXY_BITRATE,
+                                        '-bufsize', PROXY_BITRATE, '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '64k',
+                                        '-threads', '1', '-movflags', '+faststart']
+        return commands
+
+class ClipPreviewWorker():
+
+    def __init__(self, busy=None, on_done=None):
+        self.busy = busy or (lambda: False)     # True while clips are being extracted
+        self.on_done = on_done                  # Called with the PreviewJob once its outputs are recorded
+        self.jobs = queue.Queue(maxsize=QUEUE_SIZE)
+        self.process = None
+        self.thread = None
+        self.run = False
+        self.stats = {"done": 0, "failed": 0, "skipped": 0, "last_seconds": None}
+
+    def start(self):
+        self.run = True
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop after the current ffmpeg (terminated), the clips still queued are recorded as skipped
+        '''
+        self.run = False
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            self.skip(job, "stopped")
+
+    def submit(self, clip_job):
+        job = PreviewJob(clip_job)
+        try:
+            self.jobs.put_nowait(job)
+            job.manifest.record(job.clip, previews="queued")
+        except queue.Full:
+            self.skip(job, "preview queue full")
+
+    def skip(self, job, reason):
+        self.stats["skipped"] += 1
+        print(f"Previews of {job.path} skipped: {reason}")
+        job.manifest.record(job.clip, previews="skipped")
+
+    def getStats(self):
+        return dict(self.stats, queued=self.jobs.qsize())
+
+    def worker(self):
+        while self.run:
+            try:
+                job = self.jobs.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            while self.run and self.busy():
+                time.sleep(BUSY_WAIT)
+            if not self.run:
+                self.skip(job, "stopped")
+                break
+            self.make(job)
+
+    def make(self, job):
+        job.manifest.record(job.clip, previews="running")
+        os.makedirs(os.path.dirname(job.outputs["thumbnail"]), exist_ok=True)
+        fields = {}
+        failed = False
+        t0 = time.monotonic()
+        for output, command in job.commands().items():
+            path = job.outputs[output]
+            root, extension = os.path.splitext(path)
+            tmp = root + ".tmp" + extension     # Never a half written output under the final name
+            t = time.monotonic()
+            try:
+                self.process = subprocess.Popen(command + [tmp], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                                preexec_fn=low_priority)
+                _, stderr = self.process.communicate()
+                error = []
+                if self.process.returncode:
+                    error = stderr.decode('utf-8', 'replace').strip().splitlines()[-1:] or [f"exit code {self.process.returncode}"]
+            except OSError as e:
+                error = [str(e)]
+            self.process = None
+            if not error and os.path.exists(tmp) and os.path.getsize(tmp) > 0:
+                os.replace(tmp, path)
+                fields[output] = {"path": path, "bytes": os.path.getsize(path), "seconds": round(time.monotonic() - t, 2)}
+            else:
+                failed = True
+                print(f"FFMPEG error while making the {output} of {job.path}: {error[0] if error else 'empty output'}")
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            if not self.run:
+                break
+        self.stats["last_seconds"] = round(time.monotonic() - t0, 2)
+        self.stats["failed" if failed else "done"] += 1
+        job.manifest.record(job.clip, previews="failed" if failed else "done", **fields)
+        if self.on_done:
+            self.on_done(job)
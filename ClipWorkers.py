@@ -0,0 +1,212 @@
+import os
+import time
+import queue
+import threading
+import SegmentRing
+import Trajectory
+
+'''
+Clip extraction off the recording loop.
+
+The camera worker hands finished waves (segments already pinned in the ring) to a bounded queue, served by a few
+worker threads running ffmpeg. Submitting never blocks: when the queue is full the camera keeps the wave pending and
+tries again on the next loop (back-pressure), and past MAX_BACKLOG pending waves the oldest one is dropped. Failed
+jobs are retried. Each clip is recorded in the session manifest (SessionManifest.py) when the wave ends (pending) and
+again when its job ends (done, failed or dropped).
+Results come back through results(), so the ring (unpinning) is only touched from the camera worker.
+Wave times are monotonic seconds (ring clock), the manifest gets them as epoch times.
+With the session trajectory (Trajectory.py) a done clip also gets its telemetry sidecars, written by the same worker.
+'''
+
+CLIP_WORKERS = 2
+QUEUE_SIZE = 4
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 2
+MAX_BACKLOG = 8     # Waves waiting for a queue slot before the oldest is dropped
+
+class ClipJob():
+    '''
+    One wave to clip. status: pending (waiting for the ring / a queue slot), queued, running, retrying, done, failed,
+    dropped
+    '''
+    def __init__(self, clip, output_file, wave_start, wave_end, pre_roll, pin, manifest, gps=None, trajectory=None):
+        self.clip = clip
+        self.output_file = output_file
+        self.wave_start = wave_start
+        self.start = wave_start - pre_roll
+        self.end = wave_end
+        self.pin = pin
+        self.manifest = manifest    # SessionManifest.SessionManifest
+        self.gps = gps or {}
+        self.trajectory = trajectory    # Trajectory.TrajectoryLog of the session
+        self.telemetry = {}     # Manifest fields of the sidecars (Trajectory.clip_telemetry)
+        self.segments = []
+        self.status = "pending"
+        self.attempts = 0
+        self.error = None
+        self.wall_offset = time.time() - time.monotonic()
+        self.seconds = None     # ffmpeg time of the last attempt
+        self.start_offset = None    # Requested start - clip start (keyframe), seconds
+
+    def clip_times(self):
+        '''
+        Monotonic times of the first and last frame of the clip
+        '''
+        return self.start - (self.start_offset or 0), self.segments[-1].end
+
+    def duration(self):
+        if not self.segments:
+            return None
+        clip_start, clip_end = self.clip_times()
+        return clip_end - clip_start
+
+    def entry(self):
+        done = self.status == "done"
+        entry = {
+            "file": os.path.basename(self.output_file),
+            "path": self.output_file,
+            "status": self.status,
+            "bytes": os.path.getsize(self.output_file) if done else 0,
+            "duration": round(self.duration(), 2) if done and self.duration() else None,
+            "wave_start": round(self.wave_start + self.wall_offset, 3),
+            "wave_end": round(self.end + self.wall_offset, 3),
+            "gps": self.gps,
+            "segments": len(self.segments),
+            "attempts": self.attempts,
+            "clip_seconds": None if self.seconds is None else round(self.seconds, 3),
+            "start_offset": None if self.start_offset is None else round(self.start_offset, 3),
+            "delay": round(time.monotonic() - self.end, 2),     # Wave end to clip available
+            "error": self.error,
+        }
+        if done:
+            entry["upload"] = "pending"
+            entry.update(self.telemetry)
+        return entry
+
+    def record(self):
+        self.manifest.record(self.clip, **self.entry())
+
+class ClipWorkerPool():
+
+    def __init__(self, workers=CLIP_WORKERS, queue_size=QUEUE_SIZE):
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.finished = queue.Queue()
+        self.workers = workers
+        self.threads = []
+        self.running_jobs = 0
+        self.lock = threading.Lock()
+        self.run = False
+        self.stats = {"done": 0, "failed": 0, "dropped": 0, "retries": 0, "queue_full": 0,
+                      "last_clip_seconds": None, "last_start_offset": None, "telemetry_points": None}
+
+    def start(self):
+        self.run = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self.worker, daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        '''
+        Finish the queued jobs, then stop the workers
+        '''
+        self.jobs.join()
+        self.run = False
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def submit(self, job, block=False):
+        '''
+        Queue the job, False when the queue is full (the caller keeps it and tries later)
+        '''
+        try:
+            job.status = "queued"
+            self.jobs.put(job, block=block)
+            return True
+        except queue.Full:
+            job.status = "pending"
+            with self.lock:
+                self.stats["queue_full"] += 1
+            return False
+
+    def drop(self, job, reason):
+        job.status = "dropped"
+        job.error = reason
+        with self.lock:
+            self.stats["dropped"] += 1
+        print(f"Clip {job.output_file} dropped: {reason}")
+        job.record()
+
+    def telemetry(self, job):
+        if job.trajectory is None:
+            return
+        try:
+            clip_start, clip_end = job.clip_times()
+            job.telemetry = Trajectory.clip_telemetry(job.trajectory, job.output_file, clip_start, clip_end,
+                                                      job.wall_offset)
+            with self.lock:
+                self.stats["telemetry_points"] = job.telemetry["telemetry"]["points"]
+        except OSError as e:
+            print(f"Telemetry of {job.output_file} not written: {e}")
+
+    def results(self):
+        '''
+        Jobs finished (done or failed) since the last call
+        '''
+        jobs = []
+        while True:
+            try:
+                jobs.append(self.finished.get_nowait())
+            except queue.Empty:
+                return jobs
+
+    def getStats(self):
+        with self.lock:     # The counters are updated by the worker threads and the Camera thread
+            return dict(self.stats, queued=self.jobs.qsize(), running=self.running_jobs)
+
+    def worker(self):
+        while self.run:
+            try:
+                job = self.jobs.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            with self.lock:
+                self.running_jobs += 1
+            self.process(job)
+            with self.lock:
+                self.running_jobs -= 1
+            self.finished.put(job)
+            self.jobs.task_done()
+
+    def process(self, job):
+        while True:
+            job.status = "running"
+            job.attempts += 1
+            t = time.monotonic()
+            job.error, job.start_offset = SegmentRing.concat_segments(job.segments, job.output_file, start=job.start)
+            job.seconds = time.monotonic() - t
+            if job.error is None and os.path.exists(job.output_file) and os.path.getsize(job.output_file) > 0:
+                job.status = "done"
+                with self.lock:
+                    self.stats["done"] += 1
+                    self.stats["last_clip_seconds"] = round(job.seconds, 3)
+                    self.stats["last_start_offset"] = None if job.start_offset is None else round(job.start_offset, 3)
+                offset = "" if job.start_offset is None else f", starts {job.start_offset:+.3f} s before the pre-roll"
+                print(f"Clip saved to {job.output_file} ({len(job.segments)} segments in {job.seconds:.2f} s{offset})")
+                self.telemetry(job)
+                break
+            job.error = job.error or "empty clip"
+            if os.path.exists(job.output_file):
+                os.remove(job.output_file)
+            if job.attempts >= MAX_ATTEMPTS or not job.segments:
+                job.status = "failed"
+                with self.lock:
+                    self.stats["failed"] += 1
+                print(f"FFMPEG error while clipping {job.output_file}: {job.error}")
+                break
+            job.status = "retrying"
+            with self.lock:
+                self.stats["retries"] += 1
+            time.sleep(RETRY_DELAY)
+        job.record()
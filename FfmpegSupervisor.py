@@ -0,0 +1,204 @@
+import re
+import time
+import threading
+import subprocess
+from collections import deque
+
+'''
+Supervision of a long running ffmpeg child (recording, preview).
+
+Both outputs are drained continuously by threads, so ffmpeg never blocks on a full pipe. stdout carries the -progress
+key/values (frame, fps, bitrate, out_time_us, speed, total_size, about every 0.5 s), stderr the log, of which the last
+lines are kept for the error reports. When the owner reads the media from stdout (start(command, stdout=reader)),
+ffmpeg is given -progress pipe:2 and the reports are picked out of the log. check() (called from the owner's loop)
+kills the process when its output time stops advancing (frozen feed, dropped connection) or when its frame rate
+collapses, and the owner restarts it.
+'''
+
+START_TIMEOUT = 20      # Seconds to the first progress report (connection, first keyframe)
+STALL_TIMEOUT = 6       # Seconds without the output time advancing
+MIN_FPS = 5             # Frame rate (between reports) counted as collapsed...
+LOW_FPS_TIME = 15       # ...for this long
+STDERR_LINES = 20
+
+PROGRESS_LINE = re.compile(r"^[a-z_0-9]+=\S*$")
+_rtsp_options = None
+
+def rtsp_input_options():
+    '''
+    RTSP input options: TCP transport (no lost UDP packets on a busy link) and a socket timeout, so a dropped camera
+    ends ffmpeg instead of hanging it. The timeout option was renamed in ffmpeg 5 (stimeout -> timeout)
+    '''
+    global _rtsp_options
+    if _rtsp_options is None:
+        try:
+            result = subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=5)
+            match = re.search(r"ffmpeg version n?(\d+)\.", result.stdout.decode('utf-8', 'replace'))
+            major = int(match.group(1)) if match else 5
+        except (OSError, subprocess.TimeoutExpired):
+            major = 5
+        timeout = 'timeout' if major >= 5 else 'stimeout'
+        _rtsp_options = ['-rtsp_transport', 'tcp', f'-{timeout}', str(5 * 1000000)]
+    return list(_rtsp_options)
+
+def parse_number(value):
+    '''
+    "1234.5kbits/s", "1.01x", "25.0", "N/A" -> float or None
+    '''
+    match = re.match(r"\s*(-?[\d.]+)", value)
+    return float(match.group(1)) if match else None
+
+class FfmpegSupervisor():
+
+    def __init__(self, name, on_progress=None):
+        self.name = name
+        self.on_progress = on_progress    # Called from the reader thread with (monotonic_ns of the report, report)
+        self.process = None
+        self.stderr_lines = deque(maxlen=STDERR_LINES)
+        self.report = {}
+        self.started = 0
+        self.last_advance = 0
+        self.out_time = None
+        self.low_fps_since = None
+        self.fps = None
+        self.bitrate = None
+        self.state = "stopped"
+        self.progress_on_stderr = False
+        self.stats = {"restarts": 0, "stalls": 0, "starts": 0, "last_error": None}
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, command, stdout=None):
+        '''
+        stdout: None for -progress pipe:1, or a function reading the process stdout (called in its own thread), then
+        the command must have -progress pipe:2
+        '''
+        if self.process is not None:
+            self.stats["restarts"] += 1
+        self.stats["starts"] += 1
+        self.stderr_lines.clear()
+        self.report = {}
+        self.out_time = None
+        self.low_fps_since = None
+        self.fps = None
+        self.bitrate = None
+        self.started = time.monotonic()
+        self.last_advance = self.started
+        self.state = "starting"
+        self.progress_on_stderr = stdout is not None
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        threading.Thread(target=stdout or self.stdout_reader, args=(self.process,), daemon=True).start()
+        threading.Thread(target=self.stderr_reader, args=(self.process,), daemon=True).start()
+
+    def stop(self, timeout=2):
+        '''
+        Stop ffmpeg (SIGTERM lets it close its output), killed after timeout
+        '''
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+                print(f"{self.name}: ffmpeg forcefully stopped")
+        self.state = "stopped"
+
+    def stdout_reader(self, process):
+        report = {}
+        for line in process.stdout:
+            report = self.progress_line(process, report, line.decode('utf-8', 'replace').strip())
+
+    def stderr_reader(self, process):
+        report = {}
+        for line in process.stderr:
+            line = line.decode('utf-8', 'replace').rstrip()
+            if self.progress_on_stderr and PROGRESS_LINE.match(line):
+                report = self.progress_line(process, report, line)
+            elif line:
+                self.stderr_lines.append(line)
+
+    def progress_line(self, process, report, line):
+        '''
+        Adds a key=value line to the report being read, handled on its last line (progress=). Returns the report
+        '''
+        key, _, value = line.partition("=")
+        report[key] = value.strip()
+        if key != "progress":
+            return report
+        if process is self.process:
+            self.handle_report(time.monotonic_ns(), report)
+        return {}
+
+    def handle_report(self, now_ns, report):
+        now = now_ns / 1e9
+        out_time = parse_number(report.get("out_time_us", "N/A"))
+        frame = parse_number(report.get("frame", "N/A"))
+        previous = self.report
+        if out_time is not None and out_time > 0 and (self.out_time is None or out_time > self.out_time):
+            self.out_time = out_time
+            self.last_advance = now
+            if self.state == "starting":
+                self.state = "running"
+        # Rates between reports (the fps and bitrate ffmpeg prints are averages since the start)
+        if previous and frame is not None and previous.get("_frame") is not None and now > previous["_time"]:
+            self.fps = (frame - previous["_frame"]) / (now - previous["_time"])
+            size = parse_number(report.get("total_size", "N/A"))
+            if size is not None and previous.get("_size") is not None:
+                self.bitrate = 8 * (size - previous["_size"]) / (now - previous["_time"]) / 1000
+        report["_time"] = now
+        report["_frame"] = frame
+        report["_size"] = parse_number(report.get("total_size", "N/A"))
+        self.report = report
+        if self.on_progress:
+            self.on_progress(now_ns, report)
+
+    def check(self):
+        '''
+        Kills ffmpeg when it stalled or its frame rate collapsed. Returns False when it isn't running (anymore)
+        '''
+        if self.process is None or self.state == "stopped":
+            return False
+        if self.process.poll() is not None:
+            if self.state != "exited":
+                self.state = "exited"
+                self.stats["last_error"] = self.stderr_lines[-1] if self.stderr_lines else f"exit code {self.process.returncode}"
+                print(f"{self.name}: ffmpeg exited ({self.stats['last_error']})")
+            return False
+        now = time.monotonic()
+        reason = None
+        if self.state == "starting" and now - self.started > START_TIMEOUT:
+            reason = "no output after start"
+        elif self.state == "running" and now - self.last_advance > STALL_TIMEOUT:
+            reason = f"output time frozen for {now - self.last_advance:.0f} s"
+        elif self.state == "running" and self.fps is not None and self.fps < MIN_FPS:
+            self.low_fps_since = self.low_fps_since or now
+            if now - self.low_fps_since > LOW_FPS_TIME:
+                reason = f"frame rate collapsed ({self.fps:.1f} fps)"
+        else:
+            self.low_fps_since = None
+        if reason is None:
+            return True
+        print(f"{self.name}: ffmpeg stalled, {reason}")
+        self.stats["stalls"] += 1
+        self.stats["last_error"] = reason
+        self.state = "stalled"
+        self.process.kill()
+        self.process.wait()
+        return False
+
+    def getStats(self):
+        report = self.report
+        return dict(self.stats,
+                    state=self.state,
+                    uptime=round(time.monotonic() - self.started, 1) if self.running else 0,
+                    frame=report.get("frame"),
+                    fps=None if self.fps is None else round(self.fps, 1),
+                    bitrate_kbps=None if self.bitrate is None else round(self.bitrate),
+                    speed=report.get("speed"),
+                    out_time=None if self.out_time is None else round(self.out_time / 1e6, 1),
+                    seconds_since_progress=round(time.monotonic() - self.last_advance, 1) if self.running else None)
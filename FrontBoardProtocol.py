@@ -0,0 +1,220 @@
+import struct
+
+'''
+Frame encoding for the Front IO Board serial protocol.
+
+Frame structure: [0xff, 0xff, op_code, 0x00, data_length, data..., checksum_high, checksum_low]
+The checksum is the 16 bit sum of every byte after the two header bytes (op_code, length and data).
+
+FrameDecoder does the opposite on the receiving side, splitting the incoming byte stream into frames so that replies
+and unsolicited frames pushed by the board can be routed by op code.
+
+FrameEncoder writes frames into a single preallocated buffer, and keeps cached FrameTemplate's for the frames that
+are sent over and over again (goal velocity/position writes, present position reads, tracker polls) so that only the
+payload values are patched and the checksum is updated incrementally.
+'''
+
+OP_CODES = {
+    "Firmware":0x20,
+    "Dynamixel Write":0x50,
+    "Dynamixel Read":0x51,
+    "Group Dynamixel Write":0x56,
+    "Group Dynamixel Read":0x57,
+    "Bulk Dynamixel Read":0x58,
+    "Bulk Temperature Read":0x59,
+    "Set Shutdown":0x60,
+    "Get Shutdown&PushButton":0x61,
+    "Set BackPanel LEDs":0x62,
+    "Get Mac Address":0x63,
+    "Get Hall Status":0x64,
+    "Get Tracker Message":0x65,
+    "Start Tracker Pairing":0x66,
+    "Check Tracker Pairing":0x67,
+    "Cancel Current Pairing":0x68,
+    "Reboot both Dynamixel":0x69,
+    "Tracker Message Push":0x6A,      # Unsolicited, sent by the board when a new tracker fix arrives (push mode)
+    "Set Tracker Push Mode":0x6B,
+}
+
+HEADER_SIZE = 5     # 0xff, 0xff, op_code, length high, length low
+CHECKSUM_SIZE = 2
+MAX_DATA_LENGTH = 255
+MAX_FRAME_SIZE = HEADER_SIZE + MAX_DATA_LENGTH + CHECKSUM_SIZE
+
+HEADER = struct.Struct('>BBBBB')
+CHECKSUM = struct.Struct('>H')
+INT32 = struct.Struct('>i')                 # Dynamixel register values are sent MSB first
+DYNAMIXEL_ADDR = struct.Struct('>BH')       # ID, ADDR_H, ADDR_L
+DYNAMIXEL_WRITE = struct.Struct('>BHi')     # ID, ADDR_H, ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0
+
+# O(1) op code validation instead of scanning the op code dictionary
+VALID_OPS = bytearray(256)
+for _op in OP_CODES.values():
+    VALID_OPS[_op] = 1
+
+
+def frame_checksum(frame):
+    return sum(frame[2:-CHECKSUM_SIZE]) & 0xFFFF
+
+def build_frame(op_code, data=b''):
+    '''
+    Builds a standalone frame (new bytearray). Used for templates and by tools, the hot path goes through FrameEncoder
+    '''
+    if not 0 <= op_code < 256 or not VALID_OPS[op_code]:
+        raise Exception("build_frame()", "Incorrect op_code (received {})".format(op_code))
+    if len(data) > MAX_DATA_LENGTH:
+        raise Exception("build_frame()", "Data Length exceeded (received {})".format(len(data)))
+    frame = bytearray(HEADER_SIZE + len(data) + CHECKSUM_SIZE)
+    HEADER.pack_into(frame, 0, 0xff, 0xff, op_code, 0, len(data))
+    frame[HEADER_SIZE:HEADER_SIZE + len(data)] = data
+    CHECKSUM.pack_into(frame, len(frame) - CHECKSUM_SIZE, frame_checksum(frame))
+    return frame
+
+
+class FrameTemplate:
+    '''
+    A prebuilt frame where only some 32 bit register values change between sends.
+    patch() overwrites the values in place and updates the checksum with the difference of the patched bytes.
+    '''
+    def __init__(self, op_code, data, fields=()):
+        self.frame = build_frame(op_code, data)
+        self.view = memoryview(self.frame)
+        self.fields = tuple(HEADER_SIZE + offset for offset in fields)
+        self.checksum_offset = len(self.frame) - CHECKSUM_SIZE
+        self.checksum = sum(self.frame[2:self.checksum_offset])
+
+    def patch(self, *values):
+        frame = self.frame
+        checksum = self.checksum
+        for offset, value in zip(self.fields, values):
+            checksum -= frame[offset] + frame[offset + 1] + frame[offset + 2] + frame[offset + 3]
+            INT32.pack_into(frame, offset, value)
+            checksum += frame[offset] + frame[offset + 1] + frame[offset + 2] + frame[offset + 3]
+        self.checksum = checksum
+        CHECKSUM.pack_into(frame, self.checksum_offset, checksum & 0xFFFF)
+        return self.view
+
+
+class FrameEncoder:
+    '''
+    Encodes frames into a reusable buffer. The returned memoryviews are only valid until the next call,
+    they are meant to be written to the serial port straight away.
+    '''
+    def __init__(self):
+        self.buffer = bytearray(MAX_FRAME_SIZE)
+        self.view = memoryview(self.buffer)
+        self.write_templates = {}   # (ID, ADDR) -> FrameTemplate
+        self.group_templates = {}   # ((ID, ADDR), ...) -> FrameTemplate
+        self.read_frames = {}       # (ID, ADDR) -> constant frame
+        self.constant_frames = {}   # op_code -> constant frame with no data
+
+    def encode(self, op_code, data=b''):
+        length = len(data)
+        if not 0 <= op_code < 256 or not VALID_OPS[op_code]:
+            raise Exception("build_message()", "Incorrect op_code (received {})".format(op_code))
+        if length > MAX_DATA_LENGTH:
+            raise Exception("build_message()", "Data Length exceeded (received {})".format(length))
+        buffer = self.buffer
+        HEADER.pack_into(buffer, 0, 0xff, 0xff, op_code, 0, length)
+        end = HEADER_SIZE + length
+        buffer[HEADER_SIZE:end] = data
+        CHECKSUM.pack_into(buffer, end, (op_code + length + sum(data)) & 0xFFFF)
+        return self.view[:end + CHECKSUM_SIZE]
+
+    def constant(self, op_code):
+        ''' Frames without data, ex: the tracker message poll '''
+        frame = self.constant_frames.get(op_code)
+        if frame is None:
+            frame = self.constant_frames[op_code] = memoryview(build_frame(op_code))
+        return frame
+
+    def dynamixel_write(self, ID, ADDR, value):
+        template = self.write_templates.get((ID, ADDR))
+        if template is None:
+            template = FrameTemplate(OP_CODES["Dynamixel Write"], DYNAMIXEL_WRITE.pack(ID, ADDR, 0), fields=(3,))
+            self.write_templates[(ID, ADDR)] = template
+        return template.patch(value)
+
+    def dynamixel_read(self, ID, ADDR):
+        frame = self.read_frames.get((ID, ADDR))
+        if frame is None:
+            frame = self.read_frames[(ID, ADDR)] = memoryview(build_frame(OP_CODES["Dynamixel Read"], DYNAMIXEL_ADDR.pack(ID, ADDR)))
+        return frame
+
+    def group_write(self, registers, values):
+        '''
+        registers: tuple of (ID, ADDR) pairs, values: the 32 bit value to write to each of them
+        '''
+        template = self.group_templates.get(registers)
+        if template is None:
+            data = bytearray([len(registers)])
+            for ID, ADDR in registers:
+                data += DYNAMIXEL_WRITE.pack(ID, ADDR, 0)
+            fields = tuple(1 + i * DYNAMIXEL_WRITE.size + 3 for i in range(len(registers)))
+            template = FrameTemplate(OP_CODES["Group Dynamixel Write"], data, fields=fields)
+            self.group_templates[registers] = template
+        return template.patch(*values)
+
+    def group_read(self, registers):
+        data = bytearray([len(registers)])
+        for ID, ADDR in registers:
+            data += DYNAMIXEL_ADDR.pack(ID, ADDR)
+        return self.encode(OP_CODES["Group Dynamixel Read"], data)
+
+
+class FrameDecoder:
+    '''
+    Incremental frame parser. feed() the bytes read from the serial port and take complete frames out with next_frame().
+    Bytes that don't start a valid frame (noise, frames with a bad checksum) are skipped so the stream resyncs by itself.
+    '''
+    def __init__(self):
+        self.buffer = bytearray()
+        self.checksum_errors = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def pending(self):
+        return len(self.buffer)
+
+    def clear(self):
+        self.skipped_bytes += len(self.buffer)
+        self.buffer.clear()
+
+    def next_frame(self):
+        '''
+        Returns (op_code, body) for the next complete frame or None if more bytes are needed.
+        body is [data_length, data...], the same as IOBoardDriver.read_message() returns.
+        '''
+        buffer = self.buffer
+        while True:
+            start = buffer.find(b'\xff\xff')
+            if start < 0:
+                keep = 1 if buffer[-1:] == b'\xff' else 0
+                self.skipped_bytes += len(buffer) - keep
+                del buffer[:len(buffer) - keep]
+                return None
+            if start:
+                self.skipped_bytes += start
+                del buffer[:start]
+            if len(buffer) < HEADER_SIZE:
+                return None
+            op_code = buffer[2]
+            length = buffer[4]
+            total = HEADER_SIZE + length + CHECKSUM_SIZE
+            if not VALID_OPS[op_code] or buffer[3] != 0:
+                self.skipped_bytes += 1
+                del buffer[:1]
+                continue
+            if len(buffer) < total:
+                return None
+            checksum = (buffer[total - 2] << 8) | buffer[total - 1]
+            if sum(buffer[2:total - CHECKSUM_SIZE]) & 0xFFFF != checksum:
+                self.checksum_errors += 1
+                self.skipped_bytes += 1
+                del buffer[:1]
+                continue
+            body = bytes(buffer[4:total - CHECKSUM_SIZE])
+            del buffer[:total]
+            return op_code, body
@@ -1,6 +1,8 @@
 import db
+import FrontBoardProtocol
 import serial
 import time
+from collections import deque
 from serial.tools import list_ports
 
 
@@ -19,36 +21,55 @@ DEG_PULSE = 0.088 # 360 degrees is 4096 pulses, so 1 degree is 11.37777 pulses
 # This is due to the camera assembly onto the motor.
 TILT_OFFSET = 0 # Empyrical offset to get mechanical 0 closer to real 0: manual calibration is stil needed through control panel  
 
+# Servo configuration applied at start up, in one group write. EEPROM registers (drive mode) go before torque on.
+CONFIG_REGISTERS = (
+    (1, 10), (2, 10),               # Drive mode: tilt time based profile, pan velocity based profile
+    (1, 84), (1, 82), (1, 80),      # Tilt P, I, D
+    (1, 108),                       # Tilt profile acceleration
+    (1, 64), (2, 64),               # Torque ON
+)
+CONFIG_VALUES = (1, 0, 1000, 200, 800, 20, 1, 1)
+GOAL_REGISTERS = (
+    (1, 112), (1, 116),             # Tilt profile velocity and goal position (0 degrees), only at start up
+)
+
+# Frames that command servo motion, used for the fix to command latency measurement
+MOTION_OPS = (FrontBoardProtocol.OP_CODES["Dynamixel Write"], FrontBoardProtocol.OP_CODES["Group Dynamixel Write"])
+
 def get_op_codes():
         '''
         Returns a dictionary with different possible operations to ESP32 and respective code ex: 'Firmware':0x20
         '''
-        return {
-            "Firmware":0x20,
-            "Dynamixel Write":0x50,
-            "Dynamixel Read":0x51,
-            "Group Dynamixel Write":0x56,
-            "Group Dynamixel Read":0x57,
-            "Bulk Dynamixel Read":0x58,
-            "Bulk Temperature Read":0x59,
-            "Set Shutdown":0x60,
-            "Get Shutdown&PushButton":0x61,
-            "Set BackPanel LEDs":0x62,
-            "Get Mac Address":0x63,
-            "Get Hall Status":0x64,
-            "Get Tracker Message":0x65,
-            "Start Tracker Pairing":0x66,
-            "Check Tracker Pairing":0x67,
-            "Cancel Current Pairing":0x68,
-            "Reboot both Dynamixel":0x69,
-        }
+        return dict(FrontBoardProtocol.OP_CODES)
 
 class FrontBoardDriver:
-    def __init__(self):
+    def __init__(self, port=None):
+        '''
+        port: optional device path (ex: the pty of test_setup/frontboard_emulator.py). When not given, 
+        the serial ports are scanned for the "Surf Front Board" device
+        '''
         conn = db.get_connection()
         self.gps_points = db.GPSData(conn)
+        self.webapp = db.WebApp(conn)
+        self.commands = db.Commands(conn)
         self.command_codes = get_op_codes()
+        self.encoder = FrontBoardProtocol.FrameEncoder()
+        self.decoder = FrontBoardProtocol.FrameDecoder()
+        
+        self.tracker_push = False               # Set by enableTrackerPush() when the firmware supports pushed tracker frames
+        self.tracker_queue = deque(maxlen=32)   # Pushed fixes: (board_time_ms, host_time, lat, lon)
+        self.last_push_time = 0
+        self.last_fallback_poll = 0
+        self.pending_fix_time = None            # Host time of the latest delivered fix not yet followed by a motion command
+        self.timed_out_ops = {}                 # Op code -> requests that timed out, whose late replies may still arrive
+        self.link_stats = {"transactions": 0, "tracker_transactions": 0, "fixes": 0, "stale_frames": 0,
+                           "fix_to_command_count": 0, "fix_to_command_total": 0.0, "fix_to_command_max": 0.0}
+        self.health = LinkHealth(self)
+        self.current_pan_mode = ""
         connected = False
+        if port:
+            self.serial = serial.Serial(port, baudrate=1000000, timeout=2.0)
+            connected = True
         while not connected:
             ports = serial.tools.list_ports.comports()
             print("Searching for GPIO Front Board ")
@@ -62,17 +83,12 @@ class FrontBoardDriver:
                         print(f"Connection error: {e}")
             time.sleep(0.1)
         
+        self.webapp.clear_error("frontboard_link")
         self.setBackPanelLEDs(False, False)
-        self.dynamixelWrite(1, 10, 1)
-        self.dynamixelWrite(2, 10, 0)    # Pan drive mode to velocity profile 
-        self.setTiltPID(1000, 200, 800)
-        self.dynamixelWrite(1, 108, 20) # Set Tilt profile acceleration 
-        self.turnOnTorque()
-        self.setTiltAngle(0, 1) 
-        time.sleep(1)
+        self.applyServoConfig()
         
-        self.PanCenterPulse = self.dynamixelRead(2, 132) 
-        self.current_pan_mode = ""
+        # Provisional reference until the pan center calibration runs (deferred, started by the tracking process)
+        self.PanCenterPulse = self.dynamixelRead(2, 132) or 0
         
         self.tiltIntendedPlayTime = 0.75
         self.panIntendedPlayTime = 0.5 # How much time we want each pan movement to take  
@@ -80,7 +96,7 @@ class FrontBoardDriver:
         self.lastLat = 0
         self.lastLon = 0
         
-        self.calibratePanCenter()
+        self.enableTrackerPush()
         
     def send_message(self, msg):
         """
@@ -96,85 +112,82 @@ class FrontBoardDriver:
         
         return True
     
-    def parsing_message(self):
+    def read_frame(self, deadline=None):
         """
-            Reads serial port data and parses the returned message
-            Returns: [0xff ,0xff ,op_code ,data_lenght ,data ,high_value ,low_value]
-            Receives: 
+            Reads serial port data until the frame decoder has a complete frame
+            Returns: (op_code, [data_lenght ,data])
         """
-        header = self.serial.read(2)                              # HEADERS (0xff, 0xff)
-        
-        if len(header) < 2 or header[:2] != b'\xff\xff' :         # Check if header corresponds to expected
-            err_msg = "Error with headers {}".format(header)
-            raise Exception("parsing_message()", err_msg)
-        
-        op_code = self.serial.read(1)                             #OP_CODE  
-
-        data_len = self.serial.read(2)                            #DATA_LENGTH      
-        if data_len[1] > 255:
-            err_msg = "Data Length exceeded (received {})".format(data_len)
-            raise Exception("parsing_message()", err_msg)
-                
-        if data_len[1] > 0:
-            data = self.serial.read(data_len[1])                  #DATA    
-
-        high_value = self.serial.read(1)                          #MSB
-        low_value = self.serial.read(1)                           #LSB   
-
-        if data_len[1] > 0:
-            read_message = header + op_code + data_len + data + high_value + low_value
-
-        else:
-            read_message = header + op_code + data_len + high_value + low_value
-
-        return read_message
+        if deadline is None:
+            deadline = time.time() + self.serial.timeout
+        while True:
+            frame = self.decoder.next_frame()
+            if frame:
+                return frame
+            if time.time() >= deadline:
+                err_msg = "Timeout waiting for response ({} bytes pending)".format(self.decoder.pending())
+                raise TimeoutError("read_frame()", err_msg)
+            chunk = self.serial.read(max(1, self.serial.in_waiting))
+            if chunk:
+                self.decoder.feed(chunk)
  
     def read_message(self, msg):
         """
-            Verifies if the parsed message is valid and returns just the data portion 
+            Reads frames until the response to msg arrives and returns just the data portion.
+            Tracker frames pushed by the board in the meantime are routed to the tracker queue.
             Returns: [data]
-            Receives: [read_message] 
+            Receives: [msg] the request that was sent
         """
-        cmd_buffer = self.parsing_message()
+        deadline = time.time() + self.serial.timeout    # For the whole exchange: pushed frames don't extend it
+        while True:
+            try:
+                op_code, body = self.read_frame(deadline)
+            except TimeoutError:
+                self.timed_out_ops[msg[2]] = self.timed_out_ops.get(msg[2], 0) + 1
+                raise
+            if op_code == self.command_codes["Tracker Message Push"]:
+                self.handlePushedTracker(body)
+            elif op_code != msg[2] and self.discard_late_reply(op_code):
+                pass
+            else:
+                # Only a frame matching an earlier timed out request is skipped: that the board echoes the request
+                # op code in every reply is only confirmed by the emulator
+                return body
 
-        checksum = int.from_bytes((cmd_buffer[-2:]))
-        bytesum = sum(cmd_buffer[2:-2])
-        
-        if sum(cmd_buffer[:2]) == sum(msg[:2]) and bytesum == checksum:
-            return cmd_buffer[4:-2]    # [data]
-        else: 
-            err_msg = "Error with response validity {}".format(cmd_buffer)
-            raise Exception("read_message()", err_msg)
+    def discard_late_reply(self, op_code):
+        """
+            True (and counted as stale) when op_code is the one of an earlier request that timed out
+        """
+        if not self.timed_out_ops.get(op_code):
+            return False
+        self.timed_out_ops[op_code] -= 1
+        self.link_stats["stale_frames"] += 1
+        return True
         
-    def build_message(self, op_code, data=[ ]):
+    def pollPushedFrames(self):
+        """
+            Non blocking: decodes whatever is already in the serial input buffer, outside of any transaction
+        """
+        waiting = self.serial.in_waiting
+        if waiting:
+            self.decoder.feed(self.serial.read(waiting))
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is None:
+                return
+            op_code, body = frame
+            if op_code == self.command_codes["Tracker Message Push"]:
+                self.handlePushedTracker(body)
+            elif not self.discard_late_reply(op_code):
+                self.link_stats["stale_frames"] += 1    # Unsolicited, outside of any transaction
+        
+    def build_message(self, op_code, data=b''):
         """
             Build a Message Respecting Communication Protocol with the Board
             Sending Message Structure: [0xff ,0xff ,op_code ,data_lenght ,data ,high_chksum ,low_chksum]
             Receiving Message Structure: [op_code][data]
+            The message is written into the encoder's reusable buffer and is only valid until the next build
         """
-        msg = [0xff, 0xff]
-        
-        if op_code not in self.command_codes.values():
-            err_msg = "Incorrect op_code (received {})".format(op_code)
-            raise Exception("build_message()", err_msg)
-        
-        if len(data) > 255:
-            err_msg = "Data Length exceeded (received {})".format(len(data))
-            raise Exception("build_message()", err_msg)
-
-        msg.append(op_code)
-        msg.append(0) # high byte is always 0
-        msg.append(len(data))
-
-        for d in data:
-            msg.append(d)
-
-        chk = sum(msg[2:])
-        chk_low = chk & 0xff
-        chk_high = (chk >> 8) & 0xff
-        msg.append(chk_high)
-        msg.append(chk_low)
-        return msg   
+        return self.encoder.encode(op_code, data)
         
     def bsr_message(self, op_code, data):
         """
@@ -184,11 +197,28 @@ class FrontBoardDriver:
         """
         try:
             msg = self.build_message(op_code, data)
+        except Exception as e:
+            print(f"Error in comm with front board {e} ")
+            return None
+        return self.bsr_frame(msg)
+    
+    def bsr_frame(self, msg):
+        """
+            Send a pre-built frame (see FrontBoardProtocol.FrameEncoder) and Read the response
+        """
+        try:
+            self.link_stats["transactions"] += 1
+            if self.pending_fix_time is not None and msg[2] in MOTION_OPS:
+                self.recordFixToCommand()
             self.send_message(msg)
-            time.sleep(0.01)
             read_msg = self.read_message(msg)
+            self.health.record_success()
             return read_msg
+        except TimeoutError as e:
+            self.health.record_failure("timeout")
+            print(f"Error in comm with front board {e} ")
         except Exception as e:
+            self.health.record_failure("error")
             print(f"Error in comm with front board {e} ")
         
     def getFirmware(self):
@@ -206,6 +236,8 @@ class FrontBoardDriver:
         
     def getShutdownState(self):
         response = self.bsr_message(self.command_codes["Get Shutdown&PushButton"], [])
+        if not response:
+            return None
         msg = int.from_bytes(response, byteorder='big')
         # Extracting the last 2 bits
         last_2_bits = msg & 0b11
@@ -218,11 +250,13 @@ class FrontBoardDriver:
     
     def setShutdown(self, seconds=15):
         bytes_val = seconds.to_bytes(2, 'little') 
-        self.bsr_message(self.command_codes["Set Shutdown"], [bytes_val])
+        self.bsr_message(self.command_codes["Set Shutdown"], bytes_val)
         time.sleep(0.05)
         
     def bulkReadTemp(self):
         response = self.bsr_message(self.command_codes["Bulk Temperature Read"], [0x00])
+        if not response or len(response) < 7:
+            return None
         nReadings = response[0]
         IDTILT = response[1]
         ERRORTILT = response[2]
@@ -230,12 +264,16 @@ class FrontBoardDriver:
         IDPAN = response[4]
         ERRORPAN = response[5]
         TEMPPAN = response[6]
+        self.health.record_servo_error(IDTILT, ERRORTILT)
+        self.health.record_servo_error(IDPAN, ERRORPAN)
         print(f"Motor {IDTILT} has {ERRORTILT} errors and Temp {TEMPTILT} C")
         print(f"Motor {IDPAN} has {ERRORPAN} errors and Temp {TEMPPAN} C")
         return TEMPTILT, TEMPPAN
         
     def bulkReadPosVel(self):
         response = self.bsr_message(self.command_codes["Bulk Dynamixel Read"], [0x00])
+        if not response or len(response) < 13:
+            return None
         nLen = response[0]
         IDTILT = response[1]
         ERRORTILT = response[2]
@@ -263,94 +301,55 @@ class FrontBoardDriver:
         bytelist = [panvel_h, panvel_l]
         panvel_int = int.from_bytes(bytearray(bytelist), "big")
         
+        self.health.record_servo_error(IDTILT, ERRORTILT)
+        self.health.record_servo_error(IDPAN, ERRORPAN)
         return tiltpos_int, tiltvel_int, panpos_int, panvel_int        
         
     def dynamixelRead(self, ID,  ADDR):
-        ADDR_bytes = ADDR.to_bytes(2, byteorder="little")
-        ADDR_H = ADDR_bytes[1]
-        ADDR_L = ADDR_bytes[0]
-        data2send = bytearray([ID, ADDR_H, ADDR_L])
-        response = self.bsr_message(self.command_codes["Dynamixel Read"], data2send)
+        '''
+        Reads a 4 byte register, None when the read fails.
+        Reply: [data length] ... [4 bytes value, MSB first]. The firmware protocol only gives the value as the last 4
+        bytes of the reply (read that way since the first driver). The [data length, ID, error, value] layout, with the
+        servo status like the bulk read replies, comes from the emulator and isn't confirmed on the hardware yet: the
+        servo error is only taken from a reply of exactly that length whose ID byte is the one requested.
+        '''
+        response = self.bsr_frame(self.encoder.dynamixel_read(ID, ADDR))
+        if not response or len(response) < 5:
+            return None
+        if len(response) == 7 and response[1] == ID:
+            self.health.record_servo_error(ID, response[2])
         
         data_bytes = response[-4:]
         result = int.from_bytes(data_bytes, byteorder='big', signed=True)
         return result
         
     def dynamixelWrite(self, ID, ADDR, data):
-        ADDR_bytes = ADDR.to_bytes(2, byteorder="little")
-        ADDR_H = ADDR_bytes[1]
-        ADDR_L = ADDR_bytes[0]
-        
-        data_bytes = data.to_bytes(4, byteorder='little', signed=True)
-        # Extract Data bytes
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
+        response = self.bsr_frame(self.encoder.dynamixel_write(ID, ADDR, data))
         
-        data2send = bytearray([ID, ADDR_H, ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        response = self.bsr_message(self.command_codes["Dynamixel Write"], data2send)
+    def groupDynamixelWrite(self, registers, values):
+        '''
+        Writes values[i] to the registers[i] = (ID, ADDR) pair, all in one message
+        '''
+        return self.bsr_frame(self.encoder.group_write(registers, values))
+    
+    def groupDynamixelRead(self, registers):
+        '''
+        Reads the registers = ((ID, ADDR), ...) in one message. Returns [NCOMMANDS, 4 bytes per register (MSB first)]
+        '''
+        return self.bsr_frame(self.encoder.group_read(registers))
         
     def turnOnTorque(self):
-        ID1 = 0x01
-        ID2 = 0x02
-        
-        ADDR = 64
-        data = 1
-        
-        ADDR_bytes = ADDR.to_bytes(2, byteorder="little")
-        ADDR_H = ADDR_bytes[1]
-        ADDR_L = ADDR_bytes[0]
-        
-        data_bytes = data.to_bytes(4, byteorder='little')
-        # Extract Data bytes
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
-        
-        NCOMMANDS = 2
-        
-        data2send = bytearray([NCOMMANDS, ID1, ADDR_H, ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0, ID2, ADDR_H, ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        response = self.bsr_message(self.command_codes["Group Dynamixel Write"], data2send)
+        response = self.groupDynamixelWrite(((1, 64), (2, 64)), (1, 1))
         #print("Torque Turned ON on both Axis")
         
     def turnOffTorque(self):
-        ID1 = 0x01
-        ID2 = 0x02
-        
-        ADDR = 64
-        data = 0
-        
-        ADDR_bytes = ADDR.to_bytes(2, byteorder="little")
-        ADDR_H = ADDR_bytes[1]
-        ADDR_L = ADDR_bytes[0]
-        
-        data_bytes = data.to_bytes(4, byteorder='little')
-        # Extract Data bytes
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
-        
-        data2send = bytearray([2, ID1, ADDR_H, ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0, ID2, ADDR_H, ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        response = self.bsr_message(self.command_codes["Group Dynamixel Write"], data2send)
+        response = self.groupDynamixelWrite(((1, 64), (2, 64)), (0, 0))
         #print("Torque Turned OFF on both Axis")
         
     def getPanPID(self):
-        ADDR = [80, 82, 84]
-        NCOMMANDS = 3
-        ID = 2
-        msg = [NCOMMANDS]
-        
-        for addr in ADDR:
-            ADDR_bytes = addr.to_bytes(2, byteorder="little")
-            ADDR_H = ADDR_bytes[1]
-            ADDR_L = ADDR_bytes[0]
-            msg.extend([ID, ADDR_H, ADDR_L])
-            
-        data2send = bytearray(msg)
-        response = self.bsr_message(self.command_codes["Group Dynamixel Read"], data2send)
+        response = self.groupDynamixelRead(((2, 80), (2, 82), (2, 84)))
+        if not response:
+            return None
         
         D = int.from_bytes(response[1:5], byteorder='big')
         I = int.from_bytes(response[5:9], byteorder='big')
@@ -362,19 +361,9 @@ class FrontBoardDriver:
         return P, I, D
     
     def getPanVelocityPI(self):
-        ADDR = [76, 78]
-        NCOMMANDS = 2
-        ID = 2
-        msg = [NCOMMANDS]
-        
-        for addr in ADDR:
-            ADDR_bytes = addr.to_bytes(2, byteorder="little")
-            ADDR_H = ADDR_bytes[1]
-            ADDR_L = ADDR_bytes[0]
-            msg.extend([ID, ADDR_H, ADDR_L])
-            
-        data2send = bytearray(msg)
-        response = self.bsr_message(self.command_codes["Group Dynamixel Read"], data2send)
+        response = self.groupDynamixelRead(((2, 76), (2, 78)))
+        if not response:
+            return None
         
         I = int.from_bytes(response[1:5], byteorder='big')
         P = int.from_bytes(response[5:9], byteorder='big')
@@ -385,19 +374,9 @@ class FrontBoardDriver:
         return P, I
     
     def getTiltPID(self):
-        ADDR = [80, 82, 84]
-        NCOMMANDS = 3
-        ID = 1
-        msg = [NCOMMANDS]
-        
-        for addr in ADDR:
-            ADDR_bytes = addr.to_bytes(2, byteorder="little")
-            ADDR_H = ADDR_bytes[1]
-            ADDR_L = ADDR_bytes[0]
-            msg.extend([ID, ADDR_H, ADDR_L])
-            
-        data2send = bytearray(msg)
-        response = self.bsr_message(self.command_codes["Group Dynamixel Read"], data2send)
+        response = self.groupDynamixelRead(((1, 80), (1, 82), (1, 84)))
+        if not response:
+            return None
         
         D = int.from_bytes(response[1:5], byteorder='big')
         I = int.from_bytes(response[5:9], byteorder='big')
@@ -409,185 +388,39 @@ class FrontBoardDriver:
         return P, I, D
             
     def setPanPID(self, P, I, D):
-        ID = 2
-        NCOMMANDS = 3
-        msg = [NCOMMANDS]
-        
-        ADDR = [84, 82, 80]
-        
-        P_ADDR_BYTES = ADDR[0].to_bytes(2, byteorder="little")
-        P_ADDR_H = P_ADDR_BYTES[1]
-        P_ADDR_L = P_ADDR_BYTES[0]
-        data_bytes = P.to_bytes(4, byteorder="little")
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
-        msg.extend([ID, P_ADDR_H, P_ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        
-        I_ADDR_BYTES = ADDR[1].to_bytes(2, byteorder="little")
-        I_ADDR_H = I_ADDR_BYTES[1]
-        I_ADDR_L = I_ADDR_BYTES[0]
-        data_bytes = I.to_bytes(4, byteorder="little")
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
-        msg.extend([ID, I_ADDR_H, I_ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        
-        D_ADDR_BYTES = ADDR[2].to_bytes(2, byteorder="little")
-        D_ADDR_H = D_ADDR_BYTES[1]
-        D_ADDR_L = D_ADDR_BYTES[0]
-        data_bytes = D.to_bytes(4, byteorder="little")
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
-        msg.extend([ID, D_ADDR_H, D_ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        
-        data2send = bytearray(msg)
-        response = self.bsr_message(self.command_codes["Group Dynamixel Write"], data2send)
+        response = self.groupDynamixelWrite(((2, 84), (2, 82), (2, 80)), (P, I, D))
         #print("Pan PID Parameters Updated")
         
     def setPanVelocityPI(self, P, I):
-        ID = 2
-        NCOMMANDS = 2
-        msg = [NCOMMANDS]
-        
-        ADDR = [78, 76]
-        
-        P_ADDR_BYTES = ADDR[0].to_bytes(2, byteorder="little")
-        P_ADDR_H = P_ADDR_BYTES[1]
-        P_ADDR_L = P_ADDR_BYTES[0]
-        data_bytes = P.to_bytes(4, byteorder="little")
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
-        msg.extend([ID, P_ADDR_H, P_ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        
-        I_ADDR_BYTES = ADDR[1].to_bytes(2, byteorder="little")
-        I_ADDR_H = I_ADDR_BYTES[1]
-        I_ADDR_L = I_ADDR_BYTES[0]
-        data_bytes = I.to_bytes(4, byteorder="little")
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
-        msg.extend([ID, I_ADDR_H, I_ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        
-        data2send = bytearray(msg)
-        response = self.bsr_message(self.command_codes["Group Dynamixel Write"], data2send)
+        response = self.groupDynamixelWrite(((2, 78), (2, 76)), (P, I))
         #print("Pan PID Parameters Updated")
 
     def setTiltPID(self, P, I, D):
-        ID = 1
-        NCOMMANDS = 3
-        msg = [NCOMMANDS]
-        
-        ADDR = [84, 82, 80]
-        
-        P_ADDR_BYTES = ADDR[0].to_bytes(2, byteorder="little")
-        P_ADDR_H = P_ADDR_BYTES[1]
-        P_ADDR_L = P_ADDR_BYTES[0]
-        data_bytes = P.to_bytes(4, byteorder="little")
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
-        msg.extend([ID, P_ADDR_H, P_ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        
-        I_ADDR_BYTES = ADDR[1].to_bytes(2, byteorder="little")
-        I_ADDR_H = I_ADDR_BYTES[1]
-        I_ADDR_L = I_ADDR_BYTES[0]
-        data_bytes = I.to_bytes(4, byteorder="little")
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
-        msg.extend([ID, I_ADDR_H, I_ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        
-        D_ADDR_BYTES = ADDR[2].to_bytes(2, byteorder="little")
-        D_ADDR_H = D_ADDR_BYTES[1]
-        D_ADDR_L = D_ADDR_BYTES[0]
-        data_bytes = D.to_bytes(4, byteorder="little")
-        data_31_24 = data_bytes[3]
-        data_23_16 = data_bytes[2]
-        data_15_8 = data_bytes[1]
-        data_7_0 = data_bytes[0]
-        msg.extend([ID, D_ADDR_H, D_ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-        
-        data2send = bytearray(msg)
-        response = self.bsr_message(self.command_codes["Group Dynamixel Write"], data2send)
+        response = self.groupDynamixelWrite(((1, 84), (1, 82), (1, 80)), (P, I, D))
         #print("Tilt PID Parameters Updated")
         
     def int_to_signed_bytes(self, value, length):
-        # Check if the integer is negative
-        if value < 0:
-            # Calculate the two's complement of the negative number
-            value = (1 << (length * 8)) + value
-        return value.to_bytes(length, byteorder='little')
+        # Two's complement for negative numbers, plain unsigned bytes otherwise
+        return (value % (1 << (length * 8))).to_bytes(length, byteorder='little')
 
     def groupDynamixelSetPosition(self, tiltpos=None, tiltvel=None, panpos=None, panvel=None):
-        NCOMMANDS = 0
-        msg = []
+        registers = []
+        values = []
         if tiltpos:
-            ID = 1
-            ADDR = 116
-            ADDR_BYTES = ADDR.to_bytes(2, byteorder="little")
-            ADDR_H = ADDR_BYTES[1]
-            ADDR_L = ADDR_BYTES[0]
-            data_bytes = tiltpos.to_bytes(4, byteorder="little")
-            data_31_24 = data_bytes[3]
-            data_23_16 = data_bytes[2]
-            data_15_8 = data_bytes[1]
-            data_7_0 = data_bytes[0]
-            msg.extend([ID, ADDR_H, ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-            NCOMMANDS += 1
+            registers.append((1, 116))
+            values.append(tiltpos)
         if tiltvel:
-            ID = 1
-            ADDR = 112
-            ADDR_BYTES = ADDR.to_bytes(2, byteorder="little")
-            ADDR_H = ADDR_BYTES[1]
-            ADDR_L = ADDR_BYTES[0]
-            data_bytes = tiltvel.to_bytes(4, byteorder="little")
-            data_31_24 = data_bytes[3]
-            data_23_16 = data_bytes[2]
-            data_15_8 = data_bytes[1]
-            data_7_0 = data_bytes[0]
-            msg.extend([ID, ADDR_H, ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-            NCOMMANDS += 1
+            registers.append((1, 112))
+            values.append(tiltvel)
         if panpos:
-            ID = 2
-            ADDR = 116
-            ADDR_BYTES = ADDR.to_bytes(2, byteorder="little")
-            ADDR_H = ADDR_BYTES[1]
-            ADDR_L = ADDR_BYTES[0]
-            data_bytes = panpos.to_bytes(4, byteorder="little", signed=True)
-            data_31_24 = data_bytes[3]
-            data_23_16 = data_bytes[2]
-            data_15_8 = data_bytes[1]
-            data_7_0 = data_bytes[0]
-            msg.extend([ID, ADDR_H, ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-            NCOMMANDS += 1
+            registers.append((2, 116))
+            values.append(panpos)
         if panvel:
-            ID = 2
-            ADDR = 112
-            ADDR_BYTES = ADDR.to_bytes(2, byteorder="little")
-            ADDR_H = ADDR_BYTES[1]
-            ADDR_L = ADDR_BYTES[0]
-            data_bytes = panvel.to_bytes(4, byteorder="little")
-            data_31_24 = data_bytes[3]
-            data_23_16 = data_bytes[2]
-            data_15_8 = data_bytes[1]
-            data_7_0 = data_bytes[0]
-            msg.extend([ID, ADDR_H, ADDR_L, data_31_24, data_23_16, data_15_8, data_7_0])
-            NCOMMANDS += 1
+            registers.append((2, 112))
+            values.append(panvel)
             
-        if NCOMMANDS > 0:
-            msg.insert(0, NCOMMANDS)
-            data2send = bytearray(msg)
-            response = self.bsr_message(self.command_codes["Group Dynamixel Write"], data2send)
+        if registers:
+            response = self.groupDynamixelWrite(tuple(registers), values)
         else:
             return
 
@@ -679,10 +512,16 @@ class FrontBoardDriver:
         self.dynamixelWrite(2, 104, dyna_val)    # Set Goal Velocity (104)
         
     def getCurrentPanAngle(self):
+        '''
+        On a failed read the last known angle is returned, so the control loop keeps going while the link recovers
+        '''
         currentpulse = self.dynamixelRead(2, 132) 
+        if currentpulse is None:
+            return getattr(self, "lastPanAngle", 0)
         dif = currentpulse - self.PanCenterPulse
         angle = dif * 90 / 1024 / 40
-        return round(angle, 2)
+        self.lastPanAngle = round(angle, 2)
+        return self.lastPanAngle
         
     def getMacAddress(self):
         return self.bsr_message(0x63, [])
@@ -691,23 +530,93 @@ class FrontBoardDriver:
         return self.bsr_message(0x64, [])
     
     def getTrackerMessage(self):
-        response = self.bsr_message(0x65, [])
+        '''
+        Returns 1 if a new valid tracker fix was stored in gps_points.latest_gps_data, 0 otherwise.
+        In push mode the fixes pushed by the board are taken from the queue without any serial transaction
+        (with a slow poll as a safety net if pushes stop). Otherwise the board is polled.
+        '''
+        if self.tracker_push:
+            self.pollPushedFrames()
+            if self.tracker_queue:
+                _, _, lat, lon = self.tracker_queue[-1]   # Only the most recent fix matters
+                self.tracker_queue.clear()
+                return self.storeTrackerFix(lat, lon)
+            if time.time() - self.last_push_time < 2 or time.time() - self.last_fallback_poll < 1:
+                return 0
+            self.last_fallback_poll = time.time()
+            
+        self.link_stats["tracker_transactions"] += 1
+        response = self.bsr_frame(self.encoder.constant(self.command_codes["Get Tracker Message"]))
         if not response:
             return 0
         if response[0] == 0x08:
             print(response)
             lat = int.from_bytes(response[1:5], byteorder='little', signed=True) / 10000000 # Coordinates are sent with a scale factor to eliminate decimal places to reduce the nr of bytes
             lon = int.from_bytes(response[5:9], byteorder='little', signed=True) / 10000000
-            if self.isValidGPSData(lat, lon):
-                if lat != self.lastLat or lon != self.lastLon:
-                    position = {"latitude": float(lat), "longitude": float(lon)}
-                    self.gps_points.latest_gps_data = position
-                    self.lastLat = lat
-                    self.lastLon = lon
-                    return 1
+            return self.storeTrackerFix(lat, lon)
         else:
             # No valid GPS data
             return 0
+        
+    def storeTrackerFix(self, lat, lon):
+        if self.isValidGPSData(lat, lon):
+            if lat != self.lastLat or lon != self.lastLon:
+                position = {"latitude": float(lat), "longitude": float(lon)}
+                self.gps_points.latest_gps_data = position
+                self.lastLat = lat
+                self.lastLon = lon
+                self.link_stats["fixes"] += 1
+                self.pending_fix_time = time.time()
+                return 1
+        return 0
+    
+    def handlePushedTracker(self, body):
+        '''
+        Pushed tracker frame: [data_length, lat (4 bytes), lon (4 bytes), board time in ms (4 bytes)], little endian
+        '''
+        if len(body) < 13:
+            return
+        lat = int.from_bytes(body[1:5], byteorder='little', signed=True) / 10000000
+        lon = int.from_bytes(body[5:9], byteorder='little', signed=True) / 10000000
+        board_time = int.from_bytes(body[9:13], byteorder='little')
+        self.last_push_time = time.time()
+        self.tracker_queue.append((board_time, self.last_push_time, lat, lon))
+        
+    def enableTrackerPush(self, enable=True):
+        '''
+        Asks the board to push tracker frames as they arrive. Older firmware doesn't know the op code and
+        doesn't acknowledge it, in which case we keep polling.
+        '''
+        response = self.bsr_message(self.command_codes["Set Tracker Push Mode"], [0x01 if enable else 0x00])
+        self.tracker_push = bool(enable and response and len(response) > 1 and response[1] == 0x01)
+        self.decoder.clear()
+        print(f"Tracker message delivery: {'push' if self.tracker_push else 'polling'}")
+        return self.tracker_push
+    
+    def recordFixToCommand(self):
+        latency = time.time() - self.pending_fix_time
+        self.pending_fix_time = None
+        self.link_stats["fix_to_command_count"] += 1
+        self.link_stats["fix_to_command_total"] += latency
+        self.link_stats["fix_to_command_max"] = max(self.link_stats["fix_to_command_max"], latency)
+        
+    def getTrackerStats(self):
+        '''
+        Serial transactions per delivered fix and latency between a fix being delivered and the next motion command
+        '''
+        stats = self.link_stats
+        fixes = stats["fixes"]
+        count = stats["fix_to_command_count"]
+        return {
+            "mode": "push" if self.tracker_push else "polling",
+            "fixes": fixes,
+            "transactions": stats["transactions"],
+            "tracker_transactions_per_fix": round(stats["tracker_transactions"] / fixes, 2) if fixes else None,
+            "fix_to_command_avg_ms": round(1000 * stats["fix_to_command_total"] / count, 2) if count else None,
+            "fix_to_command_max_ms": round(1000 * stats["fix_to_command_max"], 2),
+            "stale_frames": stats["stale_frames"],
+            "checksum_errors": self.decoder.checksum_errors,
+        }
             
     def isValidGPSData(self, lat, lon):
         if int(lat) == 38 and int(lon) == -9: # This means the incoming data is valid gps data with proper lock (PT Lisbon Area)
@@ -717,6 +626,8 @@ class FrontBoardDriver:
         
     def startTrackerPairing(self):
         response = self.bsr_message(0x66, [])
+        if not response or len(response) < 2:
+            return 0
         if response[0] == 0x01:
             if response[1] == 0x01:
                 return 1
@@ -731,69 +642,106 @@ class FrontBoardDriver:
         byte[2] = 0x01 if camera is pairing, 0x00 if not pairing
         """
         response = self.bsr_message(0x67, [])
-        if response[0] == 0x02:
+        if response and len(response) >= 3 and response[0] == 0x02:
             return response[1], response[2]
 
     def cancelTrackerPairing(self):
         response = self.bsr_message(0x68, [])        
-        if response[1] == 0x01:
+        if response and len(response) >= 2 and response[1] == 0x01:
             return 1
         else:
             return 0
         
+    def applyServoConfig(self, goal=True):
+        '''
+        Drive modes, tilt PID and profile and torque ON, and with goal the tilt to 0 degrees, in one group write.
+        Without goal (recovery while tracking) the servos aren't moved
+        '''
+        if not goal:
+            return self.groupDynamixelWrite(CONFIG_REGISTERS, CONFIG_VALUES)
+        self.lastTiltAngle = 0
+        return self.groupDynamixelWrite(CONFIG_REGISTERS + GOAL_REGISTERS,
+                                        CONFIG_VALUES + (self.toDynamixelVelocity(1 * TILT_GEAR_RATIO), 750))
+    
+    def reapplyPanMode(self, mode=None):
+        '''
+        Writes the pan operating mode and profiles again (ex: after a servo reboot reset them)
+        '''
+        mode = mode or self.current_pan_mode or "position"
+        self.current_pan_mode = ""
+        if mode == "velocity":
+            self.setPanVelocityControl()
+        else:
+            self.setPanPositionControl()
+        
     def rebootDynamixel(self):
+        '''
+        Reboots both servos and re-applies their configuration, without moving them. The reboot resets the pan
+        multi-turn count, so the pan center pulse is no longer valid: the tracking process is asked to calibrate again
+        '''
         response = self.bsr_message(0x69, [])
         # now we need to reapply configurations
-        self.dynamixelWrite(2, 10, 0)    # Pan drive mode to velocity profile 
-        self.setTiltPID(1000, 200, 800)
-        self.dynamixelWrite(1, 108, 20) # Set Tilt profile acceleration 
-        self.current_pan_mode = ""
-        self.setPanPositionControl()
+        mode = self.current_pan_mode
+        self.applyServoConfig(goal=False)
+        self.reapplyPanMode(mode)
+        self.commands.calibrate_pan_center = True
+        print("Servos rebooted, pan center calibration requested")
+        return response is not None
+    
+    def flushSerial(self):
+        '''
+        Drops whatever is buffered on both directions, including partially decoded frames
+        '''
+        self.serial.reset_input_buffer()
+        self.serial.reset_output_buffer()
+        self.decoder.clear()
+        self.timed_out_ops.clear()
         
-    def calibratePanCenter(self):
-        print("Calibrating Pan Center. Please do not move the camera.")
-        # Start rotating faster and we will slowdown 
-        initial_speed = 6
-        self.setPanPositionControl() # First we try to go to position mode so we are sure velocity control overrides the new speed
-        self.setPanVelocityControl(initial_speed) # Temporarily override the velocity limit
-        self.setPanGoalVelocity(initial_speed) # Rotate slowly to the right
-        # Timeout for searching 
-        start = time.time()
-        while self.getHallStatus()[1] == 1:
-            time.sleep(0.05)
-            new_speed = initial_speed - (time.time() - start) / 10 # Decrease speed by 0.1 every second
-            new_speed = max(new_speed, 1.5)
-            self.setPanGoalVelocity(new_speed)
-            if time.time() - start >= 130: # If a minute passes and cant find the sensor, stop trying
-                print("Timeout reached. Could not find Hall Effect Sensor")
-                self.setPanGoalVelocity(0)
-                return False
-            
-        print("Right Hall Effect Sensor Triggered")
-        self.setPanGoalVelocity(0)
-        self.PanCenterPulse = self.dynamixelRead(2, 132)
-        time.sleep(0.5)
-        self.setPanPositionControl()
-        self.setPanAngle(-120, 10) # This will move us back to the mechanical center position (120 degrees offset between sensor and mechanical 0)
-        # Wait until position is reached
-        time.sleep(1)
-        wait_start = time.time()
-        while True:
-            velocity = abs(self.dynamixelRead(2, 128))
-            print(f"Waiting to reach center position. Current Velocity: {velocity}")
-            if velocity <= 2:
-                break
-            if time.time() - wait_start > 25:  # 15s safety
-                print("Warning: servo did not settle in time")
-                self.setPanVelocityControl()
-                self.setPanGoalVelocity(0)
-                break
-            time.sleep(0.1)
-        self.PanCenterPulse = self.dynamixelRead(2, 132)
-        self.setTiltAngle(0, 1)
-        print(f"Pan Center Calibrated. New Center Pulse: {self.PanCenterPulse}")
+    def resyncLink(self):
+        '''
+        Flushes and checks the board answers again, restoring the tracker delivery mode
+        '''
+        self.flushSerial()
+        if self.getFirmware() is None:
+            return False
+        if self.tracker_push:
+            self.enableTrackerPush()
         return True
         
+    def serviceHealth(self):
+        '''
+        Periodic link check and recovery (see LinkHealth). Must run on the thread that owns the serial port,
+        the Serial Broker calls it from its worker between requests.
+        '''
+        return self.health.service()
+    
+    def getLinkHealth(self):
+        return self.health.stats()
+        
+    def calibratePanCenter(self):
+        '''
+        Blocking pan center calibration, runs the PanCenterCalibration state machine until it finishes.
+        The tracking loop steps the state machine itself instead, so it keeps servicing everything else meanwhile.
+        Not exposed by the Serial Broker (it would hold the serial port for minutes): other processes request a
+        calibration with commands.calibrate_pan_center.
+        '''
+        calibration = PanCenterCalibration(self)
+        calibration.start()
+        while calibration.active:
+            time.sleep(calibration.poll_period)
+            calibration.step()
+        return calibration.state == PanCenterCalibration.DONE
+    
+    def latchPanCenterPulse(self):
+        '''
+        Stores the current pan position as the pan center reference. Returns None when the position can't be read
+        (the previous reference is kept)
+        '''
+        pulse = self.dynamixelRead(2, 132)
+        if pulse is not None:
+            self.PanCenterPulse = pulse
+        return pulse
+        
     def setPanAngle(self, angle, speed=None):
         # Function to set pan angle bypassing the min/max limits
         deg_pulse = 0.088 # 360 degrees is 4096 pulses, so 1 degree is 11.37777 pulses
@@ -811,6 +759,318 @@ class FrontBoardDriver:
         self.dynamixelWrite(2, 116, pan_dynamixel_value) # Set the angle
         return True    
         
+class LinkHealth:
+    '''
+    Front board link and servo health, with escalating recovery.
+
+    Every transaction is recorded (success, timeout, other error) and the servo hardware error bits are taken from the
+    replies that carry them (Dynamixel reads, bulk reads). service() is called periodically: while transactions keep
+    failing it escalates one step at a time, waiting cooldown seconds between steps:
+        flush the serial buffers -> resync with the board -> reboot the servos -> re-apply the mode profiles
+    A servo hardware error (overload, overheating, ...) only clears with a reboot, so it jumps straight to that step.
+    A reboot resets the pan multi-turn count, so it also requests a new pan center calibration (rebootDynamixel).
+    At most max_reboots reboots are done in reboot_window seconds: past that (an error that doesn't clear, ex:
+    overload or input voltage) the link stays degraded, reported in WebApp.ErrorStates, until the window allows again.
+    The state is published in WebApp.ErrorStates while degraded and the recovery events are kept with their timings.
+    '''
+    ACTIONS = ["flush", "resync", "reboot_servos", "reapply_profiles"]
+    SERVO_ERROR_BITS = {0x01: "input voltage", 0x04: "overheating", 0x08: "motor encoder", 0x10: "electrical shock", 0x20: "overload"}
+    SERVO_NAMES = {1: "Tilt", 2: "Pan"}
+
+    def __init__(self, io, failure_threshold=3, cooldown=2.0, recovered_after=5, servo_check_period=5.0, window=100,
+                 max_reboots=3, reboot_window=600):
+        self.io = io
+        self.failure_threshold = failure_threshold  # Consecutive failed transactions before starting recovery
+        self.cooldown = cooldown                    # Seconds between escalation steps
+        self.recovered_after = recovered_after      # Consecutive good transactions to consider the link healthy again
+        self.servo_check_period = servo_check_period
+        self.max_reboots = max_reboots
+        self.reboot_window = reboot_window          # Seconds
+        self.reboots = deque()                      # Times of the servo reboots in the last reboot_window
+        self.reboots_exhausted = False
+        self.counts = {"transactions": 0, "errors": 0, "timeouts": 0}
+        self.recent = deque(maxlen=window)          # 1 for every failed transaction in the window, 0 otherwise
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.servo_errors = {1: 0, 2: 0}
+        self.level = 0                              # Index of the next recovery action
+        self.degraded = False
+        self.last_action_time = 0
+        self.last_servo_check = 0
+        self.events = deque(maxlen=20)
+
+    def record_success(self):
+        self.counts["transactions"] += 1
+        self.recent.append(0)
+        self.consecutive_failures = 0
+        self.consecutive_successes += 1
+
+    def record_failure(self, kind):
+        self.counts["transactions"] += 1
+        self.counts["errors"] += 1
+        if kind == "timeout":
+            self.counts["timeouts"] += 1
+        self.recent.append(1)
+        self.consecutive_failures += 1
+        self.consecutive_successes = 0
+
+    def record_servo_error(self, ID, bits):
+        if ID in self.servo_errors:
+            self.servo_errors[ID] = bits
+
+    def describe_servo_errors(self):
+        errors = []
+        for ID, bits in self.servo_errors.items():
+            if bits:
+                names = [name for bit, name in self.SERVO_ERROR_BITS.items() if bits & bit] or [f"0x{bits:02x}"]
+                errors.append(f"{self.SERVO_NAMES[ID]} servo {', '.join(names)}")
+        return "; ".join(errors)
+
+    def service(self):
+        now = time.time()
+        if now - self.last_servo_check >= self.servo_check_period:
+            self.last_servo_check = now
+            self.io.bulkReadPosVel()        # Refreshes the servo error bits
+
+        if now - self.last_action_time < self.cooldown:
+            return self.level
+        servo_error = self.describe_servo_errors()
+        if servo_error:
+            self.recover(servo_error, "reboot_servos")  # Out of the escalation sequence, it doesn't change self.level
+        elif self.consecutive_failures >= self.failure_threshold:
+            self.recover(f"{self.consecutive_failures} failed transactions in a row", self.ACTIONS[self.level])
+        elif self.degraded and self.consecutive_successes >= self.recovered_after:
+            self.degraded = False
+            self.level = 0
+            self.io.webapp.clear_error("frontboard_link")
+            print("Front board link recovered")
+        return self.level
+
+    def reboot_allowed(self, now):
+        while self.reboots and now - self.reboots[0] >= self.reboot_window:
+            self.reboots.popleft()
+        return len(self.reboots) < self.max_reboots
+
+    def recover(self, reason, action):
+        self.degraded = True
+        start = time.time()
+        self.consecutive_failures = 0
+        if action == "reboot_servos" and not self.reboot_allowed(start):
+            self.last_action_time = start
+            message = f"Front board link: {reason}, {len(self.reboots)} servo reboots in {self.reboot_window} s, not rebooting again"
+            if not self.reboots_exhausted:
+                self.reboots_exhausted = True
+                self.events.append({"time": start, "action": "none", "reason": reason, "duration_ms": 0, "ok": False})
+                print(message)
+            self.io.webapp.set_error("frontboard_link", message)
+            return
+        self.reboots_exhausted = False
+        escalate = action == self.ACTIONS[self.level]
+        try:
+            if action == "flush":
+                self.io.flushSerial()
+                ok = True
+            elif action == "resync":
+                ok = self.io.resyncLink()
+            elif not self.io.resyncLink():
+                # The board itself doesn't answer, rebooting the servos can't help: keep trying to resync
+                action = "resync"
+                ok = escalate = False
+            elif action == "reboot_servos":
+                self.reboots.append(start)
+                ok = self.io.rebootDynamixel()
+                self.servo_errors = {1: 0, 2: 0}
+            else:
+                self.io.applyServoConfig(goal=False)
+                self.io.reapplyPanMode()
+                ok = True
+        except Exception as e:
+            print(f"Recovery action {action} failed: {e}")
+            ok = False
+        self.last_action_time = time.time()
+        duration_ms = round(1000 * (self.last_action_time - start), 1)
+        self.events.append({"time": start, "action": action, "reason": reason, "duration_ms": duration_ms, "ok": bool(ok)})
+        self.io.webapp.set_error("frontboard_link", f"Front board link: {reason}, recovering ({action})")
+        print(f"Front board link: {reason}. Recovery action: {action} ({'ok' if ok else 'failed'}, {duration_ms} ms)")
+        if escalate:
+            self.level = min(self.level + 1, len(self.ACTIONS) - 1)
+
+    def stats(self):
+        window = len(self.recent)
+        return {
+            "degraded": self.degraded,
+            "error_rate": round(sum(self.recent) / window, 3) if window else 0.0,
+            "transactions": self.counts["transactions"],
+            "errors": self.counts["errors"],
+            "timeouts": self.counts["timeouts"],
+            "checksum_errors": self.io.decoder.checksum_errors,
+            "skipped_bytes": self.io.decoder.skipped_bytes,
+            "servo_errors": dict(self.servo_errors),
+            "servo_reboots": len(self.reboots),
+            "reboots_exhausted": self.reboots_exhausted,
+            "next_action": self.ACTIONS[self.level],
+            "events": list(self.events),
+        }
+
+
+class PanCenterCalibration:
+    '''
+    Pan homing as a resumable state machine.
+    The pan rotates to the right, slowing down over time, until the hall effect sensor triggers. That position is 120 degrees
+    from the mechanical center, so we then move back there and wait for the servo to settle before latching the center pulse.
+    A pulse that can't be read is read again for up to latch_timeout seconds, then the calibration fails: it never
+    finishes without a center pulse.
+
+    step() must be called periodically (every control loop tick). Each call does at most one serial transaction every
+    poll_period, so the serial link stays available for the rest of the traffic.
+    Works with either a FrontBoardDriver or a SerialBroker.FrontBoardClient.
+    '''
+    IDLE = "idle"
+    SEARCHING = "searching"
+    PAUSING = "pausing"
+    RETURNING = "returning"
+    SETTLING = "settling"
+    LATCHING = "latching"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, io, initial_speed=6, min_speed=1.5, search_timeout=130, settle_timeout=25, timeout=170, poll_period=0.05,
+                 latch_timeout=2):
+        self.io = io
+        self.initial_speed = initial_speed      # º/s, decreases by 0.1 every second down to min_speed
+        self.min_speed = min_speed
+        self.search_timeout = search_timeout    # Give up if the hall sensor isn't found in this time
+        self.settle_timeout = settle_timeout    # Time allowed for reaching the center position
+        self.timeout = timeout                  # Overall timeout
+        self.poll_period = poll_period
+        self.latch_timeout = latch_timeout      # Time allowed for reading the pan position once in place
+        self.hall_pulse = None                  # Pan position latched at the hall sensor
+        self.state = self.IDLE
+        self.message = ""
+        self.start_time = 0
+        self.state_time = 0
+        self.next_poll = 0
+        self.last_speed = None
+
+    @property
+    def active(self):
+        return self.state not in (self.IDLE, self.DONE, self.FAILED, self.CANCELLED)
+
+    @property
+    def progress(self):
+        '''
+        Rough completion between 0 and 1
+        '''
+        if self.state == self.SEARCHING:
+            return round(0.7 * min((time.time() - self.state_time) / self.search_timeout, 1), 2)
+        if self.state == self.PAUSING:
+            return 0.75
+        if self.state == self.RETURNING:
+            return 0.8
+        if self.state == self.SETTLING:
+            return round(0.8 + 0.2 * min((time.time() - self.state_time) / self.settle_timeout, 0.95), 2)
+        if self.state == self.LATCHING:
+            return 0.99
+        if self.state == self.DONE:
+            return 1.0
+        return 0.0
+
+    def status(self):
+        return {"state": self.state, "progress": self.progress, "message": self.message}
+
+    def set_state(self, state, message=""):
+        self.state = state
+        self.state_time = time.time()
+        self.message = message
+        if message:
+            print(message)
+
+    def start(self):
+        print("Calibrating Pan Center. Please do not move the camera.")
+        self.start_time = time.time()
+        self.hall_pulse = None
+        self.last_speed = self.initial_speed
+        self.io.setPanPositionControl() # First we try to go to position mode so we are sure velocity control overrides the new speed
+        self.io.setPanVelocityControl(self.initial_speed) # Temporarily override the velocity limit
+        self.io.setPanGoalVelocity(self.initial_speed) # Rotate slowly to the right
+        self.set_state(self.SEARCHING)
+        self.next_poll = time.time() + self.poll_period
+
+    def cancel(self):
+        if self.active:
+            self.io.setPanGoalVelocity(0)
+            self.set_state(self.CANCELLED, "Pan Center Calibration cancelled")
+
+    def fail(self, message):
+        self.io.setPanGoalVelocity(0)
+        self.set_state(self.FAILED, message)
+
+    def step(self):
+        if not self.active:
+            return self.state
+        now = time.time()
+        if now < self.next_poll:
+            return self.state
+        self.next_poll = now + self.poll_period
+
+        if now - self.start_time >= self.timeout:
+            self.fail("Timeout reached. Pan Center Calibration did not finish")
+
+        elif self.state == self.SEARCHING:
+            hall = self.io.getHallStatus()
+            if not hall or len(hall) < 2:
+                pass                # Failed read, try again on the next step
+            elif hall[1] != 1:
+                self.io.setPanGoalVelocity(0)
+                self.hall_pulse = self.io.latchPanCenterPulse()
+                self.set_state(self.PAUSING, "Right Hall Effect Sensor Triggered")
+            elif now - self.state_time >= self.search_timeout:
+                self.fail("Timeout reached. Could not find Hall Effect Sensor")
+            else:
+                new_speed = max(self.initial_speed - (now - self.state_time) / 10, self.min_speed) # Decrease speed by 0.1 every second
+                if abs(new_speed - self.last_speed) >= 0.1:   # Only resend the speed when it actually changed
+                    self.io.setPanGoalVelocity(new_speed)
+                    self.last_speed = new_speed
+
+        elif self.state == self.PAUSING:
+            if self.hall_pulse is None:
+                # The return move is relative to the pulse latched here, read it again
+                self.hall_pulse = self.io.latchPanCenterPulse()
+                if self.hall_pulse is None and now - self.state_time >= self.latch_timeout:
+                    self.fail("Could not read the pan position at the Hall Effect Sensor. Pan Center Calibration failed")
+            elif now - self.state_time >= 0.5:
+                self.io.setPanPositionControl()
+                self.io.setPanAngle(-120, 10) # This will move us back to the mechanical center position (120 degrees offset between sensor and mechanical 0)
+                self.set_state(self.RETURNING)
+
+        elif self.state == self.RETURNING:
+            if now - self.state_time >= 1:      # Give the servo time to start moving
+                self.set_state(self.SETTLING)
+
+        elif self.state == self.SETTLING:
+            velocity = self.io.dynamixelRead(2, 128)
+            if velocity is not None and abs(velocity) <= 2:
+                self.set_state(self.LATCHING)
+            elif now - self.state_time > self.settle_timeout:
+                print("Warning: servo did not settle in time")
+                self.io.setPanVelocityControl()
+                self.io.setPanGoalVelocity(0)
+                self.set_state(self.LATCHING)
+
+        elif self.state == self.LATCHING:
+            pulse = self.io.latchPanCenterPulse()
+            if pulse is not None:
+                self.finish(pulse)
+            elif now - self.state_time >= self.latch_timeout:
+                self.fail("Could not read the pan center position. Pan Center Calibration failed")
+
+        return self.state
+
+    def finish(self, pulse):
+        self.io.setTiltAngle(0, 1)
+        self.set_state(self.DONE, f"Pan Center Calibrated. New Center Pulse: {pulse}")
+
 def testAutoPairing():        
     io = FrontBoardDriver()
 
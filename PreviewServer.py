@@ -0,0 +1,224 @@
+import os
+import time
+import threading
+from flask import Flask, Response, jsonify
+from werkzeug.serving import make_server
+from FfmpegSupervisor import FfmpegSupervisor, rtsp_input_options
+import Camera
+
+'''
+Live preview of the camera for any number of viewers, with a single RTSP pull and a single encode.
+
+One ffmpeg (supervised) pulls the stream and encodes a low resolution MJPEG to its stdout, only while somebody is
+watching. The newest frame is kept in a FrameBuffer that every viewer reads from: a viewer waits for a frame newer than
+the one it sent last and always gets the newest, so a slow client skips frames instead of building a backlog, and the
+frames are shared (never copied per viewer). The process runs niced on the last CPU core, with a single encoder
+thread, so the preview can't starve the recording.
+
+    http://<camera>:8081/preview.mjpg     multipart MJPEG stream
+    http://<camera>:8081/preview.jpg      latest frame
+    http://<camera>:8081/preview_stats    encoder and viewer stats
+'''
+
+PREVIEW_PORT = 8081
+PREVIEW_WIDTH = 640
+PREVIEW_FPS = 10
+PREVIEW_QUALITY = 8         # MJPEG q:v, 2 (best) to 31
+IDLE_TIMEOUT = 10           # Seconds the encoder keeps running after the last viewer left
+RESTART_DELAY = 2
+FRAME_TIMEOUT = 5           # A viewer waiting longer than this for a frame gets the connection closed
+PREVIEW_NICE = 10
+BOUNDARY = b"frame"
+
+class FrameBuffer():
+    '''
+    Latest frame, with a sequence number for the readers to know what they already sent
+    '''
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.timestamp = 0
+
+    def publish(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.sequence += 1
+            self.timestamp = time.monotonic()
+            self.condition.notify_all()
+
+    def wait(self, last_sequence, timeout=FRAME_TIMEOUT):
+        '''
+        Newest frame after last_sequence: (sequence, frame), or (last_sequence, None) on timeout
+        '''
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.sequence > last_sequence, timeout=timeout):
+                return last_sequence, None
+            return self.sequence, self.frame
+
+def jpeg_frames(stream, chunk_size=65536):
+    '''
+    Splits concatenated JPEG images (ffmpeg image2pipe) on their start / end markers
+    '''
+    data = bytearray()
+    while True:
+        chunk = stream.read1(chunk_size) if hasattr(stream, "read1") else stream.read(chunk_size)
+        if not chunk:
+            return
+        data += chunk
+        while True:
+            start = data.find(b'\xff\xd8')
+            end = data.find(b'\xff\xd9', start + 2) if start != -1 else -1
+            if end == -1:
+                if start == -1:
+                    data.clear()
+                elif start > 0:
+                    del data[:start]
+                break
+            yield bytes(data[start:end + 2])
+            del data[:end + 2]
+
+class PreviewStream():
+
+    def __init__(self, input_args, width=PREVIEW_WIDTH, fps=PREVIEW_FPS, quality=PREVIEW_QUALITY):
+        self.input_args = input_args
+        self.width = width
+        self.fps = fps
+        self.quality = quality
+        self.buffer = FrameBuffer()
+        self.supervisor = FfmpegSupervisor("Preview")
+        self.lock = threading.Lock()
+        self.check_lock = threading.Lock()     # check() runs from the main loop and the request threads
+        self.viewers = 0
+        self.last_viewer = 0
+        self.last_start = 0
+        self.stats = {"frames": 0, "frames_sent": 0, "frames_skipped": 0, "viewers_served": 0}
+
+    def command(self):
+        return [
+            'ffmpeg',
+            '-nostats',
+            '-loglevel', 'error',
+            '-progress', 'pipe:2',      # stdout carries the frames
+            '-threads', '1',
+            *self.input_args,
+            '-an',
+            '-vf', f'fps={self.fps},scale={self.width}:-2',
+            '-c:v', 'mjpeg',
+            '-q:v', str(self.quality),
+            '-threads', '1',
+            '-f', 'image2pipe',
+            '-'
+        ]
+
+    def reader(self, process):
+        for frame in jpeg_frames(process.stdout):
+            if process is not self.supervisor.process:
+                break
+            self.buffer.publish(frame)
+            self.stats["frames"] += 1
+
+    def check(self):
+        '''
+        Runs the encoder while there are viewers (and IDLE_TIMEOUT after the last one), restarts it when it stalls
+        '''
+        with self.check_lock:
+            running = self.supervisor.check()
+            wanted = self.viewers > 0 or time.monotonic() - self.last_viewer < IDLE_TIMEOUT
+            if wanted and not running and time.monotonic() - self.last_start > RESTART_DELAY:
+                print("Preview encoder started")
+                self.last_start = time.monotonic()
+                self.supervisor.start(self.command(), stdout=self.reader)
+            elif not wanted and running:
+                print("Preview encoder stopped, no viewers")
+                self.supervisor.stop()
+
+    def frames(self):
+        '''
+        Multipart MJPEG body for one viewer
+        '''
+        with self.lock:
+            self.viewers += 1
+            self.stats["viewers_served"] += 1
+            self.last_viewer = time.monotonic()
+        sequence = self.buffer.sequence
+        try:
+            while True:
+                new_sequence, frame = self.buffer.wait(sequence)
+                if frame is None:
+                    if not self.supervisor.running and time.monotonic() - self.last_start > FRAME_TIMEOUT + RESTART_DELAY:
+                        return      # No stream
+                    continue
+                if sequence and new_sequence > sequence + 1:
+                    self.stats["frames_skipped"] += new_sequence - sequence - 1
+                sequence = new_sequence
+                self.stats["frames_sent"] += 1
+                yield (b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: ' +
+                       str(len(frame)).encode() + b'\r\n\r\n' + frame + b'\r\n')
+        finally:
+            with self.lock:
+                self.viewers -= 1
+                self.last_viewer = time.monotonic()
+
+    def getStats(self):
+        return dict(self.stats, viewers=self.viewers, encoder=self.supervisor.getStats(),
+                    frame_age=round(time.monotonic() - self.buffer.timestamp, 2) if self.buffer.frame else None)
+
+def create_app(stream):
+    app = Flask(__name__)
+
+    @app.route('/preview.mjpg')
+    def preview_mjpg():
+        stream.last_viewer = time.monotonic()    # Start the encoder right away
+        stream.check()
+        return Response(stream.frames(), mimetype='multipart/x-mixed-replace; boundary=' + BOUNDARY.decode())
+
+    @app.route('/preview.jpg')
+    def preview_jpg():
+        stream.last_viewer = time.monotonic()
+        stream.check()
+        fresh = stream.buffer.frame is not None and time.monotonic() - stream.buffer.timestamp < 1
+        _, frame = stream.buffer.wait(stream.buffer.sequence - 1 if fresh else stream.buffer.sequence)
+        if frame is None:
+            return jsonify({"success": False, "message": "No preview available"}), 503
+        return Response(frame, mimetype='image/jpeg')
+
+    @app.route('/preview_stats')
+    def preview_stats():
+        return jsonify({"success": True, "message": "OK", "state": stream.getStats()})
+
+    return app
+
+def limit_cpu():
+    '''
+    Lower priority and the last CPU core for this process and its ffmpeg (inherited)
+    '''
+    try:
+        os.nice(PREVIEW_NICE)
+        cores = sorted(os.sched_getaffinity(0))
+        if len(cores) > 1:
+            os.sched_setaffinity(0, {cores[-1]})
+    except (AttributeError, OSError) as e:
+        print(f"Preview CPU limits not applied: {e}")
+
+def serve(stream, port=PREVIEW_PORT):
+    server = make_server("0.0.0.0", port, create_app(stream), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(d):
+    limit_cpu()
+    stream = PreviewStream(rtsp_input_options() + ['-i', Camera.RTSP_URL])
+    server = serve(stream)
+    print(f"Preview server on port {PREVIEW_PORT}")
+    try:
+        while not d["stop"]:
+            time.sleep(0.5)
+            stream.check()
+    except KeyboardInterrupt:
+        d["stop"] = True
+    server.shutdown()
+    stream.supervisor.stop()
+
+if __name__ == "__main__":
+    main({"stop": False})
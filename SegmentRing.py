@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import tempfile
+import subprocess
+from collections import deque
+from FfmpegSupervisor import FfmpegSupervisor, rtsp_input_options
+
+'''
+Continuous recording of the rtsp stream into a bounded ring of short segments.
+
+A single ffmpeg process (segment muxer) writes fixed length MPEG-TS segments with unique names and appends each
+finished segment to a CSV list (name, start, end in stream time). The ring reads that list, maps stream time to the
+monotonic clock and deletes the oldest segments once the ring holds more than ring_seconds of footage. Segments still
+needed by a wave are protected with pins. Clips are assembled by concatenating (stream copy) only the segments that
+cover the requested interval, so nothing is re-read or rewritten apart from the clip itself.
+
+The ring directory is meant to be on tmpfs (/dev/shm): the footage waiting between waves stays in RAM, bounded in
+bytes as well as in time, and only clips are written to the SD card.
+
+Stream time -> monotonic clock: ffmpeg reports its output time (-progress, about every 0.5 s) and each report is
+paired with time.monotonic_ns() when it is read. Reports can only arrive late, so the smallest (monotonic - stream)
+difference over the last OFFSET_WINDOW reports is the best estimate (a few ms instead of the 1 s of HHMMSS stamps).
+The first clip segment is cut with the concat inpoint at the last keyframe before the requested start, so the clip
+starts on a keyframe without decoding anything, and how far before the requested start it begins is reported.
+'''
+
+SEGMENT_TIME = 2            # Seconds per segment (ffmpeg cuts on the next keyframe)
+RING_SECONDS = 30           # Footage kept when nothing is pinned, must stay above the wave pre-roll
+MAX_PINNED_SECONDS = 300    # Hard bounds on the ring, pinned segments past them are evicted anyway
+MAX_RING_BYTES = 256 * 1024 * 1024
+MAX_RING_FRACTION = 0.5     # Of the ring filesystem (the ring is meant for tmpfs, it holds the segments in RAM)
+RESTART_DELAY = 2           # Seconds between ffmpeg starts, when it exits (ex: camera not streaming)
+OFFSET_WINDOW = 60          # Progress reports kept for the stream time -> monotonic offset
+LIST_FILE = "segments.csv"
+
+def keyframe_times(path):
+    '''
+    Timestamps (seconds, file time base) of the video keyframes of a segment, read from the packets (no decoding)
+    '''
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+               '-of', 'json', path]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=10)
+    if result.returncode != 0:
+        return []
+    packets = json.loads(result.stdout.decode('utf-8')).get("packets", [])
+    return sorted(float(p["pts_time"]) for p in packets if "K" in p.get("flags", "") and "pts_time" in p)
+
+def concat_segments(segments, output_file, start=None):
+    '''
+    Concatenates the segments into output_file, without re-encoding. With start (monotonic seconds) the first segment
+    is entered at the last keyframe before start, otherwise the clip starts on the segment boundary. It ends on a
+    segment boundary, so it can hold up to one segment more after the wave end.
+    Returns (error or None, start - clip start in seconds: footage kept before start, negative when the clip starts late)
+    '''
+    if not segments:
+        return "no recorded segments", None
+    first = segments[0]
+    inpoint = None
+    start_offset = None
+    if start is not None:
+        start_offset = start - first.start
+        keyframes = keyframe_times(first.path)
+        if keyframes:
+            # Keyframe times are in the file time base, its first keyframe is the segment start
+            wanted = keyframes[0] + start - first.start
+            inpoint = max([k for k in keyframes if k <= wanted] or keyframes[:1])
+            start_offset = start - (first.start + inpoint - keyframes[0])
+
+    fd, list_file = tempfile.mkstemp(suffix=".ffconcat", dir=os.path.dirname(first.path))
+    with os.fdopen(fd, "w") as fp:
+        fp.write("ffconcat version 1.0\n")
+        for segment in segments:
+            fp.write(f"file '{segment.path}'\n")
+            if segment is first and inpoint is not None:
+                fp.write(f"inpoint {inpoint:.6f}\n")
+
+    command = [
+        'ffmpeg',
+        '-f', 'concat',
+        '-safe', '0',
+        '-i', list_file,
+        '-c', 'copy',       # Copy video without re-encoding
+        '-y',               # Overwrite output file if it exists
+        output_file
+    ]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+    except subprocess.TimeoutExpired:
+        return "ffmpeg timed out", start_offset
+    finally:
+        os.remove(list_file)
+    if result.returncode != 0:
+        lines = result.stderr.decode('utf-8').strip().splitlines()
+        return (lines[-1] if lines else f"ffmpeg exit code {result.returncode}"), start_offset
+    return None, start_offset
+
+class Segment():
+    def __init__(self, path, start, end):
+        self.path = path
+        self.start = start  # Monotonic clock (seconds) of the first and last frame
+        self.end = end
+        try:
+            self.size = os.path.getsize(path)
+        except FileNotFoundError:
+            self.size = 0
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+class SegmentRing():
+
+    def __init__(self, rtsp_url, directory, segment_time=SEGMENT_TIME, ring_seconds=RING_SECONDS):
+        self.rtsp_url = rtsp_url
+        self.directory = directory
+        self.segment_time = segment_time
+        self.ring_seconds = ring_seconds
+        self.supervisor = FfmpegSupervisor("Segment ring", on_progress=self.progress_report)
+        self.segments = []
+        self.bytes = 0
+        self.max_bytes = MAX_RING_BYTES
+        self.pins = {}
+        self.next_pin = 0
+        self.list_position = 0
+        self.offset = None      # Monotonic clock - stream time, from the segment list until ffmpeg reports progress
+        self.progress = deque(maxlen=OFFSET_WINDOW)     # (monotonic - stream time) of each progress report
+        self.last_start = 0
+        self.stats = {"segments": 0, "evicted": 0, "forced_evictions": 0}
+
+    @property
+    def running(self):
+        return self.supervisor.running
+
+    def restart_due(self):
+        return not self.running and time.time() - self.last_start > RESTART_DELAY
+
+    def start(self):
+        '''
+        Start ffmpeg, keeping only the pinned segments (leftovers of a previous run are deleted)
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        fs = os.statvfs(self.directory)
+        self.max_bytes = min(MAX_RING_BYTES, int(MAX_RING_FRACTION * fs.f_blocks * fs.f_frsize))
+        self.clear()
+        kept = [os.path.basename(s.path) for s in self.segments]
+        for name in os.listdir(self.directory):
+            if (name.endswith(".ts") and name not in kept) or name.endswith(".ffconcat") or name == LIST_FILE:
+                os.remove(os.path.join(self.directory, name))
+        self.last_start = time.time()
+        self.list_position = 0
+        self.offset = None
+        self.progress.clear()
+        prefix = time.strftime('%Y%m%d_%H%M%S', time.localtime())     # Unique across restarts
+        command = [
+            'ffmpeg',
+            '-nostats',
+            '-progress', 'pipe:1',  # Output time reports, read by the supervisor
+            *rtsp_input_options(),
+            '-i', self.rtsp_url,
+            '-c:v', 'copy',         # Copy video stream to maintain quality
+            '-c:a', 'aac',
+            '-f', 'segment',
+            '-segment_time', str(self.segment_time),
+            '-segment_format', 'mpegts',   # Stays readable if ffmpeg is killed, concatenates cleanly
+            '-segment_list', os.path.join(self.directory, LIST_FILE),
+            '-segment_list_type', 'csv',
+            '-segment_list_size', '0',     # Only appended to, the ring evicts
+            '-y',
+            os.path.join(self.directory, f"seg_{prefix}_%06d.ts")
+        ]
+        self.supervisor.start(command)
+        print(f"Segment ring recording to {self.directory}")
+
+    def progress_report(self, now_ns, report):
+        out_time = report.get("out_time_us", "")
+        if out_time.isdigit() and int(out_time) > 0:
+            self.progress.append((now_ns - 1000 * int(out_time)) / 1e9)
+
+    def stream_offset(self):
+        '''
+        Monotonic - stream time (seconds), None before the first report
+        '''
+        offsets = list(self.progress)
+        return min(offsets) if offsets else self.offset
+
+    def stop(self):
+        '''
+        Stop ffmpeg (it closes the current segment) and read the last segments
+        '''
+        self.supervisor.stop()
+        print("Recording stopped.")
+        self.poll()
+
+    def poll(self):
+        '''
+        Add the segments ffmpeg finished since the last call and evict the old ones. A stalled ffmpeg is killed, to be
+        restarted (restart_due)
+        '''
+        self.supervisor.check()
+        list_path = os.path.join(self.directory, LIST_FILE)
+        try:
+            if os.path.getsize(list_path) <= self.list_position:
+                return
+            with open(list_path) as fp:
+                fp.seek(self.list_position)
+                lines = fp.readlines()
+        except FileNotFoundError:
+            return
+        now = time.monotonic()
+        entries = []
+        for line in lines:
+            if not line.endswith("\n"):
+                break       # Entry still being written
+            self.list_position += len(line)
+            try:
+                name, start, end = line.strip().rsplit(",", 2)
+                entries.append((name, float(start), float(end)))
+            except ValueError:
+                continue
+        if not entries:
+            return
+        # The newest segment is listed right after its last frame, any delay only makes the offset bigger
+        if self.offset is None or now - entries[-1][2] < self.offset:
+            self.offset = now - entries[-1][2]
+        offset = self.stream_offset()
+        for name, start, end in entries:
+            segment = Segment(os.path.join(self.directory, name), start + offset, end + offset)
+            self.segments.append(segment)
+            self.bytes += segment.size
+            self.stats["segments"] += 1
+        self.evict()
+
+    def getStats(self):
+        return dict(self.supervisor.getStats(), segments=len(self.segments), ring_bytes=self.bytes,
+                    evicted=self.stats["evicted"], forced_evictions=self.stats["forced_evictions"])
+
+    def covered_until(self):
+        return self.segments[-1].end if self.segments else 0
+
+    def pin(self, start):
+        '''
+        Protect the segments from start (monotonic seconds) onwards until unpin(). Returns the pin id
+        '''
+        self.next_pin += 1
+        self.pins[self.next_pin] = start
+        return self.next_pin
+
+    def unpin(self, pin):
+        self.pins.pop(pin, None)
+        self.evict()
+
+    def evict(self):
+        pinned_from = min(self.pins.values()) if self.pins else None
+        while self.segments:
+            oldest = self.segments[0]
+            footage = self.segments[-1].end - oldest.start
+            full = footage > MAX_PINNED_SECONDS or self.bytes > self.max_bytes
+            if footage <= self.ring_seconds and not full:
+                break
+            if pinned_from is not None and oldest.end >= pinned_from:
+                if not full:
+                    break
+                self.stats["forced_evictions"] += 1
+                print("Segment ring full, evicting pinned footage")
+            self.remove(self.segments.pop(0))
+            self.stats["evicted"] += 1
+
+    def clear(self):
+        '''
+        Delete every segment that isn't pinned
+        '''
+        pinned_from = min(self.pins.values()) if self.pins else None
+        keep = [s for s in self.segments if pinned_from is not None and s.end >= pinned_from]
+        for segment in self.segments:
+            if segment not in keep:
+                self.remove(segment)
+        self.segments = keep
+
+    def remove(self, segment):
+        self.bytes -= segment.size
+        try:
+            os.remove(segment.path)
+        except FileNotFoundError:
+            pass
+
+    def segments_between(self, start, end):
+        return [s for s in self.segments if s.end > start and s.start < end]
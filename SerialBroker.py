@@ -0,0 +1,653 @@
+import os
+import socket
+import struct
+import threading
+import time
+import functools
+from collections import deque
+
+'''
+Single owner of the Front IO Board and Zoom Controller serial ports.
+
+The broker process opens both serial devices once and serves the other processes (Tracking, WebServer, test tools)
+over a local Unix socket with a small binary RPC. Requests are serviced by a single worker thread so the serial
+links are never shared between processes.
+
+Requests are scheduled by priority class (motion > tracker > status > diagnostics), FIFO within a class. Commands with a
+coalescing key (goal velocity / position of a servo, zoom target, LEDs) replace any queued command with the same key,
+so only the latest target is sent. Motion commands are sent one way by the clients: no response, no waiting.
+
+Other processes use FrontBoardClient() and ZoomClient(), which expose the same method names as
+IOBoardDriver.FrontBoardDriver and Zoom_CBN8125.SoarCameraZoomFocus.
+
+Request frame:  [req_id u32][method u16][flags u8][payload_len u16][payload]
+Response frame: [req_id u32][status u8][payload_len u16][payload]   (not sent for FLAG_ONEWAY requests)
+The payload is the (args, kwargs) tuple of the call encoded by pack_value().
+'''
+
+SOCKET_PATH = "/tmp/surfcam_serial_broker.sock"
+
+REQUEST_HEADER = struct.Struct('<IHBH')
+RESPONSE_HEADER = struct.Struct('<IBH')
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_SUPERSEDED = 2   # A newer command with the same coalescing key replaced this one before it was sent
+
+FLAG_ONEWAY = 0x01
+
+# Priority classes, lower is served first
+CLASS_MOTION = 0
+CLASS_TRACKER = 1
+CLASS_STATUS = 2
+CLASS_DIAGNOSTICS = 3
+CLASS_NAMES = ["motion", "tracker", "status", "diagnostics"]
+
+STATS_PRINT_PERIOD = 60 # seconds
+HEALTH_CHECK_PERIOD = 1 # seconds between front board link health checks (and recovery steps)
+
+BY_ID_DIR = "/dev/serial/by-id"
+PORT_DESCRIPTIONS = {
+    "frontboard": "Surf Front Board",
+    "zoom": "Zoom",
+}
+
+# Method tables. The position of each entry in METHODS is its id on the wire. Every process runs from the same checkout,
+# so ids only have to agree within one deploy.
+FRONTBOARD_METHODS = [
+    "getFirmware",
+    "setBackPanelLEDs",
+    "getShutdownState",
+    "setShutdown",
+    "bulkReadTemp",
+    "bulkReadPosVel",
+    "dynamixelRead",
+    "dynamixelWrite",
+    "turnOnTorque",
+    "turnOffTorque",
+    "getPanPID",
+    "getPanVelocityPI",
+    "getTiltPID",
+    "setPanPID",
+    "setPanVelocityPI",
+    "setTiltPID",
+    "setAngles",
+    "setTiltAngle",
+    "setPanVelocityControl",
+    "setPanPositionControl",
+    "setPanProfileVelocity",
+    "setPanGoalVelocity",
+    "getCurrentPanAngle",
+    "getMacAddress",
+    "getHallStatus",
+    "getTrackerMessage",
+    "startTrackerPairing",
+    "checkTrackerPairing",
+    "cancelTrackerPairing",
+    "rebootDynamixel",
+    "setPanAngle",
+    "latchPanCenterPulse",
+    "enableTrackerPush",
+    "getTrackerStats",
+    "getLinkHealth",
+]
+
+ZOOM_METHODS = [
+    "setMinZoom",
+    "setMaxZoom",
+    "set_zoom_position",
+    "set_zoom_speed",
+    "getZoomPosition",
+    "getZoomStats",
+    "stop_zoom",
+    "set_zoom_focus_position",
+    "set_focus_position",
+    "set_focus_mode",
+    "trigger_autofocus",
+    "getFocusPosition",
+]
+
+BROKER_METHODS = [
+    "getBrokerStats",
+]
+
+METHODS = [("frontboard", m) for m in FRONTBOARD_METHODS] + \
+          [("zoom", m) for m in ZOOM_METHODS] + \
+          [("broker", m) for m in BROKER_METHODS]
+
+METHOD_IDS = {entry: i for i, entry in enumerate(METHODS)}
+
+# Commands that move the servos or the lens. These jump ahead of everything else.
+MOTION_METHODS = {
+    "setAngles",
+    "setTiltAngle",
+    "setPanVelocityControl",
+    "setPanPositionControl",
+    "setPanProfileVelocity",
+    "setPanGoalVelocity",
+    "setPanAngle",
+    "set_zoom_position",
+    "set_zoom_speed",
+    "stop_zoom",
+    "set_zoom_focus_position",
+    "set_focus_position",
+    "setMinZoom",
+    "setMaxZoom",
+}
+
+TRACKER_METHODS = {
+    "getTrackerMessage",
+    "getCurrentPanAngle",
+    "getHallStatus",
+    "latchPanCenterPulse",
+    "getTrackerStats",
+}
+
+# Slow or rarely needed calls, served when nothing else is waiting
+DIAGNOSTICS_METHODS = {
+    "getFirmware",
+    "bulkReadTemp",
+    "bulkReadPosVel",
+    "getPanPID",
+    "getPanVelocityPI",
+    "getTiltPID",
+    "getMacAddress",
+    "getBrokerStats",
+    "getLinkHealth",
+    "getZoomStats",
+}
+
+# Everything else (LEDs, shutdown and push button, pairing, PID and torque setup, ...) is CLASS_STATUS
+def method_class(name):
+    if name in MOTION_METHODS:
+        return CLASS_MOTION
+    if name in TRACKER_METHODS:
+        return CLASS_TRACKER
+    if name in DIAGNOSTICS_METHODS:
+        return CLASS_DIAGNOSTICS
+    return CLASS_STATUS
+
+# Commands where only the latest queued value matters. Methods sharing a key supersede each other: the older queued
+# job is dropped and the new one goes to the tail of its class, so it still runs after anything queued in between
+# (ex: a control mode switch).
+COALESCE_KEYS = {
+    ("frontboard", "setPanGoalVelocity"): "pan_goal",
+    ("frontboard", "setPanAngle"): "pan_goal",
+    ("frontboard", "setTiltAngle"): "tilt_goal",
+    ("frontboard", "setAngles"): "pan_tilt_goal",
+    ("frontboard", "setBackPanelLEDs"): "leds",
+    ("zoom", "set_zoom_position"): "zoom_goal",
+    ("zoom", "set_zoom_speed"): "zoom_goal",
+    ("zoom", "stop_zoom"): "zoom_goal",
+    ("zoom", "set_zoom_focus_position"): "zoom_goal",
+    ("zoom", "set_focus_position"): "focus_goal",
+}
+
+# Sent without waiting for a response by the clients
+ONEWAY_METHODS = set(COALESCE_KEYS)
+
+
+def pack_value(value, out):
+    '''
+    Appends a compact type tagged encoding of value to the bytearray out.
+    Supports None, bool, int, float, bytes, str, tuples/lists and dicts of those.
+    '''
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, int):
+        out += b'i'
+        out += struct.pack('<q', value)
+    elif isinstance(value, float):
+        out += b'd'
+        out += struct.pack('<d', value)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        out += b'y'
+        out += struct.pack('<H', len(value))
+        out += value
+    elif isinstance(value, str):
+        value = value.encode("utf-8")
+        out += b's'
+        out += struct.pack('<H', len(value))
+        out += value
+    elif isinstance(value, (tuple, list)):
+        out += b't'
+        out += struct.pack('<B', len(value))
+        for v in value:
+            pack_value(v, out)
+    elif isinstance(value, dict):
+        out += b'm'
+        out += struct.pack('<B', len(value))
+        for k, v in value.items():
+            pack_value(k, out)
+            pack_value(v, out)
+    else:
+        # numpy scalars and similar
+        try:
+            pack_value(value.item(), out)
+        except AttributeError:
+            raise TypeError(f"Can't encode value of type {type(value)}")
+    return out
+
+def unpack_value(buf, offset=0):
+    '''
+    Decodes one value encoded by pack_value() starting at offset. Returns (value, new_offset)
+    '''
+    tag = buf[offset:offset + 1]
+    offset += 1
+    if tag == b'N':
+        return None, offset
+    if tag == b'T':
+        return True, offset
+    if tag == b'F':
+        return False, offset
+    if tag == b'i':
+        return struct.unpack_from('<q', buf, offset)[0], offset + 8
+    if tag == b'd':
+        return struct.unpack_from('<d', buf, offset)[0], offset + 8
+    if tag in (b'y', b's'):
+        length = struct.unpack_from('<H', buf, offset)[0]
+        offset += 2
+        data = bytes(buf[offset:offset + length])
+        if tag == b's':
+            data = data.decode("utf-8")
+        return data, offset + length
+    if tag == b't':
+        count = buf[offset]
+        offset += 1
+        items = []
+        for _ in range(count):
+            v, offset = unpack_value(buf, offset)
+            items.append(v)
+        return tuple(items), offset
+    if tag == b'm':
+        count = buf[offset]
+        offset += 1
+        items = {}
+        for _ in range(count):
+            k, offset = unpack_value(buf, offset)
+            v, offset = unpack_value(buf, offset)
+            items[k] = v
+        return items, offset
+    raise ValueError(f"Unknown value tag {tag}")
+
+def by_id_path(device):
+    '''
+    Returns the stable udev /dev/serial/by-id link pointing to device (/dev/ttyACM0 can change between boots),
+    or device itself when there is none
+    '''
+    try:
+        for name in os.listdir(BY_ID_DIR):
+            path = os.path.join(BY_ID_DIR, name)
+            if os.path.realpath(path) == os.path.realpath(device):
+                return path
+    except OSError:
+        pass
+    return device
+
+def find_port(description, cached=None):
+    '''
+    Returns the device path of the serial port matching description. The cached path is used straight away when
+    it still exists, otherwise the ports are scanned (every 100 ms until the device shows up).
+    '''
+    if cached and os.path.exists(cached):
+        return cached
+    from serial.tools import list_ports
+    printed = False
+    while True:
+        for port in list_ports.comports():
+            if description in port.description:
+                return by_id_path(port.device)
+        if not printed:
+            print(f"Searching for {description} serial port")
+            printed = True
+        time.sleep(0.1)
+
+def recv_exactly(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("Socket closed")
+        data += chunk
+    return data
+
+
+class SerialBroker:
+    '''
+    Owns the serial drivers and services RPC requests coming from the Unix socket.
+    '''
+    def __init__(self, socket_path=SOCKET_PATH, targets=None):
+        self.socket_path = socket_path
+        if targets is None:
+            import db
+            self.ports = db.SerialPorts(db.get_connection())
+            self.ports.startup_timings = {"started_at": time.time()}
+            self.targets = {}
+            self.open_targets()
+        else:
+            self.targets = targets      # Drivers already open (tests, emulators), name -> driver
+        self.queues = [deque() for _ in CLASS_NAMES]
+        self.queued = {}           # coalescing key -> job waiting in self.queues
+        self.queue_size = 0
+        self.queue_cond = threading.Condition()
+        self.stats = {}            # method name -> [count, total seconds, max seconds]
+        self.class_stats = [[0, 0.0, 0.0, 0] for _ in CLASS_NAMES]  # [count, total wait, max wait, coalesced]
+        self.stats_lock = threading.Lock()
+        self.running = False
+
+    def open_targets(self):
+        '''
+        Opens the front board and the zoom controller concurrently, each on its cached port when there is one
+        '''
+        start = time.time()
+        opened = {}     # name -> port, written by its thread
+        threads = [threading.Thread(target=self.open_target, args=(name, opened)) for name in PORT_DESCRIPTIONS]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.ports.record_startup_phase("serial_ports_ready", time.time() - start)
+        # Persisted once both threads are done, db.txt is rewritten as a whole by dump()
+        changed = {f"{name}_port": port for name, port in opened.items() if port != self.ports.client.get(f"{name}_port")}
+        for key, port in changed.items():
+            self.ports.client.set(key, port)
+        if changed:
+            self.ports.client.dump(list(changed), "db.txt")
+
+    def open_target(self, name, opened):
+        import IOBoardDriver as GPIO
+        import Zoom_CBN8125 as ZoomController
+        drivers = {"frontboard": GPIO.FrontBoardDriver, "zoom": ZoomController.SoarCameraZoomFocus}
+
+        cached = self.ports.client.get(f"{name}_port")
+        while name not in self.targets:
+            start = time.time()
+            port = find_port(PORT_DESCRIPTIONS[name], cached)
+            self.ports.record_startup_phase(f"{name}_discovery", time.time() - start)
+            start = time.time()
+            try:
+                self.targets[name] = drivers[name](port=port)
+            except Exception as e:
+                print(f"Serial Broker couldn't open {name} on {port}: {e}")
+                cached = None     # Stale cache (other device on that path), scan again
+                time.sleep(0.1)
+                continue
+            self.ports.record_startup_phase(f"{name}_init", time.time() - start)
+            opened[name] = port
+
+    def getBrokerStats(self):
+        '''
+        Returns the current queue depth, the queueing delay per priority class and the per-op latency
+        (queueing + execution) in milliseconds
+        '''
+        with self.stats_lock:
+            ops = {}
+            for name, (count, total, worst) in self.stats.items():
+                ops[name] = {"count": count, "avg_ms": round(1000 * total / count, 2), "max_ms": round(1000 * worst, 2)}
+            classes = {}
+            for name, (count, total, worst, coalesced) in zip(CLASS_NAMES, self.class_stats):
+                classes[name] = {"count": count, "avg_wait_ms": round(1000 * total / count, 2) if count else 0.0,
+                                 "max_wait_ms": round(1000 * worst, 2), "coalesced": coalesced}
+        return {"queue_depth": self.queue_size, "classes": classes, "ops": ops}
+
+    def printStats(self):
+        stats = self.getBrokerStats()
+        print(f"Serial Broker queue depth: {stats['queue_depth']}")
+        for name, c in stats["classes"].items():
+            print(f"    [{name}] {c['count']} served, wait avg {c['avg_wait_ms']} ms, max {c['max_wait_ms']} ms, {c['coalesced']} coalesced")
+        for name, op in sorted(stats["ops"].items()):
+            print(f"    {name}: {op['count']} calls, avg {op['avg_ms']} ms, max {op['max_ms']} ms")
+
+    def submit(self, job):
+        entry = METHODS[job["method"]]
+        job["class"] = method_class(entry[1])
+        key = COALESCE_KEYS.get(entry)
+        superseded = None
+        with self.queue_cond:
+            if key is not None:
+                superseded = self.queued.pop(key, None)
+                if superseded is not None:
+                    superseded["superseded"] = True     # Left in its deque, skipped by the worker
+                    self.queue_size -= 1
+                self.queued[key] = job
+                job["key"] = key
+            self.queues[job["class"]].append(job)
+            self.queue_size += 1
+            self.queue_cond.notify()
+        if superseded is not None:
+            with self.stats_lock:
+                self.class_stats[superseded["class"]][3] += 1
+            self.respond(superseded, STATUS_SUPERSEDED, None)
+
+    def next_job(self, timeout):
+        '''
+        Takes the oldest job of the highest priority class with work queued, or returns None after timeout
+        '''
+        with self.queue_cond:
+            end = time.time() + timeout
+            while True:
+                for q in self.queues:
+                    while q:
+                        job = q.popleft()
+                        if job.get("superseded"):
+                            continue
+                        if self.queued.get(job.get("key")) is job:
+                            del self.queued[job["key"]]
+                        self.queue_size -= 1
+                        return job
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return None
+                self.queue_cond.wait(remaining)
+
+    def check_health(self):
+        '''
+        Runs the front board health check / recovery on the worker thread, so it never races with a request
+        '''
+        try:
+            self.targets["frontboard"].serviceHealth()
+        except Exception as e:
+            print(f"Serial Broker health check error: {e}")
+
+    def worker(self):
+        last_health_check = time.time()
+        while self.running:
+            if time.time() - last_health_check >= HEALTH_CHECK_PERIOD:
+                last_health_check = time.time()
+                self.check_health()
+            job = self.next_job(timeout=HEALTH_CHECK_PERIOD)
+            if job is None:
+                continue
+            wait = time.time() - job["t_enqueue"]
+            with self.stats_lock:
+                entry = self.class_stats[job["class"]]
+                entry[0] += 1
+                entry[1] += wait
+                entry[2] = max(entry[2], wait)
+            target, name = METHODS[job["method"]]
+            try:
+                obj = self if target == "broker" else self.targets[target]
+                result = getattr(obj, name)(*job["args"], **job["kwargs"])
+                status = STATUS_OK
+            except Exception as e:
+                print(f"Serial Broker error running {name}: {e}")
+                result = str(e)
+                status = STATUS_ERROR
+
+            elapsed = time.time() - job["t_enqueue"]
+            with self.stats_lock:
+                entry = self.stats.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] = max(entry[2], elapsed)
+
+            self.respond(job, status, result)
+
+    def respond(self, job, status, result):
+        if job.get("flags", 0) & FLAG_ONEWAY:
+            if status == STATUS_ERROR:
+                print(f"Serial Broker one way call failed: {result}")
+            return
+        try:
+            payload = pack_value(result, bytearray())
+        except TypeError as e:
+            payload = pack_value(str(e), bytearray())
+            status = STATUS_ERROR
+        frame = RESPONSE_HEADER.pack(job["req_id"], status, len(payload)) + payload
+        try:
+            with job["lock"]:
+                job["conn"].sendall(frame)
+        except OSError:
+            pass # Client went away, nothing to do
+
+    def handle_client(self, conn):
+        lock = threading.Lock()
+        try:
+            while self.running:
+                header = recv_exactly(conn, REQUEST_HEADER.size)
+                req_id, method, flags, length = REQUEST_HEADER.unpack(header)
+                payload = recv_exactly(conn, length) if length else b''
+                (args, kwargs), _ = unpack_value(payload) if length else (((), {}), 0)
+                if method >= len(METHODS):
+                    self.respond({"conn": conn, "lock": lock, "req_id": req_id}, STATUS_ERROR, f"Unknown method {method}")
+                    continue
+                self.submit({"conn": conn, "lock": lock, "req_id": req_id, "method": method,
+                             "flags": flags, "args": args, "kwargs": kwargs, "t_enqueue": time.time()})
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def serve(self, d):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o777)
+        server.listen(8)
+        server.settimeout(0.5)
+
+        self.running = True
+        worker_thread = threading.Thread(target=self.worker, daemon=True)
+        worker_thread.start()
+        print(f"Serial Broker listening on {self.socket_path}")
+
+        last_stats_time = time.time()
+        try:
+            while not d["stop"]:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    conn = None
+                if conn:
+                    threading.Thread(target=self.handle_client, args=(conn,), daemon=True).start()
+                if time.time() - last_stats_time >= STATS_PRINT_PERIOD:
+                    last_stats_time = time.time()
+                    self.printStats()
+        finally:
+            self.running = False
+            server.close()
+            worker_thread.join(timeout=2)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+class BrokerClient:
+    '''
+    Thin RPC client. Any method listed for the target in the method tables can be called directly on the client,
+    ex: client.setPanGoalVelocity(2), client.setAngles(pan=10, tilt=5)
+    Methods in ONEWAY_METHODS return None straight away, the others block until the broker answers.
+    The connection is opened lazily (and reopened after a fork) and retried until the broker is up.
+    '''
+    def __init__(self, target, socket_path=SOCKET_PATH, timeout=30.0):
+        self._target = target
+        self._socket_path = socket_path
+        self._timeout = timeout
+        self._sock = None
+        self._pid = None
+        self._req_id = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._sock is not None and self._pid == os.getpid():
+            return
+        self._sock = None
+        printed = False
+        while True:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self._timeout)
+                sock.connect(self._socket_path)
+                break
+            except OSError:
+                sock.close()
+                if not printed:
+                    print(f"Waiting for Serial Broker on {self._socket_path}")
+                    printed = True
+                time.sleep(0.2)
+        self._sock = sock
+        self._pid = os.getpid()
+
+    def _call(self, name, *args, **kwargs):
+        method = METHOD_IDS[(self._target, name)]
+        payload = pack_value((args, kwargs), bytearray())
+        oneway = (self._target, name) in ONEWAY_METHODS
+        with self._lock:
+            self._connect()
+            self._req_id = (self._req_id + 1) & 0xFFFFFFFF
+            req_id = self._req_id
+            try:
+                self._sock.sendall(REQUEST_HEADER.pack(req_id, method, FLAG_ONEWAY if oneway else 0, len(payload)) + payload)
+                if oneway:
+                    return None
+                while True:
+                    header = recv_exactly(self._sock, RESPONSE_HEADER.size)
+                    resp_id, status, length = RESPONSE_HEADER.unpack(header)
+                    data = recv_exactly(self._sock, length) if length else b''
+                    if resp_id == req_id:
+                        break
+            except (ConnectionError, OSError) as e:
+                self._sock.close()
+                self._sock = None
+                print(f"Error in comm with Serial Broker {e}")
+                return None
+
+        result, _ = unpack_value(data) if length else (None, 0)
+        if status == STATUS_SUPERSEDED:
+            return None
+        if status != STATUS_OK:
+            print(f"Serial Broker error on {name}: {result}")
+            return None
+        return result
+
+    def __getattr__(self, name):
+        if (self._target, name) not in METHOD_IDS:
+            raise AttributeError(f"{self._target} has no method {name}")
+        return functools.partial(self._call, name)
+
+
+def FrontBoardClient(socket_path=SOCKET_PATH):
+    return BrokerClient("frontboard", socket_path)
+
+def ZoomClient(socket_path=SOCKET_PATH):
+    return BrokerClient("zoom", socket_path)
+
+def BrokerStatsClient(socket_path=SOCKET_PATH):
+    return BrokerClient("broker", socket_path)
+
+
+def main(d):
+    broker = SerialBroker()
+    try:
+        broker.serve(d)
+    except KeyboardInterrupt:
+        d["stop"] = True
+    print("Serial Broker stopped")
+
+if __name__ == "__main__":
+    main({"stop": False})
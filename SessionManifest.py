@@ -0,0 +1,285 @@
+import os
+import json
+import math
+import shutil
+import time
+import threading
+
+'''
+Session clip manifests and the session index, instead of listing the video folders and guessing from file names.
+
+Both are append-only JSON lines files: each line updates one record (a clip of the session, keyed by "clip", or a
+session of the index, keyed by "session") and later lines win, so writers from different processes only ever append
+a line. A file is read once when opened (O(k) for k clips), then queries don't touch the filesystem.
+
+Clip record: clip (number), file, path, status (pending until the clip worker is done, then done / failed / dropped),
+bytes, duration, wave_start, wave_end (epoch), gps (GpsSummary of the wave), upload (pending, uploading, uploaded,
+failed), plus the clip worker fields (attempts, clip_seconds, start_offset, delay, error), the previews
+(ClipPreviews.py) and the telemetry sidecars (Trajectory.py). Each of CLIP_OUTPUTS is {"path", "bytes", ...} with its
+own upload state. Clips recorded before the manifests existed are migrated from their folder (legacy, no wave times).
+'''
+
+MANIFEST_DIRECTORY = "/home/idmind/surfcamera_deploy_test/manifests"
+VIDEOS_DIRECTORY = "/home/idmind/surfcamera_deploy_test/videos"
+INDEX_FILE = "index.jsonl"
+IN_PROGRESS = ("pending", "queued", "running", "retrying")
+NO_SESSION = "other"    # Folder, manifest and index name of the recordings made without a session (SessionID -1)
+CLIP_OUTPUTS = ("thumbnail", "preview", "proxy", "telemetry", "gpx")    # Files made from each clip
+
+def session_name(session_id):
+    '''
+    Folder, manifest and index name of a WebApp.SessionID (int or str, -1 without a session)
+    '''
+    session = str(session_id)
+    return NO_SESSION if session == "-1" else session
+
+def read_records(path, key):
+    records = {}
+    read_new_records(path, key, records)
+    return records
+
+def read_new_records(path, key, records, offset=0):
+    '''
+    Updates records with the lines from offset on, returns the offset after the last complete line
+    '''
+    try:
+        with open(path, "rb") as fp:
+            fp.seek(offset)
+            for line in fp:
+                if not line.endswith(b"\n"):
+                    break       # Being written, read on the next call
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue    # Last line cut by a power loss
+                records.setdefault(entry[key], {}).update(entry)
+    except FileNotFoundError:
+        pass
+    return offset
+
+def append_record(path, entry):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as fp:
+        fp.write(json.dumps(entry) + "\n")
+
+class SessionManifest():
+
+    def __init__(self, session, directory=MANIFEST_DIRECTORY):
+        self.session = str(session)
+        self.path = os.path.join(directory, f"{self.session}.jsonl")
+        self.lock = threading.Lock()
+        self.records = read_records(self.path, "clip")
+
+    def reload(self):
+        '''
+        Re-read the file, for the changes made by other processes
+        '''
+        records = read_records(self.path, "clip")
+        with self.lock:
+            self.records = records
+
+    def record(self, clip, **fields):
+        entry = dict(fields, clip=clip)
+        with self.lock:
+            append_record(self.path, entry)
+            self.records.setdefault(clip, {}).update(entry)
+
+    def clips(self, status=None):
+        '''
+        Clip records in clip number order (only the ones with status when given)
+        '''
+        with self.lock:
+            records = [dict(r) for _, r in sorted(self.records.items())]
+        return [r for r in records if status is None or r.get("status") == status]
+
+    def clip_count(self):
+        return len(self.clips(status="done"))
+
+    def next_clip(self):
+        '''
+        Number for the next clip (numbers of failed or dropped clips aren't reused)
+        '''
+        with self.lock:
+            return max(self.records) + 1 if self.records else 0
+
+    def size(self):
+        '''
+        Bytes of the finished clips, their previews and telemetry
+        '''
+        total = 0
+        for r in self.clips():
+            total += r.get("bytes") or 0
+            total += sum(r[o].get("bytes", 0) for o in CLIP_OUTPUTS if isinstance(r.get(o), dict))
+        return total
+
+    def in_progress(self):
+        return len([r for r in self.clips() if r.get("status") in IN_PROGRESS])
+
+    def set_upload_state(self, clip, state, output=None):
+        '''
+        Upload state of the clip, or of one of its CLIP_OUTPUTS
+        '''
+        if output is None:
+            self.record(clip, upload=state)
+        else:
+            self.record(clip, **{f"{output}_upload": state})
+
+    def remove_incomplete(self):
+        '''
+        Delete the files left by clips that failed or were dropped. Clips still in progress are kept: a clip worker
+        may be writing them (stop_session only waits for them up to a timeout)
+        '''
+        for r in self.clips():
+            if r.get("status") in ("failed", "dropped") and r.get("path") and os.path.exists(r["path"]):
+                print(f"Deleting unfinished clip: {r['path']}")
+                os.remove(r["path"])
+
+class SessionIndex():
+    '''
+    Every session recorded on this camera: created, updated (last clip), uploaded (epoch, when all clips are), bytes
+    (clips and previews, kept up to date by the Camera)
+    '''
+    def __init__(self, directory=MANIFEST_DIRECTORY, videos_directory=VIDEOS_DIRECTORY):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILE)
+        self.videos_directory = videos_directory
+        if not os.path.exists(self.path):
+            self.migrate()
+        self.records = {}
+        self.offset = read_new_records(self.path, "session", self.records)
+        self.inode = self.file_id()
+
+    def file_id(self):
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        '''
+        Reads the lines appended by the other processes since the last read (all of it after a compaction)
+        '''
+        inode = self.file_id()
+        if inode != self.inode:
+            self.inode = inode
+            self.records = {}
+            self.offset = 0
+        self.offset = read_new_records(self.path, "session", self.records, self.offset)
+
+    def migrate(self):
+        '''
+        One time listing of the video folders recorded before the index existed. Their clips (N.mp4) get a manifest
+        too, so the sessions not uploaded yet can still be uploaded
+        '''
+        if not os.path.isdir(self.videos_directory):
+            return
+        for session in sorted(os.listdir(self.videos_directory)):
+            folder = os.path.join(self.videos_directory, session)
+            if os.path.isdir(folder):
+                mtime = os.path.getmtime(folder)
+                size = self.migrate_clips(session, folder)
+                append_record(self.path, {"session": session, "created": mtime, "updated": mtime, "bytes": size})
+        print(f"Session index created from {self.videos_directory}")
+
+    def migrate_clips(self, session, folder):
+        '''
+        Writes the manifest of a session recorded before the manifests, from its clip files. Returns their bytes
+        '''
+        manifest = SessionManifest(session, directory=self.directory)
+        if manifest.records:
+            return manifest.size()      # Already there, only done once
+        clips = []
+        for name in os.listdir(folder):
+            stem, extension = os.path.splitext(name)
+            path = os.path.join(folder, name)
+            if extension == ".mp4" and stem.isdigit() and os.path.getsize(path) > 0:
+                clips.append((int(stem), name, path))
+        for clip, name, path in sorted(clips):
+            mtime = os.path.getmtime(path)
+            manifest.record(clip, file=name, path=path, status="done", bytes=os.path.getsize(path), duration=None,
+                            wave_start=None, wave_end=round(mtime, 3), gps={}, upload="pending", legacy=True)
+        return manifest.size()
+
+    def update(self, session, **fields):
+        entry = dict(fields, session=str(session))
+        append_record(self.path, entry)
+        self.records.setdefault(entry["session"], {}).update(entry)
+
+    def register(self, session):
+        self.refresh()
+        if str(session) not in self.records or self.records[str(session)].get("deleted"):
+            now = time.time()
+            self.update(session, created=now, updated=now, bytes=0, deleted=False)
+
+    def sessions(self):
+        '''
+        Session records, oldest first
+        '''
+        records = [dict(r) for r in self.records.values() if not r.get("deleted")]
+        return sorted(records, key=lambda r: r.get("created", 0))
+
+    def remove(self, session):
+        self.update(session, deleted=True)
+
+    def delete(self, session):
+        '''
+        Deletes the session video folder and manifest, and removes it from the index
+        '''
+        session = str(session)
+        shutil.rmtree(os.path.join(self.videos_directory, session), ignore_errors=True)
+        manifest = os.path.join(self.directory, f"{session}.jsonl")
+        if os.path.exists(manifest):
+            os.remove(manifest)
+        self.remove(session)
+
+    def compact(self):
+        '''
+        Rewrite the index with one line per live session (only when no other process is writing, ex: at boot)
+        '''
+        self.refresh()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fp:
+            for record in self.sessions():
+                fp.write(json.dumps(record) + "\n")
+        os.replace(tmp, self.path)
+        self.records = {}
+        self.offset = read_new_records(self.path, "session", self.records)
+        self.inode = self.file_id()
+
+class GpsSummary():
+    '''
+    Tracker fixes received during a wave, summarised for the manifest
+    '''
+    def __init__(self):
+        self.fixes = 0
+        self.first = None
+        self.last = None
+        self.distance = 0
+        self.max_speed = 0
+
+    def add(self, t, latitude, longitude):
+        if self.last is not None:
+            lt, lat, lon = self.last
+            if t <= lt:
+                return
+            dy = (latitude - lat) * 111000
+            dx = (longitude - lon) * 111000 * math.cos(math.radians(lat))
+            step = math.hypot(dx, dy)
+            self.distance += step
+            self.max_speed = max(self.max_speed, step / (t - lt))
+        else:
+            self.first = (t, latitude, longitude)
+        self.last = (t, latitude, longitude)
+        self.fixes += 1
+
+    def summary(self):
+        if not self.fixes:
+            return {"fixes": 0}
+        return {
+            "fixes": self.fixes,
+            "start": [self.first[1], self.first[2]],
+            "end": [self.last[1], self.last[2]],
+            "distance_m": round(self.distance, 1),
+            "max_speed_ms": round(self.max_speed, 2),
+        }
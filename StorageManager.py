@@ -0,0 +1,160 @@
+import os
+import time
+import shutil
+import db
+import SessionManifest
+
+'''
+Keeps the SD card from filling up during a session.
+
+Every CHECK_PERIOD seconds the free space of the filesystem (statvfs) and the bytes of the recorded sessions (from the
+session index, kept up to date by the Camera, read incrementally: no folder is listed) are compared with the quota and
+the watermarks. Above the high watermark (or below MIN_FREE_BYTES free) sessions are deleted, oldest first, until the
+low watermark (and TARGET_FREE_BYTES free) is reached:
+    1. sessions already uploaded, and the recordings made outside a session (never uploaded)
+    2. only when the card is about to be full, sessions not uploaded yet (but not while uploading)
+The active session is never deleted. start_session is refused without SESSION_HEADROOM_BYTES of free space and quota.
+'''
+
+STORAGE_DIRECTORY = "/home/idmind/surfcamera_deploy_test"
+GPS_LOGS_DIRECTORY = "/home/idmind/surfcamera_deploy_test/gps_logs"
+QUOTA_BYTES = 48 * 1024**3          # Sessions (clips and previews) at most
+HIGH_WATERMARK = 0.90               # Fraction of the quota used that starts the eviction...
+LOW_WATERMARK = 0.75                # ...down to this fraction
+MIN_FREE_BYTES = 4 * 1024**3        # Free space that starts the eviction...
+TARGET_FREE_BYTES = 8 * 1024**3     # ...up to this much free
+SESSION_HEADROOM_BYTES = 4 * 1024**3    # Free space and quota needed to start a session
+CHECK_PERIOD = 10
+OUTSIDE_SESSION = SessionManifest.NO_SESSION     # Camera folder for the recordings without a SessionID
+
+def session_headroom(stats):
+    '''
+    (True, "") when a session can start, else (False, reason). Free space is read now, the session bytes from the
+    last stats published by the storage manager (storage_stats)
+    '''
+    free = shutil.disk_usage(STORAGE_DIRECTORY).free
+    if free < SESSION_HEADROOM_BYTES:
+        return False, f"only {free / 1024**3:.1f} GB free"
+    used = (stats or {}).get("session_bytes")
+    if used is not None and QUOTA_BYTES - used < SESSION_HEADROOM_BYTES:
+        return False, f"session quota full ({used / 1024**3:.1f} of {QUOTA_BYTES / 1024**3:.0f} GB)"
+    return True, ""
+
+def folder_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class StorageManager():
+
+    def __init__(self, index, webapp=None):
+        self.index = index      # SessionManifest.SessionIndex
+        self.webapp = webapp
+        self.stats = {"evicted": 0, "evicted_bytes": 0, "last_evicted": None}
+
+    def measure_unknown(self):
+        '''
+        One time measure of the sessions recorded before the index kept their size
+        '''
+        for record in self.index.sessions():
+            if "bytes" not in record:
+                size = folder_size(os.path.join(self.index.videos_directory, record["session"]))
+                self.index.update(record["session"], bytes=size)
+
+    def session_bytes(self):
+        return sum(r.get("bytes") or 0 for r in self.index.sessions())
+
+    def over_high(self, free, used):
+        return used > QUOTA_BYTES * HIGH_WATERMARK or free < MIN_FREE_BYTES
+
+    def under_low(self, free, used):
+        return used <= QUOTA_BYTES * LOW_WATERMARK and free >= TARGET_FREE_BYTES
+
+    def candidates(self, active, free):
+        '''
+        Sessions that can be deleted, in eviction order
+        '''
+        sessions = [r for r in self.index.sessions() if r["session"] not in active]
+        first = [r for r in sessions if r.get("uploaded") or self.outside_session(r["session"])]
+        if free >= MIN_FREE_BYTES:
+            return first
+        rest = [r for r in sessions if r not in first and not self.uploading(r["session"])]
+        return first + rest
+
+    def outside_session(self, session):
+        # "-1": folder of the recordings outside a session made before the name was shared
+        return SessionManifest.session_name(session) == OUTSIDE_SESSION
+
+    def uploading(self, session):
+        manifest = SessionManifest.SessionManifest(session, directory=self.index.directory)
+        return any(r.get("upload") == "uploading" for r in manifest.clips())
+
+    def delete(self, record):
+        session = record["session"]
+        print(f"Storage: deleting session {session} ({(record.get('bytes') or 0) / 1024**2:.0f} MB, "
+              f"{'uploaded' if record.get('uploaded') or self.outside_session(session) else 'NOT uploaded'})")
+        self.index.delete(session)
+        shutil.rmtree(os.path.join(GPS_LOGS_DIRECTORY, session), ignore_errors=True)
+        self.stats["evicted"] += 1
+        self.stats["evicted_bytes"] += record.get("bytes") or 0
+        self.stats["last_evicted"] = session
+
+    def check(self, active):
+        '''
+        Evicts sessions if needed (never the ones in active), returns the stats
+        '''
+        t = time.monotonic()
+        self.index.refresh()
+        self.measure_unknown()
+        free = shutil.disk_usage(STORAGE_DIRECTORY).free
+        used = self.session_bytes()
+        if self.over_high(free, used):
+            for record in self.candidates(active, free):
+                if self.under_low(free, used):
+                    break
+                self.delete(record)
+                free = shutil.disk_usage(STORAGE_DIRECTORY).free
+                used = self.session_bytes()
+        stats = dict(self.stats, free_bytes=free, session_bytes=used, quota_bytes=QUOTA_BYTES,
+                     sessions=len(self.index.sessions()), check_seconds=round(time.monotonic() - t, 3))
+        stats["headroom"] = free >= SESSION_HEADROOM_BYTES and QUOTA_BYTES - used >= SESSION_HEADROOM_BYTES
+        if self.webapp is not None:
+            if free < MIN_FREE_BYTES:
+                self.webapp.set_error("storage", f"Storage: only {free / 1024**3:.1f} GB free")
+            elif not stats["headroom"]:
+                self.webapp.set_error("storage", "Storage: quota full, sessions waiting for upload")
+            else:
+                self.webapp.clear_error("storage")
+        return stats
+
+def active_sessions(webapp):
+    '''
+    Session the Camera records into (the same name as its folder)
+    '''
+    return {SessionManifest.session_name(webapp.SessionID)}
+
+def main(d):
+    conn = db.get_connection()
+    webapp = db.WebApp(conn)
+    camera_state = db.CameraState(conn)
+    manager = StorageManager(SessionManifest.SessionIndex(), webapp)
+    last_check = 0
+    try:
+        while not d["stop"]:
+            time.sleep(0.5)
+            if time.monotonic() - last_check > CHECK_PERIOD:
+                last_check = time.monotonic()
+                try:
+                    camera_state.storage_stats = manager.check(active_sessions(webapp))
+                except OSError as e:
+                    print(f"Storage check failed: {e}")
+    except KeyboardInterrupt:
+        d["stop"] = True
+
+if __name__ == "__main__":
+    main({"stop": False})
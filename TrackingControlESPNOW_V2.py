@@ -3,8 +3,12 @@ import math
 import utils
 import time
 import numpy as np
+import SerialBroker
+import ZoomCurves
+import ZoomPlanner
+import Trajectory
+import SessionManifest
 import IOBoardDriver as GPIO
-import Zoom_CBN8125 as ZoomController
 from utils import Location
 from collections import deque
 import json
@@ -25,15 +29,14 @@ gps_points = db.GPSData(conn)
 commands = db.Commands(conn)
 cam_state = db.CameraState(conn)
 webapp = db.WebApp(conn)
+serial_ports = db.SerialPorts(conn)
 webapp.IsPaired = False
 autorec = AutoRecordingController(cam_state, gps_points)
+trajectory = Trajectory.TrajectoryWriter()     # Fixes of the session, sliced into each clip's telemetry
 
-IO = GPIO.FrontBoardDriver()
+IO = SerialBroker.FrontBoardClient()     # Serial ports are owned by the SerialBroker process
 
-Zoom = ZoomController.SoarCameraZoomFocus()
-
-lower_distance = 0
-upper_distance = 0
+Zoom = SerialBroker.ZoomClient()
 
 # Logging function to save the data
 def log_data(calculated_angle, actual_angle, pan_speed, file_path="recording_log.txt"):
@@ -42,21 +45,9 @@ def log_data(calculated_angle, actual_angle, pan_speed, file_path="recording_log
         log_file.write(f"{time.time()}, {calculated_angle}, {actual_angle}, {pan_speed}\n")
 
 
-distance_zoom_table = {
-    1:1,
-    15:1,
-    25:2,
-    50:4,
-    75:4.5,
-    100:5,
-    120:7,
-    140:9,
-    160:11,
-    215:13,
-    300:15,
-    600:25
-    # Add as many mappings as needed, making sure they are ordered
-}
+zoom_curves = ZoomCurves.get_curves()    # distance -> zoom level, from zoom_calibration/<camera model>.json
+zoom_planner = ZoomPlanner.ZoomPlanner(zoom_curves, Zoom, budget=commands.zoom_command_budget)
+autofocus = ZoomPlanner.StationaryAutofocus(Zoom)
 
 
 def normalize_angle(angle):
@@ -120,34 +111,22 @@ def tiltCalculations():
     return -tiltAngle
 
 def zoomCalculations():
-    global trackDistX
-    
-    # Find between which 2 mapped values trackDistx fits. This assumes distance_zoom_table is sorted
-    lower_distance = max([d for d in distance_zoom_table if d <= trackDistX], default=1)
-    upper_distance = min([d for d in distance_zoom_table if d >= trackDistX], default=15)
-    
-    if lower_distance == upper_distance:
-        new_zoom_level = distance_zoom_table[lower_distance]
-    else:
-        # Interpolate trackDistx based on the distance_zoom_table lookup values
-        x0, y0 = lower_distance, distance_zoom_table[lower_distance]
-        x1, y1 = upper_distance, distance_zoom_table[upper_distance]
-        new_zoom_level = y0 + (trackDistX - x0) * (y1-y0) / (x1-x0)
-        new_zoom_level = round(new_zoom_level * commands.camera_zoom_multiplier, 2)
-
-    if commands.camera_zoom_value is None or abs(new_zoom_level - commands.camera_zoom_value) >= 0.25:
-        new_zoom_level = round(new_zoom_level, 2) 
-        Zoom.set_zoom_position(new_zoom_level)
-        commands.camera_zoom_value = new_zoom_level
+    '''
+    Steps the zoom planner with the real lens position (camera_zoom_value, from the zoom position inquiries).
+    The predicted range is updated on every tracker fix. Runs while recording too, with a lower zoom rate
+    '''
+    zoom_level = zoom_planner.step(time.time(), commands.camera_zoom_value, commands.camera_zoom_multiplier,
+                                   cam_state.is_recording)
+    if zoom_level is not None and (commands.camera_zoom_target is None or abs(zoom_level - commands.camera_zoom_target) >= 0.05):
+        commands.camera_zoom_target = round(zoom_level, 2)
         
-    return new_zoom_level
+    return zoom_level
 
 panBuffer = deque(maxlen=3)
 timeBuffer = deque(maxlen=3)
 
 def main(d):
     try:
-        Zoom = ZoomController.SoarCameraZoomFocus()
         CourseCal = utils.courseCalculator(gps_points)
         course = 0
         
@@ -167,8 +146,20 @@ def main(d):
         
         last_motor_update_time = 0
         MOTOR_UPDATE_FREQUENCY = 3 # Hz
+        last_zoom_update_time = 0
+        ZOOM_UPDATE_FREQUENCY = 10 # Hz, follows the lens position inquiries while zooming
+        currentzoom = None
+        focus_mode = None
+        
+        panCalibration = GPIO.PanCenterCalibration(IO) # Stepped every loop iteration while active
+        last_calibration_status = None
         
         logger.info("Starting Tracking System")
+        timings = serial_ports.startup_timings or {}
+        if "started_at" in timings:
+            serial_ports.record_startup_phase("boot_to_tracking_loop", time.time() - timings["started_at"])
+        panCalibration.start()  # Deferred from the driver start up, runs in the background of the tracking loop
+        boot_calibration_pending = True
         
         try:
             if int(gps_points.camera_origin['latitude']) == 38 : # Check if there's any calibration already done
@@ -190,6 +181,10 @@ def main(d):
                     IO.setBackPanelLEDs(first = True, second = True)
 
                 com_check_timer = time.time()
+
+                if commands.camera_focus_mode != focus_mode:
+                    focus_mode = commands.camera_focus_mode
+                    Zoom.set_focus_mode(focus_mode)
                     
             if commands.camera_calibrate_origin:         # Calibrate the camera origin coordinate
                 commands.camera_calibrate_origin = False
@@ -221,49 +216,89 @@ def main(d):
                 logger.info(f"Current Calibration ORIGIN {gps_points.camera_origin} ; Heading Angle {gps_points.camera_heading_angle}")
                 
             elif commands.start_pairing:
-                paired, pairing = IO.checkTrackerPairing()
-                commands.start_pairing = False
-                if not paired and not pairing:
-                    IO.cancelTrackerPairing()
-                    IO.startTrackerPairing()
-                    print("Pairing Process Start")
+                pairing_state = IO.checkTrackerPairing()
+                if pairing_state is None:
+                    print("Front board didn't answer the pairing check, retrying")     # start_pairing stays set
+                else:
+                    commands.start_pairing = False
+                    paired, pairing = pairing_state
+                    if not paired and not pairing:
+                        IO.cancelTrackerPairing()
+                        IO.startTrackerPairing()
+                        print("Pairing Process Start")
                     
             elif commands.cancel_pairing:
                 commands.cancel_pairing = False
-                paired, pairing = IO.checkTrackerPairing()
+                paired, pairing = IO.checkTrackerPairing() or (None, None)
                 if paired:
                     IO.cancelTrackerPairing()
                     print("Paired Tracker removed from memory")
                     
             elif commands.calibrate_pan_center:
                 commands.calibrate_pan_center = False
-                IO.calibratePanCenter()
+                if not panCalibration.active:
+                    panCalibration.start()
                 
             elif commands.check_pairing:
-                commands.check_pairing = False
-                paired, pairing = IO.checkTrackerPairing()
-                if paired:
+                pairing_state = IO.checkTrackerPairing()
+                paired, pairing = pairing_state or (None, None)
+                if pairing_state is None:
+                    print("Front board didn't answer the pairing check, retrying")     # check_pairing stays set
+                elif paired:
+                    commands.check_pairing = False
                     webapp.IsPaired = True
                     print("Tracker is Paired")
                 elif not paired and not pairing:
+                    commands.check_pairing = False
                     commands.start_pairing = True
                     webapp.IsPaired = False
                     print("No Tracker Paired. Starting Pairing Process")
                 else:
+                    commands.check_pairing = False
                     webapp.IsPaired = False
                     print("Tracker Pairing is Ongoing")
                     
+            if commands.cancel_pan_calibration:
+                commands.cancel_pan_calibration = False
+                panCalibration.cancel()
+                
+            if panCalibration.active:
+                panCalibration.step()
+            calibration_status = panCalibration.status()
+            if calibration_status != last_calibration_status:
+                commands.pan_calibration_status = calibration_status
+                last_calibration_status = calibration_status
+            if boot_calibration_pending and not panCalibration.active:
+                boot_calibration_pending = False
+                serial_ports.record_startup_phase("pan_calibration", time.time() - panCalibration.start_time)
+                if "started_at" in timings:
+                    serial_ports.record_startup_phase("boot_to_calibrated_tracking", time.time() - timings["started_at"])
+
+            if time.time() - last_zoom_update_time >= (1 / ZOOM_UPDATE_FREQUENCY):
+                last_zoom_update_time = time.time()
+                if commands.tracking_enabled and time.time() - last_read_time < 3 and not panCalibration.active:
+                    currentzoom = zoomCalculations()
+                    if focus_mode == "preset_af":
+                        autofocus.update(time.time(), zoom_planner.range_rate, panSpeed)
+                elif zoom_planner.predicted_range is not None:
+                    zoom_planner.stop(time.time())      # Tracking off or no fixes, hold the lens where it is
+
             if IO.getTrackerMessage():
                 t = time.time()
                 delta_time = t - last_read_time 
                 last_read_time = t
                 gps_points.last_gps_time = t
                             
-                if commands.tracking_enabled:
+                if panCalibration.active:
+                    pass        # Pan is homing, motion commands would fight the calibration
+                
+                elif commands.tracking_enabled:
                     panAngle = panCalculations()
                     tiltAngle = tiltCalculations()
-                    if not cam_state.is_recording:
-                        currentzoom = zoomCalculations()
+                    zoom_planner.update_range(t, trackDistX)
+                    session = SessionManifest.session_name(webapp.SessionID)
+                    trajectory.append(session, gps_points.latest_gps_data['latitude'], gps_points.latest_gps_data['longitude'],
+                                      panAngle, tiltAngle + gps_points.tilt_offset, currentzoom, epoch=t)
                     #course = CourseCal.updateCourse() # Surfer course in radians
 
                     # Before appending the new value check if it follows the previous Trend
@@ -336,11 +371,13 @@ def main(d):
                     timeBuffer.clear()
                                         
             else:       # No new readings, make sure pan doesnt keep on rotating endlessly
-                if time.time() - last_read_time >= 5:
+                if time.time() - last_read_time >= 5 and not panCalibration.active:
                     IO.setPanVelocityControl()
                     IO.setPanGoalVelocity(0)
                     #autorec.manualStopRecording()
                 
+        panCalibration.cancel()
+        trajectory.close()
         IO.setPanGoalVelocity(0)
         IO.setPanPositionControl()
         IO.setAngles(0,5,2,2)
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import struct
+import bisect
+import threading
+import subprocess
+import utils
+
+'''
+Surfer trajectory of a session, and the telemetry of each clip sliced from it.
+
+The tracking loop appends one fixed size binary record per tracker fix to gps_logs/<session>/trajectory.bin:
+monotonic time (the clock of the segment ring and the clips), epoch, latitude, longitude, speed (m/s, between fixes),
+pan, tilt (commanded, degrees) and zoom. The file is only appended to, so the reader (Camera process) keeps the record
+times in memory and only reads the records appended since its last read; a time range is found by bisection and read
+with a single seek, never by scanning the log.
+
+When a clip is done its clip worker writes the points between its first and last frame to <session folder>/telemetry,
+as JSON (compact, times relative to the clip start, for the WebApp to draw the ride path in sync with the video) and
+GPX (speed, pan, tilt and zoom as extensions), recorded in the session manifest under telemetry and gpx like the
+previews. With MUX_TELEMETRY they're also muxed into the clip as a mov_text subtitle track (one cue per fix), stream
+copied: the video isn't re-encoded.
+'''
+
+TRAJECTORY_DIRECTORY = "/home/idmind/surfcamera_deploy_test/gps_logs"
+TRAJECTORY_FILE = "trajectory.bin"
+RECORD = struct.Struct("<ddddffff")     # t, epoch, latitude, longitude, speed, pan, tilt, zoom
+FIELDS = ("t", "latitude", "longitude", "speed", "pan", "tilt", "zoom")
+MUX_TELEMETRY = False
+GPX_NAMESPACE = "https://surfcam.idmind.pt/gpx/telemetry/1"
+
+def trajectory_path(session, directory=TRAJECTORY_DIRECTORY):
+    return os.path.join(directory, str(session), TRAJECTORY_FILE)
+
+class TrajectoryWriter():
+    '''
+    Appends the tracker fixes to the trajectory of the current session (tracking process)
+    '''
+    def __init__(self, directory=TRAJECTORY_DIRECTORY):
+        self.directory = directory
+        self.session = None
+        self.fp = None
+        self.last = None
+        self.error = None   # Last write error, logged once
+
+    def open(self, session):
+        if self.fp is not None:
+            self.fp.close()
+        path = trajectory_path(session, self.directory)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Drop a record cut by a power loss, so the records stay aligned
+        if os.path.exists(path) and os.path.getsize(path) % RECORD.size:
+            with open(path, "r+b") as fp:
+                fp.truncate(os.path.getsize(path) - os.path.getsize(path) % RECORD.size)
+        self.fp = open(path, "ab", buffering=0)
+        self.session = session
+        self.last = None
+
+    def append(self, session, latitude, longitude, pan, tilt, zoom, t=None, epoch=None):
+        '''
+        Never raises: a failed write (card full, folder deleted by the StorageManager) is logged once and the file
+        reopened on the next fix, the tracking must go on without its telemetry
+        '''
+        t = time.monotonic() if t is None else t
+        epoch = time.time() if epoch is None else epoch
+        try:
+            if session != self.session:
+                self.open(session)
+            speed = 0
+            if self.last is not None and t > self.last[0]:
+                distance = utils.get_distance_between_locations(utils.Location(self.last[1], self.last[2]),
+                                                                utils.Location(latitude, longitude))
+                speed = distance / (t - self.last[0])
+            self.last = (t, latitude, longitude)
+            self.fp.write(RECORD.pack(t, epoch, latitude, longitude, speed, pan or 0, tilt or 0, zoom or 0))
+            self.error = None
+        except OSError as e:
+            if self.error is None:
+                print(f"Trajectory of session {session} not written: {e}")
+            self.error = str(e)
+            self.close()
+
+    def close(self):
+        if self.fp is not None:
+            try:
+                self.fp.close()
+            except OSError:
+                pass
+        self.fp = None
+        self.session = None
+
+class TrajectoryLog():
+    '''
+    Reader of a session trajectory, sliced by monotonic time (thread safe, used by the clip workers)
+    '''
+    def __init__(self, session, directory=TRAJECTORY_DIRECTORY):
+        self.path = trajectory_path(session, directory)
+        self.times = []     # Monotonic time of every record read so far
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        count = size // RECORD.size
+        if count <= len(self.times):
+            return
+        with open(self.path, "rb") as fp:
+            fp.seek(len(self.times) * RECORD.size)
+            data = fp.read((count - len(self.times)) * RECORD.size)
+        self.times.extend(r[0] for r in RECORD.iter_unpack(data))
+
+    def slice(self, start, end):
+        '''
+        Records with start <= t <= end, as tuples (t, epoch, latitude, longitude, speed, pan, tilt, zoom)
+        '''
+        with self.lock:
+            self.refresh()
+            first = bisect.bisect_left(self.times, start)
+            last = bisect.bisect_right(self.times, end)
+        if last <= first:
+            return []
+        with open(self.path, "rb") as fp:
+            fp.seek(first * RECORD.size)
+            data = fp.read((last - first) * RECORD.size)
+        return list(RECORD.iter_unpack(data))
+
+def srt_time(seconds):
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+def write_json(path, points, clip_start, clip_start_epoch):
+    data = {
+        "clip_start": round(clip_start_epoch, 3),
+        "fields": list(FIELDS),
+        "points": [[round(p[0] - clip_start, 2), round(p[2], 7), round(p[3], 7), round(p[4], 2), round(p[5], 2),
+                    round(p[6], 2), round(p[7], 2)] for p in points],
+    }
+    with open(path, "w") as fp:
+        json.dump(data, fp, separators=(",", ":"))
+
+def write_gpx(path, points, name):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             f'<gpx version="1.1" creator="surfcam" xmlns="http://www.topografix.com/GPX/1/1" xmlns:sc="{GPX_NAMESPACE}">',
+             f'<trk><name>{name}</name><trkseg>']
+    for p in points:
+        ms = int(round(p[1] * 1000))
+        stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ms // 1000)) + f".{ms % 1000:03d}Z"
+        lines.append(f'<trkpt lat="{p[2]:.7f}" lon="{p[3]:.7f}"><time>{stamp}</time><extensions>'
+                     f'<sc:speed>{p[4]:.2f}</sc:speed><sc:pan>{p[5]:.2f}</sc:pan><sc:tilt>{p[6]:.2f}</sc:tilt>'
+                     f'<sc:zoom>{p[7]:.2f}</sc:zoom></extensions></trkpt>')
+    lines.append('</trkseg></trk></gpx>')
+    with open(path, "w") as fp:
+        fp.write("\n".join(lines) + "\n")
+
+def output_paths(clip_path):
+    folder, name = os.path.split(clip_path)
+    stem = os.path.splitext(name)[0]
+    telemetry = os.path.join(folder, "telemetry")
+    return {
+        "telemetry": os.path.join(telemetry, f"{stem}_telemetry.json"),
+        "gpx": os.path.join(telemetry, f"{stem}.gpx"),
+        "subtitles": os.path.join(telemetry, f"{stem}_telemetry.srt"),
+        "muxed": os.path.join(telemetry, f"{stem}_muxed.mp4"),
+    }
+
+def write_srt(path, points, clip_start, clip_end):
+    with open(path, "w") as fp:
+        for i, p in enumerate(points):
+            start = p[0] - clip_start
+            end = (points[i + 1][0] if i + 1 < len(points) else clip_end) - clip_start
+            fp.write(f"{i + 1}\n{srt_time(max(start, 0))} --> {srt_time(max(end, 0))}\n"
+                     f"{p[2]:.6f},{p[3]:.6f} {p[4]:.1f} m/s pan {p[5]:.1f} tilt {p[6]:.1f} zoom {p[7]:.1f}\n\n")
+
+def mux_telemetry(clip_path, subtitles, muxed):
+    '''
+    Adds the subtitles to the clip as a mov_text track, stream copy (replaces the clip). Returns the error or None
+    '''
+    command = ['ffmpeg', '-y', '-nostats', '-loglevel', 'error', '-i', clip_path, '-i', subtitles,
+               '-map', '0', '-map', '1', '-c', 'copy', '-c:s', 'mov_text',
+               '-metadata:s:s:0', 'handler_name=telemetry', '-movflags', '+faststart', muxed]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+        error = None
+        if result.returncode != 0:
+            lines = result.stderr.decode('utf-8', 'replace').strip().splitlines()
+            error = lines[-1] if lines else f"exit code {result.returncode}"
+    except subprocess.TimeoutExpired:
+        error = "timed out"
+    if error is None and os.path.exists(muxed) and os.path.getsize(muxed) > 0:
+        os.replace(muxed, clip_path)
+        return None
+    if os.path.exists(muxed):
+        os.remove(muxed)
+    return error or "empty output"
+
+def clip_telemetry(trajectory, clip_path, clip_start, clip_end, wall_offset, mux=None):
+    '''
+    Writes the telemetry sidecars of a clip (clip_start / clip_end monotonic), and muxes it when mux (default
+    MUX_TELEMETRY). Returns the manifest fields: telemetry {"path" (JSON), "bytes", "points", "track"} and gpx
+    {"path", "bytes"}
+    '''
+    points = trajectory.slice(clip_start, clip_end)
+    paths = output_paths(clip_path)
+    os.makedirs(os.path.dirname(paths["telemetry"]), exist_ok=True)
+    write_json(paths["telemetry"], points, clip_start, clip_start + wall_offset)
+    write_gpx(paths["gpx"], points, os.path.splitext(os.path.basename(clip_path))[0])
+    track = False
+    if (MUX_TELEMETRY if mux is None else mux) and points:
+        write_srt(paths["subtitles"], points, clip_start, clip_end)
+        error = mux_telemetry(clip_path, paths["subtitles"], paths["muxed"])
+        os.remove(paths["subtitles"])
+        track = error is None
+        if error:
+            print(f"FFMPEG error while adding the telemetry track to {clip_path}: {error}")
+    return {
+        "telemetry": {"path": paths["telemetry"], "bytes": os.path.getsize(paths["telemetry"]), "points": len(points),
+                      "track": track},
+        "gpx": {"path": paths["gpx"], "bytes": os.path.getsize(paths["gpx"])},
+    }
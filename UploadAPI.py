@@ -1,6 +1,7 @@
 import os
 import requests
 import time
+import SessionManifest
 
 def upload_file_to_gcs(object_location, session_uri):
     """
@@ -9,6 +10,9 @@ def upload_file_to_gcs(object_location, session_uri):
     Args:
         object_location (str): The path to the local file to be uploaded.
         session_uri (str): The session URI for the resumable upload.
+
+    Returns:
+        bool: True when the upload completed.
     """
     # Get the size of the file for the 'Content-Length' header
     headers = {
@@ -22,9 +26,10 @@ def upload_file_to_gcs(object_location, session_uri):
         # Print the response status
         if response.status_code in (200, 201):
             print("Upload successful!")
+            return True
         elif response.status_code in (308, 500, 503):
             print("Upload Incomplete, please continue uploading the data")
-            resume_upload(session_uri, object_location, response)
+            return resume_upload(session_uri, object_location, response)
         else:
             print(f"Failed to upload: {response.status_code}")
             print(response.text)
@@ -33,6 +38,7 @@ def upload_file_to_gcs(object_location, session_uri):
         print(f"Error: The file '{object_location}' was not found.")
     except Exception as e:
         print(f"An error occurred: {e}")
+    return False
 
 
 def check_upload_status(session_uri):
@@ -80,6 +86,9 @@ def resume_upload(session_uri, object_location, status_response):
         session_uri (str): The session URI for the resumable upload.
         object_location (str): The path to the local file to resume uploading.
         status_response (Response): The response from the initial upload attempt that returned a 308 status.
+
+    Returns:
+        bool: True when the upload completed.
     """
     # Retrieve the 'Range' header from the 308 response
     range_header = status_response.headers.get('Range')
@@ -92,8 +101,7 @@ def resume_upload(session_uri, object_location, status_response):
     else:
         # If no Range header, start from the beginning
         print("No range header, starting from the beginning")
-        upload_file_to_gcs(object_location, session_uri)
-        return 
+        return upload_file_to_gcs(object_location, session_uri)
 
     # Calculate the remaining bytes to upload
     total_file_size = os.path.getsize(object_location)
@@ -113,9 +121,10 @@ def resume_upload(session_uri, object_location, status_response):
     # Check the upload response
     if upload_response.status_code in (200, 201):
         print("Upload successfully resumed and completed!")
-    else:
-        print(f"Failed to resume upload: {upload_response.status_code}")
-        print(upload_response.text)
+        return True
+    print(f"Failed to resume upload: {upload_response.status_code}")
+    print(upload_response.text)
+    return False
 
 def validate_upload_route(session_uri, timeout=5):
     """
@@ -141,36 +150,59 @@ def validate_upload_route(session_uri, timeout=5):
     except requests.exceptions.RequestException as e:
         return False
 
-def upload_videos_in_directory(session_uris, directory_path):
+def upload_session_previews(preview_uris, manifest):
     """
-    Iterates through each video file in a specified directory and uploads them using the
-    upload_file_to_gcs() function, with each file being uploaded to a different URL from session_uris.
+    Uploads the previews and telemetry (SessionManifest.CLIP_OUTPUTS) of the finished clips that have them and weren't uploaded yet.
+    The URIs of each output are paired with the finished clips in clip number order, like the clips.
 
     Args:
-        session_uris (list): A list of session URIs (URLs) for uploading.
-        directory_path (str): The path to the directory containing video files.
+        preview_uris (dict): Output name -> list of session URIs.
+        manifest (SessionManifest.SessionManifest): The manifest of the session.
     """
-    if not os.path.exists(directory_path):
-        print(f"Directory {directory_path} does not exist.")
-        return
+    manifest.reload()
+    clips = manifest.clips(status="done")
+    for output, uris in preview_uris.items():
+        for clip, session_uri in zip(clips, uris or []):
+            if not clip.get(output) or clip.get(f"{output}_upload") == "uploaded":
+                continue
+            print(f"Uploading {output} of clip {clip['clip']}")
+            manifest.set_upload_state(clip["clip"], "uploading", output=output)
+            ok = upload_file_to_gcs(clip[output]["path"], session_uri)
+            manifest.set_upload_state(clip["clip"], "uploaded" if ok else "failed", output=output)
+
+def upload_session_clips(session_uris, manifest, preview_uris=None):
+    """
+    Uploads the finished clips of a session, in clip number order, each to the session URI at the same position,
+    and records the upload state of each clip in the session manifest.
+    The clip previews ready are uploaded first, so the WebApp can show them while the full clips are uploading, and
+    the ones made meanwhile after the clips.
 
-    # Get a list of video files in the directory
-    video_files = [file_name for file_name in os.listdir(directory_path)
-                   if os.path.isfile(os.path.join(directory_path, file_name)) and file_name.lower().endswith(('.mp4', '.mkv', '.avi', '.mov'))]
+    Args:
+        session_uris (list): A list of session URIs (URLs) for uploading.
+        manifest (SessionManifest.SessionManifest): The manifest of the session.
+        preview_uris (dict): Optional, output name (SessionManifest.CLIP_OUTPUTS) -> list of session URIs.
+    """
+    manifest.reload()
+    clips = manifest.clips(status="done")
 
-    # Check if the number of session URIs matches the number of video files
-    if len(session_uris) != len(video_files):
-        print(f"Warning: The number of session URIs ({len(session_uris)}) does not match the number of video files ({len(video_files)}).")
+    # Check if the number of session URIs matches the number of clips
+    if len(session_uris) != len(clips):
+        print(f"Warning: The number of session URIs ({len(session_uris)}) does not match the number of clips ({len(clips)}).")
         return
 
-    # Loop through each video file and its corresponding session URI
-    i = 1
-    for file_name, session_uri in zip(video_files, session_uris):
-        file_path = os.path.join(directory_path, file_name)
+    if preview_uris:
+        upload_session_previews(preview_uris, manifest)
+    uploaded = 0
+    for i, (clip, session_uri) in enumerate(zip(clips, session_uris), start=1):
         print(f"Uploading file {i}/{len(session_uris)}")
-        i = i+1
-        # Call the upload function for each file
-        upload_file_to_gcs(file_path, session_uri)
+        manifest.set_upload_state(clip["clip"], "uploading")
+        ok = upload_file_to_gcs(clip["path"], session_uri)
+        manifest.set_upload_state(clip["clip"], "uploaded" if ok else "failed")
+        uploaded += ok
+    if preview_uris:
+        upload_session_previews(preview_uris, manifest)
+    if uploaded and uploaded == len(clips):     # Nothing uploaded isn't uploaded (StorageManager deletes those first)
+        SessionManifest.SessionIndex().update(manifest.session, uploaded=time.time())
 
 def test():
     file_path = r'C:\Users\Tiago Jesus\Videos\teste.avi'
@@ -0,0 +1,70 @@
+import SessionManifest
+
+'''
+Wave intervals over the continuous recording.
+
+Wave events are {"wave": id, "event": "start" or "end", "t": time.monotonic() of the event}, pushed by any process
+on camera_state.wave_events (the monotonic clock is shared by the processes, and is the segment ring clock). Waves
+with different ids are independent: they can overlap (two surfers, or a second wave before the first one's clip is
+done) or follow each other back to back. Each open wave pins the ring from its start minus the pre-roll, and when it
+ends its interval becomes a clip of its own (ClipWorkers.ClipJob), extracted from the same segments.
+
+In production the only wave is "auto" (camera_state.start_recording, set by AutoRecording and the control panel), so
+waves only follow each other; overlapping waves need a producer of per-surfer events on camera_state.wave_events.
+'''
+
+class Wave():
+    def __init__(self, wave, start, pin):
+        self.wave = wave
+        self.start = start      # Monotonic seconds
+        self.end = None
+        self.pin = pin
+        self.gps = SessionManifest.GpsSummary()
+
+class WaveTracker():
+
+    def __init__(self, ring, pre_roll, min_duration):
+        self.ring = ring    # SegmentRing.SegmentRing
+        self.pre_roll = pre_roll
+        self.min_duration = min_duration
+        self.open = {}      # Wave id -> Wave
+        self.stats = {"started": 0, "ended": 0, "too_short": 0, "dropped": 0, "max_open": 0}
+
+    def start(self, wave, t):
+        '''
+        Opens the wave, False when it already is (repeated start)
+        '''
+        if wave in self.open:
+            return False
+        self.open[wave] = Wave(wave, t, self.ring.pin(t - self.pre_roll))
+        self.stats["started"] += 1
+        self.stats["max_open"] = max(self.stats["max_open"], len(self.open))
+        return True
+
+    def end(self, wave, t):
+        '''
+        Closes the wave: returns it with its interval, or None (not open, or too short: its footage is released)
+        '''
+        w = self.open.pop(wave, None)
+        if w is None:
+            print(f"Wave Event end without start ({wave}), ignoring")
+            return None
+        if t - w.start <= self.min_duration:
+            print("Wave Event too short, ignoring")
+            self.stats["too_short"] += 1
+            self.ring.unpin(w.pin)
+            return None
+        w.end = t
+        self.stats["ended"] += 1
+        return w
+
+    def add_fix(self, t, latitude, longitude):
+        for w in self.open.values():
+            w.gps.add(t, latitude, longitude)
+
+    def drop_all(self):
+        for w in self.open.values():
+            print(f"Wave Event dropped ({w.wave})")
+            self.ring.unpin(w.pin)
+            self.stats["dropped"] += 1
+        self.open = {}
@@ -141,12 +141,23 @@ def main(d):
         commands.calibrate_pan_center = True
         return jsonify({ "success": True, "message": "OK" })
     
+    @app.route('/cancel_pan_calibration', methods=["POST"])
+    def cancel_pan_calibration():
+        """Aborts an ongoing pan center calibration"""
+        print("flask cancel_pan_calibration")
+        commands.cancel_pan_calibration = True
+        return jsonify({ "success": True, "message": "OK" })
+    
+    @app.route('/get_pan_calibration_state', methods=["GET"])
+    def get_pan_calibration_state():
+        return jsonify({"success": True, "message": "OK", "state": commands.pan_calibration_status })
+    
     @app.route('/shutdown_surf')
     def shutdown_surf():
         """Route to shutdown system"""
         from subprocess import call
-        import IOBoardDriver as IO
-        frontboard = IO.FrontBoardDriver()
+        import SerialBroker
+        frontboard = SerialBroker.FrontBoardClient()
         frontboard.setShutdown(seconds=5)
         time.sleep(1)
         call("sudo shutdown -h now", shell=True)
@@ -173,7 +184,15 @@ def main(d):
     @app.route('/get_verticaldist_state', methods=["GET"])
     def get_verticaldist_state():
         return jsonify({"success": True, "message": "OK", "state": gps_points.camera_vertical_distance })
-    
+
+    @app.route('/get_recording_stats', methods=["GET"])
+    def get_recording_stats():
+        return jsonify({"success": True, "message": "OK", "state": camera_state.recording_stats, "clips": camera_state.clip_jobs })
+
+    @app.route('/get_storage_stats', methods=["GET"])
+    def get_storage_stats():
+        return jsonify({"success": True, "message": "OK", "state": camera_state.storage_stats })
+
     def start_server():
         print("starting server")
         app.run(host="0.0.0.0", port="5000", threaded=True)
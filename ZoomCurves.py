@@ -0,0 +1,198 @@
+import os
+import json
+import numpy as np
+
+'''
+Zoom curves compiled into dense lookup tables.
+
+Each curve is defined by calibration points, interpolated with a monotone cubic (PCHIP, so it never overshoots between
+points like a plain cubic spline would) and sampled once on a uniform grid. Evaluating is then an index computation
+plus a linear blend of two samples, O(1) whatever the number of calibration points. Monotone curves also get an
+inverse table (ex: raw lens position -> zoom level).
+
+The calibration points are loaded from zoom_calibration/<camera model>.json:
+    {
+        "model": "CBN8125",
+        "distance_to_zoom": [[distance_m, zoom], ...],
+        "zoom_to_position": [[zoom, lens_position], ...],
+        "zoom_to_focus": [[zoom, focus_position], ...],     (optional, sharp focus for the distance framed at that zoom)
+        "zoom_speed_rates": [lens position units per second for the VISCA zoom speeds 0 to 7]
+    }
+test_setup/fit_zoom_curve.py builds these point lists from measurements.
+'''
+
+CALIBRATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zoom_calibration")
+DEFAULT_MODEL = "CBN8125"
+
+
+def pchip_slopes(xs, ys):
+    '''
+    Fritsch-Carlson slopes for a monotone piecewise cubic Hermite interpolation
+    '''
+    h = np.diff(xs)
+    delta = np.diff(ys) / h
+    n = len(xs)
+    d = np.zeros(n)
+    if n == 2:
+        d[:] = delta[0]
+        return d
+    for k in range(1, n - 1):
+        if delta[k - 1] * delta[k] > 0:
+            w1 = 2 * h[k] + h[k - 1]
+            w2 = h[k] + 2 * h[k - 1]
+            d[k] = (w1 + w2) / (w1 / delta[k - 1] + w2 / delta[k])
+    # One sided three point estimates at the ends, limited to keep the shape
+    for k, h0, h1, m0, m1 in ((0, h[0], h[1], delta[0], delta[1]), (n - 1, h[-1], h[-2], delta[-1], delta[-2])):
+        slope = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+        if np.sign(slope) != np.sign(m0):
+            slope = 0.0
+        elif np.sign(m0) != np.sign(m1) and abs(slope) > abs(3 * m0):
+            slope = 3 * m0
+        d[k] = slope
+    return d
+
+def pchip_sample(xs, ys, grid):
+    '''
+    Evaluates the PCHIP interpolant of the points (xs, ys) at every value of grid (inside [xs[0], xs[-1]])
+    '''
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    d = pchip_slopes(xs, ys)
+    k = np.clip(np.searchsorted(xs, grid, side="right") - 1, 0, len(xs) - 2)
+    h = xs[k + 1] - xs[k]
+    t = (grid - xs[k]) / h
+    h00 = (1 + 2 * t) * (1 - t) ** 2
+    h10 = t * (1 - t) ** 2
+    h01 = t ** 2 * (3 - 2 * t)
+    h11 = t ** 2 * (t - 1)
+    return h00 * ys[k] + h10 * h * d[k] + h01 * ys[k + 1] + h11 * h * d[k + 1]
+
+
+class LookupCurve:
+    '''
+    Dense uniformly sampled table of a curve. Values outside the calibrated range are clamped to the ends.
+    '''
+    def __init__(self, x_start, step, samples):
+        self.x_start = float(x_start)
+        self.step = float(step)
+        self.inv_step = 1.0 / self.step
+        self.samples = [float(v) for v in samples]     # Plain floats: indexing a list is faster than numpy for scalars
+        self.last = len(self.samples) - 1
+        self.x_end = self.x_start + self.last * self.step
+
+    def __call__(self, x):
+        position = (x - self.x_start) * self.inv_step
+        if position <= 0:
+            return self.samples[0]
+        if position >= self.last:
+            return self.samples[self.last]
+        i = int(position)
+        frac = position - i
+        y0 = self.samples[i]
+        return y0 + (self.samples[i + 1] - y0) * frac
+
+
+class PchipCurve(LookupCurve):
+    '''
+    PCHIP interpolation of calibration points (any shape, PCHIP keeps the local extremes of the points)
+    '''
+    def __init__(self, points, step):
+        points = sorted((float(x), float(y)) for x, y in points)
+        xs = [x for x, _ in points]
+        if len(xs) < 2 or any(x1 <= x0 for x0, x1 in zip(xs, xs[1:])):
+            raise ValueError("A curve needs at least 2 points with distinct x values")
+        self.points = points
+        count = int(round((xs[-1] - xs[0]) / step)) + 1
+        self.grid = np.linspace(xs[0], xs[-1], count)
+        self.sampled = pchip_sample(xs, [y for _, y in points], self.grid)
+        LookupCurve.__init__(self, xs[0], self.grid[1] - self.grid[0], self.sampled)
+
+
+class MonotoneCurve(PchipCurve):
+    '''
+    PCHIP interpolation of non decreasing calibration points, with its inverse (for flat segments the inverse
+    returns the start of the segment)
+    '''
+    def __init__(self, points, step, inverse_step):
+        ys = [float(y) for _, y in sorted(points)]
+        if any(y1 < y0 for y0, y1 in zip(ys, ys[1:])):
+            raise ValueError("Calibration points must be non decreasing (see test_setup/fit_zoom_curve.py)")
+        PchipCurve.__init__(self, points, step)
+        grid = self.grid
+        count = len(grid)
+        samples = np.maximum.accumulate(self.sampled)    # Guard against rounding wiggles
+        LookupCurve.__init__(self, grid[0], grid[1] - grid[0], samples)
+
+        # Inverse: sample y uniformly and find x on the dense forward table
+        inverse_count = int(round((ys[-1] - ys[0]) / inverse_step)) + 1
+        y_grid = np.linspace(ys[0], ys[-1], inverse_count)
+        index = np.clip(np.searchsorted(samples, y_grid, side="left"), 1, count - 1)
+        y0, y1 = samples[index - 1], samples[index]
+        span = np.where(y1 > y0, y1 - y0, 1.0)
+        inverse = grid[index - 1] + np.clip((y_grid - y0) / span, 0, 1) * (grid[index] - grid[index - 1])
+        inverse[y_grid <= samples[0]] = grid[0]
+        self.inverse = LookupCurve(ys[0], y_grid[1] - y_grid[0], inverse)
+
+
+# Factory defaults, used when there's no calibration file for the camera model
+DEFAULT_CALIBRATION = {
+    "model": DEFAULT_MODEL,
+    "distance_to_zoom": [[1, 1], [15, 1], [25, 2], [50, 4], [75, 4.5], [100, 5], [120, 7], [140, 9], [160, 11],
+                         [215, 13], [300, 15], [600, 25]],
+    "zoom_to_position": [[1, 0], [2, 5350], [3, 8500], [4, 9850], [5, 11300],
+                         [6, 12250], [7, 12950], [8, 13550], [9, 14025], [10, 14420],
+                         [11, 14640], [12, 14840], [13, 15010], [14, 15155], [15, 15320],
+                         [16, 15475], [17, 15580], [18, 15670], [19, 15765], [20, 15860],
+                         [21, 15915], [22, 15970], [23, 16030], [24, 16120], [25, 16380]],
+    # Estimated from the full wide to tele travel time at each speed (used by ZoomPlanner to pick a speed)
+    "zoom_speed_rates": [550, 900, 1400, 2100, 2900, 3900, 5000, 6000],
+}
+
+def calibration_path(model=DEFAULT_MODEL):
+    return os.path.join(CALIBRATION_DIR, f"{model}.json")
+
+def load_calibration(model=DEFAULT_MODEL):
+    try:
+        with open(calibration_path(model)) as fp:
+            calibration = json.load(fp)
+        print(f"Zoom calibration loaded for {model}")
+        return calibration
+    except FileNotFoundError:
+        print(f"No zoom calibration file for {model}, using the factory defaults")
+        return DEFAULT_CALIBRATION
+
+class ZoomCurves:
+    '''
+    distance_to_zoom(m) -> zoom level, zoom_to_position(zoom) -> raw lens position and position_to_zoom(position)
+    zoom_to_focus(zoom) -> focus position, None when the camera has no focus calibration
+    '''
+    def __init__(self, calibration=None, model=DEFAULT_MODEL):
+        calibration = calibration or load_calibration(model)
+        self.model = calibration.get("model", model)
+        self.distance_to_zoom = MonotoneCurve(calibration["distance_to_zoom"], step=0.25, inverse_step=0.01)
+        self.zoom_to_position = MonotoneCurve(calibration["zoom_to_position"], step=0.005, inverse_step=4)
+        self.position_to_zoom = self.zoom_to_position.inverse
+        self.zoom_to_distance = self.distance_to_zoom.inverse
+        self.speed_rates = [float(r) for r in calibration.get("zoom_speed_rates", DEFAULT_CALIBRATION["zoom_speed_rates"])]
+        # Focus presets are only used once the focus curve was measured for the camera (test_setup/measure_zoom_focus.py)
+        focus_points = calibration.get("zoom_to_focus")
+        self.zoom_to_focus = PchipCurve(focus_points, step=0.005) if focus_points else None
+
+_curves = None
+
+def get_curves():
+    '''
+    Curves of the default camera model, compiled on first use and shared by the whole process
+    '''
+    global _curves
+    if _curves is None:
+        _curves = ZoomCurves()
+    return _curves
+
+def use_calibration(calibration):
+    '''
+    Replaces the process curves, ex: test_setup tools running the driver against an emulated lens
+    '''
+    global _curves
+    _curves = ZoomCurves(calibration)
+    return _curves
@@ -0,0 +1,227 @@
+import math
+from collections import deque
+
+'''
+Predictive zoom planner.
+
+The range to the surfer is predicted a short horizon ahead (linear fit of the recent fixes, covering the GPS and lens
+latency) and turned into a zoom level with the distance -> zoom curve. That goal is followed by a setpoint limited in
+zoom rate (slower while recording so the framing changes smoothly on video), and the lens is driven with variable
+speed zoom commands (VISCA Zoom Tele/Wide variable) chosen from the error between the setpoint and the lens position
+reported by the zoom position inquiry.
+
+Commands are only sent when the chosen speed or direction changes, within a budget of VISCA commands in any one
+second window. A speed command is only sent when there's room left for the stop that will follow it, so a stop is
+never delayed. Without lens feedback, or when the lens doesn't
+move while commanded, the planner falls back to Zoom Direct position commands.
+
+The lens is commanded through an object with the zoom driver methods set_zoom_speed(), stop_zoom() and
+set_zoom_position() (the SerialBroker ZoomClient), so test_setup/replay_zoom_planner.py can run the planner against a
+simulated lens.
+'''
+
+MIN_ZOOM = 1
+MAX_ZOOM = 25
+
+HISTORY = 1.5               # seconds of fixes used for the range rate
+HORIZON = 1.0               # seconds ahead the range is predicted
+MAX_RANGE_RATE = 15.0       # m/s, faster apparent range changes are GPS noise
+RATE_SMOOTHING = 0.3        # EMA factor of the range rate
+
+MAX_ZOOM_RATE = 4.0         # zoom levels per second of the setpoint
+MAX_ZOOM_RATE_RECORDING = 1.2
+MAX_SPEED = 7               # VISCA zoom speeds 0 to 7
+MAX_SPEED_RECORDING = 4
+RESPONSE_TIME = 0.6         # seconds to close the setpoint error, on top of the setpoint rate
+
+START_DEADBAND = 0.3        # zoom levels of error to start moving the lens
+STOP_DEADBAND = 0.05        # and to stop it
+DIRECT_DEADBAND = 0.25      # minimum change between Zoom Direct commands (fallback mode)
+
+FEEDBACK_STALL_TIME = 1.0   # seconds without lens position change while moving before falling back to Zoom Direct
+FEEDBACK_EXTRAPOLATION = 0.15  # max seconds the lens position is extrapolated between inquiry replies
+FALLBACK_TIME = 3.0         # seconds in Zoom Direct mode after a stall
+
+
+class ZoomPlanner:
+    def __init__(self, curves, zoom, budget=4.0, horizon=HORIZON):
+        '''
+        curves: ZoomCurves.ZoomCurves, zoom: zoom driver (or client). budget: VISCA commands per second the planner may send
+        '''
+        self.curves = curves
+        self.zoom = zoom
+        self.budget = max(float(budget), 2)     # A speed command and its stop
+        self.horizon = horizon
+        self.fixes = deque()
+        self.range_rate = 0.0
+        self.predicted_range = None
+        self.goal = None            # Zoom level for the predicted range
+        self.setpoint = None        # Rate limited goal, what the lens follows
+        self.last_step_time = None
+        self.speed = 0              # Last speed command sent: VISCA speed + 1, positive tele, negative wide, 0 stopped
+        self.last_direct = None     # Last Zoom Direct level sent
+        self.sent_times = deque()   # Commands sent in the last second
+        self.last_feedback = None
+        self.last_feedback_change = None
+        self.fallback_until = 0
+        self.stats = {"speed_commands": 0, "stop_commands": 0, "direct_commands": 0, "budget_deferred": 0,
+                      "stalls": 0}
+
+    # ---------------------------------------------------------------- range prediction
+
+    def update_range(self, t, distance):
+        '''
+        Adds a tracker fix (time, horizontal distance in meters) and updates the predicted range
+        '''
+        self.fixes.append((t, distance))
+        while self.fixes and self.fixes[0][0] < t - HISTORY:
+            self.fixes.popleft()
+        if len(self.fixes) >= 3 and self.fixes[-1][0] - self.fixes[0][0] >= 0.3:
+            mean_t = sum(f[0] for f in self.fixes) / len(self.fixes)
+            mean_d = sum(f[1] for f in self.fixes) / len(self.fixes)
+            num = sum((f[0] - mean_t) * (f[1] - mean_d) for f in self.fixes)
+            den = sum((f[0] - mean_t) ** 2 for f in self.fixes)
+            rate = max(min(num / den, MAX_RANGE_RATE), -MAX_RANGE_RATE) if den > 0 else 0.0
+            self.range_rate += RATE_SMOOTHING * (rate - self.range_rate)
+        self.predicted_range = max(distance + self.range_rate * self.horizon, 0)
+        return self.predicted_range
+
+    # ---------------------------------------------------------------- control
+
+    def take_budget(self, t, stop=False):
+        '''
+        True when a command can be sent at time t. Anything but a stop keeps one slot free for the following stop
+        '''
+        while self.sent_times and self.sent_times[0] <= t - 1.0:
+            self.sent_times.popleft()
+        if len(self.sent_times) < (self.budget if stop else self.budget - 1):
+            self.sent_times.append(t)
+            return True
+        self.stats["budget_deferred"] += 1
+        return False
+
+    def command_speed(self, t, speed):
+        if speed == self.speed:
+            return
+        if not self.take_budget(t, stop=(speed == 0)):
+            return
+        if speed == 0:
+            self.zoom.stop_zoom()
+        else:
+            self.zoom.set_zoom_speed(abs(speed) - 1, "tele" if speed > 0 else "wide")
+        self.stats["stop_commands" if speed == 0 else "speed_commands"] += 1
+        if self.speed == 0:
+            self.last_feedback_change = t       # Give the lens time to start before calling it a stall
+        self.speed = speed
+
+    def choose_speed(self, error_position, setpoint_rate, max_speed):
+        '''
+        Slowest speed whose lens rate covers the setpoint rate plus the error over RESPONSE_TIME
+        '''
+        needed = abs(setpoint_rate) + abs(error_position) / RESPONSE_TIME
+        rates = self.curves.speed_rates
+        for speed in range(max_speed + 1):
+            if rates[speed] >= needed:
+                return speed
+        return max_speed
+
+    def step(self, t, lens_zoom, multiplier=1, recording=False):
+        '''
+        Runs the planner at time t with the lens zoom level from the position inquiry (None when unknown).
+        Returns the zoom setpoint
+        '''
+        if self.predicted_range is None:
+            return self.setpoint
+        self.goal = max(min(self.curves.distance_to_zoom(self.predicted_range) * multiplier, MAX_ZOOM), MIN_ZOOM)
+        dt = 0 if self.last_step_time is None else max(t - self.last_step_time, 0)
+        self.last_step_time = t
+        max_rate = MAX_ZOOM_RATE_RECORDING if recording else MAX_ZOOM_RATE
+        previous = self.setpoint
+        if self.setpoint is None:
+            self.setpoint = lens_zoom if lens_zoom is not None else self.goal
+        change = max(min(self.goal - self.setpoint, max_rate * dt), -max_rate * dt)
+        self.setpoint += change
+        setpoint_position = self.curves.zoom_to_position(self.setpoint)
+        setpoint_rate = 0 if previous is None or dt <= 0 else (setpoint_position - self.curves.zoom_to_position(previous)) / dt
+
+        # Lens feedback: a lens commanded to move that doesn't report a new position is a stall (or lost inquiries)
+        if lens_zoom != self.last_feedback:
+            self.last_feedback = lens_zoom
+            self.last_feedback_change = t
+        elif self.speed != 0 and self.last_feedback_change is not None and t - self.last_feedback_change > FEEDBACK_STALL_TIME:
+            self.stats["stalls"] += 1
+            self.fallback_until = t + FALLBACK_TIME
+            self.command_speed(t, 0)
+
+        if lens_zoom is None or t < self.fallback_until:
+            self.command_speed(t, 0)
+            if self.speed == 0 and (self.last_direct is None or abs(self.setpoint - self.last_direct) >= DIRECT_DEADBAND) \
+                    and self.take_budget(t):
+                self.zoom.set_zoom_position(round(self.setpoint, 2))
+                self.stats["direct_commands"] += 1
+                self.last_direct = self.setpoint
+            return self.setpoint
+
+        self.last_direct = None
+        lens_position = self.curves.zoom_to_position(lens_zoom)
+        if self.speed != 0:
+            # The reported position is up to one inquiry period old: move it by the commanded speed since then
+            elapsed = min(t - self.last_feedback_change, FEEDBACK_EXTRAPOLATION)
+            lens_position += math.copysign(self.curves.speed_rates[abs(self.speed) - 1], self.speed) * elapsed
+            lens_zoom = self.curves.position_to_zoom(lens_position)
+        error = self.setpoint - lens_zoom
+        direction = 0 if self.speed == 0 else math.copysign(1, self.speed)
+        if abs(error) < STOP_DEADBAND or (direction and math.copysign(1, error) != direction):
+            speed = 0       # Reached or went past the setpoint
+        elif self.speed == 0 and abs(error) < START_DEADBAND:
+            speed = 0
+        else:
+            error_position = setpoint_position - lens_position
+            speed = self.choose_speed(error_position, setpoint_rate, MAX_SPEED_RECORDING if recording else MAX_SPEED)
+            speed = int(math.copysign(speed + 1, error))    # +1: speed 0 is a valid (slowest) VISCA speed
+        self.command_speed(t, speed)
+        return self.setpoint
+
+    def stop(self, t):
+        '''
+        Stops the lens and forgets the range history (tracking disabled or no fixes)
+        '''
+        self.command_speed(t, 0)
+        self.fixes.clear()
+        self.range_rate = 0.0
+        self.predicted_range = None
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats.update({"goal": self.goal, "setpoint": self.setpoint, "predicted_range": self.predicted_range,
+                      "range_rate": round(self.range_rate, 2), "speed": self.speed})
+        return stats
+
+
+STATIONARY_RANGE_RATE = 0.5     # m/s
+STATIONARY_PAN_SPEED = 0.5      # deg/s
+STATIONARY_TIME = 2.0           # seconds the target must stay still before the autofocus runs
+
+
+class StationaryAutofocus:
+    '''
+    Focus mode "preset_af": runs one push autofocus once the target stays still (waiting for a wave, sitting on the
+    board), never while it moves, so the autofocus can't hunt over water during a ride. Once per stationary period
+    '''
+    def __init__(self, zoom):
+        self.zoom = zoom
+        self.still_since = None
+        self.triggered = False
+
+    def update(self, t, range_rate, pan_speed):
+        if abs(range_rate) >= STATIONARY_RANGE_RATE or abs(pan_speed) >= STATIONARY_PAN_SPEED:
+            self.still_since = None
+            self.triggered = False
+            return False
+        if self.still_since is None:
+            self.still_since = t
+        if not self.triggered and t - self.still_since >= STATIONARY_TIME:
+            self.triggered = True
+            self.zoom.trigger_autofocus()
+            return True
+        return False
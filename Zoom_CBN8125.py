@@ -1,132 +1,479 @@
+import db
+import ZoomCurves
 import numpy as np
 import serial.tools.list_ports
+import threading
+from collections import deque
 import time
 import math
 
+'''
+VISCA replies (camera address 1, so replies come from 0x90):
+    ACK             90 4y FF            (y: socket number)
+    Completion      90 5y FF
+    Error           90 6y ee FF         (ee: 01 message length, 02 syntax, 03 command buffer full, 04 cancelled,
+                                             05 no socket, 41 not executable)
+    Zoom position   90 50 0p 0q 0r 0s FF   reply to the inquiry 81 09 04 47 FF
+    Focus position  90 50 0p 0q 0r 0s FF   reply to the inquiry 81 09 04 48 FF (same format, told apart by the
+                                           inquiry in flight)
+
+Focus commands:
+    Focus Direct        81 01 04 48 0p 0q 0r 0s FF
+    Zoom Focus Direct   81 01 04 47 0p 0q 0r 0s 0t 0u 0v 0w FF    zoom pqrs and focus tuvw in one command
+    Focus Auto/Manual   81 01 04 38 02 FF / 81 01 04 38 03 FF
+    One Push AF         81 01 04 18 01 FF    (single autofocus run, stays in manual focus after)
+'''
+
+ZOOM_POSITION_INQUIRY = bytes([0x81, 0x09, 0x04, 0x47, 0xFF])
+FOCUS_POSITION_INQUIRY = bytes([0x81, 0x09, 0x04, 0x48, 0xFF])
+
+ACK_TIMEOUT = 0.2           # seconds to wait for the ACK of a command before sending the next one
+INQUIRY_TIMEOUT = 0.2
+INQUIRY_PERIOD_MOVING = 0.1 # seconds between zoom position inquiries while the lens is moving
+INQUIRY_PERIOD_IDLE = 1.0
+FOCUS_INQUIRY_EVERY = 5     # one inquiry out of 5 reads the focus position
+
+# Focus modes: "auto" camera autofocus (hunts over water after zoom changes), "preset" manual focus set from the
+# zoom -> focus calibration curve with every zoom change, "preset_af" same plus a one push autofocus when the tracking
+# loop sees the target stationary (see ZoomPlanner.StationaryAutofocus)
+FOCUS_MODES = ("auto", "preset", "preset_af")
+FOCUS_FOLLOW_PERIOD = 0.3   # seconds between focus corrections while the lens moves with a variable speed zoom
+FOCUS_TOLERANCE = 16        # focus position units, smaller corrections are not sent
+
+VISCA_ERRORS = {0x01: "message length", 0x02: "syntax", 0x03: "command buffer full", 0x04: "command cancelled",
+                0x05: "no socket", 0x41: "command not executable"}
+
+
+def zoom_to_position(zoomValue):
+    '''
+    Zoom level (1x to 25x) to the raw lens position, from the camera model calibration curve (see ZoomCurves)
+    '''
+    return int(round(ZoomCurves.get_curves().zoom_to_position(zoomValue)))
+
+def position_to_zoom(position):
+    '''
+    Raw lens position to zoom level, the inverse of zoom_to_position()
+    '''
+    return round(ZoomCurves.get_curves().position_to_zoom(position), 2)
+
+def zoom_to_focus(zoomValue):
+    '''
+    Focus position for the distance framed at that zoom level, None without a focus calibration
+    '''
+    curve = ZoomCurves.get_curves().zoom_to_focus
+    if curve is None:
+        return None
+    return int(round(curve(zoomValue)))
+
+def nibbles(value):
+    return [(value >> 12) & 0xF, (value >> 8) & 0xF, (value >> 4) & 0xF, value & 0xF]
+
 
 class SoarCameraZoomFocus:
     '''
     RS232 Driver for interfacing with the Soar Cameras
     The Zoom Calibration is Set for the CBN8125 Camera
-    '''
-    def __init__(self):
 
+    Commands don't block the caller: the lens commands go to a single pending slot (a newer zoom target replaces one
+    that wasn't sent yet) and a writer thread sends them one at a time, waiting for the ACK before the next one.
+    Focus mode changes and one push AF are queued in order and sent first, focus corrections have their own pending
+    slot, sent after the zoom command. A reader thread parses the VISCA replies. While idle the writer inquires the
+    lens position, which is published in commands.camera_zoom_value.
+
+    In the preset focus modes, zoom targets are sent with their focus position in one Zoom Focus Direct command, and
+    the focus follows the lens during variable speed zooms.
+    '''
+    def __init__(self, port=None):
+        '''
+        port: optional device path (the Serial Broker passes the cached /dev/serial/by-id path). When not given,
+        the serial ports are scanned for the "Zoom" converter
+        '''
+        self.commands = db.Commands(db.get_connection())
         connected = False
-        print("Searching for USB-RS232 Zoom converter")
+        if port:
+            self.serial = self.open_port(port)
+            connected = True
+        else:
+            print("Searching for USB-RS232 Zoom converter")
         while not connected:
             ports = serial.tools.list_ports.comports()
             for port in ports:
                 if "Zoom" in port.description:
                     try:
-                        self.serial = serial.Serial(
-                            port.device,
-                            baudrate=9600,
-                            bytesize=serial.EIGHTBITS,
-                            stopbits=serial.STOPBITS_ONE,
-                            parity=serial.PARITY_NONE,
-                            timeout=5.0
-                        )
+                        self.serial = self.open_port(port.device)
                         connected = True
                         print("Connected to Camera Zoom/Focus Motors")
                         break
                     except Exception as e:
-                        print("Connection error: {e}")
-            time.sleep(0.1)   
-        
-        # Set the zoom speed to the minimum on both directions
+                        print(f"Connection error: {e}")
+            time.sleep(0.1)
+
+        self.cond = threading.Condition()
+        self.pending = None             # Latest lens command not sent yet
+        self.pending_focus = None       # Latest focus correction not sent yet
+        self.control_queue = deque()    # Focus mode / one push AF commands, sent in order
+        self.focus_mode = "auto"        # Camera power on default
+        self.focus_target = None        # Last focus position sent
+        self.focus_position = None      # From the last focus inquiry
+        self.last_focus_follow = 0
+        self.focus_following = False   # Focus corrections follow the lens position (variable speed zooms)
+        self.inquiry_count = 0
+        self.last_command_time = 0
+        self.waiting_ack = False
+        self.command_done = True        # Completion (or error) received for the last command sent
+        self.command_ok = True          # False when the last command got an error reply or no reply
+        self.command_socket = None      # VISCA socket of the last command, from its ACK
+        self.zooming = False            # Variable speed zoom running (completes immediately, the lens keeps moving)
+        self.zoom_started = 0
+        self.waiting_inquiry = None     # "zoom" or "focus" while an inquiry is in flight
+        self.last_inquiry_time = 0
+        self.zoom_position = None       # Raw lens position from the last inquiry
+        self.zoom_value = None          # Same, as zoom level
+        self.last_reply = b''
+        self.stats = {"commands": 0, "superseded": 0, "acks": 0, "completions": 0, "errors": 0, "inquiries": 0,
+                      "ack_timeouts": 0, "cancelled": 0, "focus_commands": 0, "autofocus_triggers": 0, "last_error": ""}
+
+        self.running = True
+        self.reader_thread = threading.Thread(target=self.reader, daemon=True)
+        self.writer_thread = threading.Thread(target=self.writer, daemon=True)
+        self.reader_thread.start()
+        self.writer_thread.start()
+
+        # Set the zoom speed to the minimum on both directions. Each command waits for the camera to complete it
+        # (bounded) instead of a fixed 1 s pause
         self.set_zoom_speed(0, "tele")
-        time.sleep(1)
+        self.waitCompletion()
         self.set_zoom_speed(0, "wide")
-        time.sleep(1)
+        self.waitCompletion()
+        self.set_focus_mode(self.commands.camera_focus_mode)
         self.set_zoom_position(2)
-        
+
+    def open_port(self, device):
+        return serial.Serial(
+            device,
+            baudrate=9600,
+            bytesize=serial.EIGHTBITS,
+            stopbits=serial.STOPBITS_ONE,
+            parity=serial.PARITY_NONE,
+            timeout=0.1     # Only used by the reader thread, short so it notices stop() quickly
+        )
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        self.writer_thread.join(timeout=1)
+        self.reader_thread.join(timeout=1)
+
+    def waitCompletion(self, timeout=1.0):
+        '''
+        Waits until the pending command was sent and the camera completed it (90 5y FF).
+        Returns False on error reply or timeout
+        '''
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.pending is not None or self.control_queue or not self.command_done:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            return self.command_ok
+
+    # ---------------------------------------------------------------- threads
+
+    def writer(self):
+        while self.running:
+            with self.cond:
+                while self.running and self.pending is None and self.pending_focus is None and not self.control_queue:
+                    now = time.time()
+                    inquiry_period = INQUIRY_PERIOD_IDLE if self.command_done and not self.zooming else INQUIRY_PERIOD_MOVING
+                    inquiry_due = self.last_inquiry_time + inquiry_period
+                    if now >= inquiry_due:
+                        break
+                    self.cond.wait(inquiry_due - now)
+                now = time.time()
+                if not self.running:
+                    return
+                if self.control_queue:
+                    msg = self.control_queue.popleft()
+                elif self.pending is not None:
+                    msg, self.pending = self.pending, None
+                else:
+                    msg, self.pending_focus = self.pending_focus, None
+                if msg is not None:
+                    self.command_socket = None
+                    self.waiting_ack = True
+                    self.command_done = False
+                    self.command_ok = True
+                    self.stats["commands"] += 1
+                else:
+                    self.inquiry_count += 1
+                    if self.inquiry_count % FOCUS_INQUIRY_EVERY == 0 and not self.zooming:
+                        msg, self.waiting_inquiry = FOCUS_POSITION_INQUIRY, "focus"
+                    else:
+                        msg, self.waiting_inquiry = ZOOM_POSITION_INQUIRY, "zoom"
+                    self.stats["inquiries"] += 1
+                    self.last_inquiry_time = now
+            try:
+                self.serial.write(msg)
+            except Exception as e:
+                print(f"Error writing to zoom controller: {e}")
+            self.last_command_time = time.time()
+
+            # One command in flight: wait for its ACK (or error), or for the inquiry reply
+            with self.cond:
+                deadline = time.time() + (INQUIRY_TIMEOUT if self.waiting_inquiry else ACK_TIMEOUT)
+                while self.running and (self.waiting_ack or self.waiting_inquiry) and time.time() < deadline:
+                    self.cond.wait(deadline - time.time())
+                if self.waiting_ack:
+                    self.stats["ack_timeouts"] += 1
+                    self.command_done = True    # No reply, don't wait for a completion that won't come
+                    self.command_ok = False
+                self.waiting_ack = False
+                self.waiting_inquiry = None
+                self.cond.notify_all()
+
+    def reader(self):
+        buffer = bytearray()
+        while self.running:
+            try:
+                chunk = self.serial.read(max(1, self.serial.in_waiting))
+            except Exception as e:
+                print(f"Error reading from zoom controller: {e}")
+                time.sleep(0.1)
+                continue
+            if not chunk:
+                continue
+            buffer += chunk
+            while 0xFF in buffer:
+                end = buffer.index(0xFF)
+                message, buffer = bytes(buffer[:end + 1]), buffer[end + 1:]
+                self.handle_reply(message)
+
+    def handle_reply(self, message):
+        if len(message) < 3 or message[0] & 0xF0 != 0x90:
+            return      # Garbage or a partial message after a resync
+        kind = message[1] & 0xF0
+        socket = message[1] & 0x0F
+        with self.cond:
+            self.last_reply = message
+            if len(message) == 7 and message[1] == 0x50:
+                position = (message[2] & 0xF) << 12 | (message[3] & 0xF) << 8 | (message[4] & 0xF) << 4 | (message[5] & 0xF)
+                if self.waiting_inquiry == "focus":
+                    self.focus_position = position
+                else:
+                    self.update_position(position)
+                self.waiting_inquiry = None
+            elif kind == 0x40:
+                self.stats["acks"] += 1
+                self.waiting_ack = False
+                self.command_socket = socket
+            elif kind == 0x50:
+                self.stats["completions"] += 1
+                if socket == self.command_socket:
+                    self.command_done = True    # Otherwise an earlier command (a completion never precedes its ACK)
+            elif kind == 0x60:
+                code = message[2] if len(message) > 3 else 0
+                if socket and socket != self.command_socket:
+                    # Errors for a command not ACKed yet come from socket 0: this is an earlier command still running
+                    # in the other socket, ex: a zoom target cancelled by a newer one
+                    self.stats["cancelled" if code == 0x04 else "errors"] += 1
+                    self.cond.notify_all()
+                    return
+                self.stats["errors"] += 1
+                self.stats["last_error"] = VISCA_ERRORS.get(code, f"0x{code:02x}")
+                print(f"Zoom controller error: {self.stats['last_error']}")
+                self.waiting_ack = False
+                self.waiting_inquiry = None
+                self.command_done = True
+                self.command_ok = False
+            self.cond.notify_all()
+
+    def update_position(self, position):
+        previous = self.zoom_position
+        self.zoom_position = position
+        self.zoom_value = position_to_zoom(position)
+        if previous is None or abs(position - previous) > 0:
+            self.commands.camera_zoom_value = self.zoom_value
+        elif self.zooming and self.command_done and time.time() - self.zoom_started > 0.5:
+            self.zooming = False        # Reached the end of the range, back to the idle inquiry period
+        self.follow_focus()
+
+    # ---------------------------------------------------------------- commands
+
+    def queue_command(self, msg):
+        '''
+        Puts a lens command in the pending slot, replacing any command that wasn't sent yet
+        '''
+        with self.cond:
+            if self.pending is not None:
+                self.stats["superseded"] += 1
+            self.pending = bytes(msg)
+            if self.pending[:4] == b'\x81\x01\x04\x07':
+                self.zooming = self.pending[4] != 0x00
+                self.zoom_started = time.time()
+                self.focus_following = True     # Variable speed zoom (or its stop): focus follows the lens
+            elif self.pending[:4] == b'\x81\x01\x04\x47':
+                self.focus_following = False    # Zoom Direct carries its own focus in the preset modes
+            self.cond.notify_all()
+
+    def follow_focus(self):
+        '''
+        Preset focus modes: keeps the focus on the calibration curve while the lens moves (called with self.cond held)
+        '''
+        if self.focus_mode == "auto" or not self.focus_following or time.time() - self.last_focus_follow < FOCUS_FOLLOW_PERIOD:
+            return
+        focus = zoom_to_focus(self.zoom_value)
+        if focus is None or (self.focus_target is not None and abs(focus - self.focus_target) < FOCUS_TOLERANCE):
+            return
+        self.last_focus_follow = time.time()
+        self.focus_target = focus
+        self.pending_focus = bytes([0x81, 0x01, 0x04, 0x48] + nibbles(focus) + [0xFF])
+        self.stats["focus_commands"] += 1
+        self.cond.notify_all()
+
+    def queue_control(self, msg):
+        with self.cond:
+            self.control_queue.append(bytes(msg))
+            self.cond.notify_all()
+
     def testSerialReception(self):
         try:
+            last = None
             while True:
-                if self.serial.in_waiting > 0:
-                    response = self.serial.read(self.serial.in_waiting)  # Read available bytes
-                    print(f"Received: {response.hex()}")  # Print the response as a hex string
+                if self.last_reply is not last:
+                    last = self.last_reply
+                    print(f"Received: {last.hex()}")  # Print the response as a hex string
                 time.sleep(0.1)  # Avoid busy waiting
         except KeyboardInterrupt:
             print("Stopping listener")
-        except Exception as e:
-            print(f"Error while receiving data: {e}")
-    
+
     def testSerialSending(self, msg):
         while True:
             self.sendMsg(msg)
             time.sleep(1)
-        
+
     def sendMsg(self, msg):
         if isinstance(msg, str):
             bytes2send = bytes(msg, "utf-8")
         else:
             bytes2send = msg
-        self.serial.write(bytes2send)
-    
+        self.queue_command(bytes2send)
+
     def receiveResponse(self):
-        try:
-            response = self.serial.read(1024)  # Read up to 1024 bytes
-            if response:
-                return response.hex()  # Convert bytes to hex string
-            else:
-                print("No response received")
-                return None
-        except serial.SerialTimeoutException:
-            print("No response received within the timeout period")
-            return None
-    
+        '''
+        Last reply parsed by the reader thread, as an hex string
+        '''
+        if self.last_reply:
+            return self.last_reply.hex()
+        print("No response received")
+        return None
+
+    def getZoomPosition(self):
+        '''
+        Lens zoom level from the last position inquiry (None until the first reply)
+        '''
+        return self.zoom_value
+
+    def getFocusPosition(self):
+        '''
+        Focus position from the last focus inquiry (None until the first reply)
+        '''
+        return self.focus_position
+
+    def getZoomStats(self):
+        with self.cond:
+            stats = dict(self.stats)
+        stats["zoom_position"] = self.zoom_position
+        stats["zoom_value"] = self.zoom_value
+        stats["focus_mode"] = self.focus_mode
+        stats["focus_target"] = self.focus_target
+        stats["focus_position"] = self.focus_position
+        return stats
+
     def setMinZoom(self):
-        msg = [0x81, 0x01, 0x04, 0x07, 0x03, 0xFF]    
+        msg = [0x81, 0x01, 0x04, 0x07, 0x03, 0xFF]
         self.sendMsg(msg)
-    
+
     def setMaxZoom(self):
         zoom_in_command = [0x81, 0x01, 0x04, 0x07, 0x02, 0xFF]
         self.sendMsg(zoom_in_command)
-        
+
     def set_zoom_position(self, zoomValue):
         '''
         Sets the camera's zoom to a value between 1x and 25x
         '''
-        
-        zoomValue = max(min(zoomValue, 25), 0)
-        
-        zoom_positions = [0, 5350, 8500, 9850, 11300,
-                        12250, 12950, 13550, 14025, 14420,
-                        14640, 14840, 15010, 15155, 15320,
-                        15475, 15580, 15670, 15765, 15860,
-                        15915, 15970, 16030, 16120, 16380]
-        
-        if isinstance(zoomValue, int):
-            zoom_position = zoom_positions[zoomValue -1]
-        else:
-            # If it's not an integer, ex. 5.3x
-            # Interpolate 
-            x0, y0 = math.floor(zoomValue), zoom_positions[math.floor(zoomValue) - 1]
-            x1, y1 = math.floor(zoomValue) + 1, zoom_positions[math.floor(zoomValue)]
-            zoom_position = y0 + (zoomValue - x0) * (y1-y0) / (x1-x0)
-            zoom_position = int(zoom_position)
-                    
-        # Split the zoom position into four nibbles (each 4 bits)
-        p = (zoom_position >> 12) & 0xF
-        q = (zoom_position >> 8) & 0xF
-        r = (zoom_position >> 4) & 0xF
-        s = zoom_position & 0xF
-        
-        # Construct the command
-        zoom_command = [0x81, 0x01, 0x04, 0x47, p, q, r, s, 0xFF]
-        
+        if self.focus_mode != "auto" and zoom_to_focus(zoomValue) is not None:
+            self.set_zoom_focus_position(zoomValue)
+            return
+        zoom_position = zoom_to_position(zoomValue)
+
+        # Construct the command, the zoom position split into four nibbles (each 4 bits)
+        zoom_command = [0x81, 0x01, 0x04, 0x47] + nibbles(zoom_position) + [0xFF]
+
         self.sendMsg(zoom_command)
-        
+
+    def set_zoom_focus_position(self, zoomValue, focusPosition=None):
+        '''
+        Sets zoom (1x to 25x) and focus in one Zoom Focus Direct command. The focus comes from the zoom -> focus
+        calibration curve when not given
+        '''
+        if focusPosition is None:
+            focusPosition = zoom_to_focus(zoomValue)
+            if focusPosition is None:
+                raise ValueError("No zoom -> focus calibration for this camera, give the focus position")
+        focusPosition = max(min(int(focusPosition), 0xFFFF), 0)
+        command = [0x81, 0x01, 0x04, 0x47] + nibbles(zoom_to_position(zoomValue)) + nibbles(focusPosition) + [0xFF]
+        with self.cond:
+            self.pending_focus = None       # Superseded by the combined command
+            self.focus_target = focusPosition
+        self.sendMsg(command)
+
+    def set_focus_position(self, focusPosition):
+        '''
+        Focus Direct, only has an effect in manual focus (the preset focus modes)
+        '''
+        focusPosition = max(min(int(focusPosition), 0xFFFF), 0)
+        with self.cond:
+            self.focus_target = focusPosition
+            self.pending_focus = bytes([0x81, 0x01, 0x04, 0x48] + nibbles(focusPosition) + [0xFF])
+            self.stats["focus_commands"] += 1
+            self.cond.notify_all()
+
+    def set_focus_mode(self, mode):
+        '''
+        "auto", "preset" or "preset_af" (see FOCUS_MODES). The preset modes need the zoom -> focus calibration
+        '''
+        if mode not in FOCUS_MODES:
+            raise ValueError(f"Focus mode must be one of {FOCUS_MODES}")
+        if mode != "auto" and ZoomCurves.get_curves().zoom_to_focus is None:
+            print(f"No zoom -> focus calibration, focus mode {mode} not available, using autofocus")
+            mode = "auto"
+        self.focus_mode = mode
+        self.focus_target = None
+        self.queue_control([0x81, 0x01, 0x04, 0x38, 0x02 if mode == "auto" else 0x03, 0xFF])
+        if mode != "auto" and self.zoom_value is not None:
+            self.set_focus_position(zoom_to_focus(self.zoom_value))
+        return mode
+
+    def trigger_autofocus(self):
+        '''
+        One push AF: a single autofocus run, the focus then stays where it settled (manual focus modes only)
+        '''
+        if self.focus_mode == "auto":
+            return
+        self.stats["autofocus_triggers"] += 1
+        self.queue_control([0x81, 0x01, 0x04, 0x18, 0x01, 0xFF])
+
     def set_zoom_speed(self, zoomSpeedValue, direction="tele"):
         '''
-        Sets the zoom speed. 
+        Sets the zoom speed.
         zoomSpeedValue should be an integer between 0 and 7.
         direction can be either "tele" for zooming in or "wide" for zooming out.
         '''
         # Ensure the speed value is within the valid range (0 to 7)
         zoomSpeedValue = max(min(zoomSpeedValue, 7), 0)
-        
+
         # Determine the command based on the direction
         if direction == "tele":
             zoom_command = [0x81, 0x01, 0x04, 0x07, 0x20 | zoomSpeedValue, 0xFF]
@@ -136,4 +483,9 @@ class SoarCameraZoomFocus:
             raise ValueError("Direction must be 'tele' (zoom in) or 'wide' (zoom out)")
         # Send the zoom speed command
         self.sendMsg(zoom_command)
-                
+
+    def stop_zoom(self):
+        '''
+        Stops a variable speed zoom started by set_zoom_speed()
+        '''
+        self.sendMsg([0x81, 0x01, 0x04, 0x07, 0x00, 0xFF])
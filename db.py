@@ -1,6 +1,7 @@
 import redis
 import pickle
 import json
+import time
 
 def get_connection():
     return redis.Redis()
@@ -58,6 +59,37 @@ class RedisClient:
         with open(filename, "w") as fp:
             json.dump(merged_data, fp, indent=2)
 
+    def push(self, key, value):
+        """Append a value to the Redis list at key."""
+        return self.r.rpush(key, pickle.dumps(value))
+
+    def pop_all(self, key):
+        """Remove and return every value of the Redis list at key, in order."""
+        pipe = self.r.pipeline()
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        values, _ = pipe.execute()
+        return [pickle.loads(v) for v in values]
+
+    def hset(self, key, field, value):
+        """Store one field of the Redis hash at key (atomic, unlike a get / modify / set of a dict)."""
+        return self.r.hset(key, field, pickle.dumps(value))
+
+    def hget(self, key, field):
+        """Retrieve one field of the Redis hash at key."""
+        val = self.r.hget(key, field)
+        if val:
+            return pickle.loads(val)
+        return None
+
+    def hdel(self, key, field):
+        """Remove one field of the Redis hash at key, returns the number of fields removed."""
+        return self.r.hdel(key, field)
+
+    def hgetall(self, key):
+        """Retrieve the Redis hash at key as a dict."""
+        return {k.decode(): pickle.loads(v) for k, v in self.r.hgetall(key).items()}
+
     def load(self, filename):
         data = {}
         with open(filename) as fp:
@@ -183,8 +215,11 @@ class Commands:
         self.client = RedisClient(connection)
         self.client.set_initial("camera_calibrate_origin", False)     # Flag utilized to start the origin calibration process
         self.client.set_initial("camera_calibrate_heading", False)    # Flag utilized to start the heading calibration process
-        self.client.set_initial("camera_zoom_value", 1)
+        self.client.set_initial("camera_zoom_value", 1)              # Real lens zoom level, from the zoom controller position inquiries
+        self.client.set_initial("camera_zoom_target", 1)             # Last zoom level requested by the tracking
         self.client.set_initial("camera_zoom_multiplier", 1)          # Used to increase/decrease the calculated zoom by a factor of 0.8-1.2x
+        self.client.set_initial("zoom_command_budget", 4)             # Max VISCA commands per second sent by the zoom planner
+        self.client.set_initial("camera_focus_mode", "preset_af")     # "auto", "preset" or "preset_af" (see Zoom_CBN8125.FOCUS_MODES)
         self.client.set_initial("tracking_enabled", False)            # Flag utilized to toggle tracking        
         self.client.set_initial("speed_control_mode_threshold", 0.3)  # Pan Speed to toggle velocity mode or position
         self.client.set_initial("max_pan_speed", 6)                   # Max pan speed when in position mode
@@ -192,6 +227,8 @@ class Commands:
         self.client.set_initial("cancel_pairing", False)
         self.client.set_initial("calibrate_pan_center", False)  # Flag utilized to start the pan center calibration process
         self.client.set_initial("check_pairing", False)
+        self.client.set_initial("cancel_pan_calibration", False)  # Flag utilized to abort an ongoing pan center calibration
+        self.client.set_initial("pan_calibration_status", {"state": "idle", "progress": 0, "message": ""})
     
     @property
     def camera_calibrate_origin(self):
@@ -217,6 +254,14 @@ class Commands:
     def camera_zoom_value(self, value):
         self.client.set("camera_zoom_value", value)
         
+    @property
+    def camera_zoom_target(self):
+        return self.client.get("camera_zoom_target")
+    
+    @camera_zoom_target.setter
+    def camera_zoom_target(self, value):
+        self.client.set("camera_zoom_target", value)
+        
     @property
     def camera_zoom_multiplier(self):
         return self.client.get("camera_zoom_multiplier")
@@ -224,6 +269,22 @@ class Commands:
     @camera_zoom_multiplier.setter
     def camera_zoom_multiplier(self, value):
         self.client.set("camera_zoom_multiplier", value)
+
+    @property
+    def zoom_command_budget(self):
+        return self.client.get("zoom_command_budget")
+
+    @zoom_command_budget.setter
+    def zoom_command_budget(self, value):
+        self.client.set("zoom_command_budget", value)
+
+    @property
+    def camera_focus_mode(self):
+        return self.client.get("camera_focus_mode")
+
+    @camera_focus_mode.setter
+    def camera_focus_mode(self, value):
+        self.client.set("camera_focus_mode", value)
         
     @property
     def tracking_enabled(self):
@@ -280,6 +341,22 @@ class Commands:
     @check_pairing.setter
     def check_pairing(self, value):
         return self.client.set("check_pairing", value)
+    
+    @property
+    def cancel_pan_calibration(self):
+        return self.client.get("cancel_pan_calibration")
+    
+    @cancel_pan_calibration.setter
+    def cancel_pan_calibration(self, value):
+        return self.client.set("cancel_pan_calibration", value)
+    
+    @property
+    def pan_calibration_status(self):
+        return self.client.get("pan_calibration_status")
+    
+    @pan_calibration_status.setter
+    def pan_calibration_status(self, value):
+        return self.client.set("pan_calibration_status", value)
 
 class CameraState:
     def __init__(self, connection):
@@ -289,6 +366,9 @@ class CameraState:
         self.client.set_initial("enable_auto_recording", False)
         self.client.set_initial("timeStamp", 0)
         self.client.set_initial("video_file_path", "")
+        self.client.set_initial("recording_stats", {})  # Segment ring ffmpeg: state, fps, bitrate_kbps, speed, stalls, restarts, last_error
+        self.client.set_initial("clip_jobs", {})  # Clip worker pool: pending, queued, running, done, failed, dropped, retries
+        self.client.set_initial("storage_stats", {})  # Storage manager: free and session bytes, quota, headroom, evictions
     
     @property
     def wave_nr(self):
@@ -338,6 +418,41 @@ class CameraState:
     def enable_auto_recording(self, v):
         self.client.set("enable_auto_recording", v)
         
+    @property
+    def recording_stats(self):
+        return self.client.get("recording_stats")
+
+    @recording_stats.setter
+    def recording_stats(self, v):
+        self.client.set("recording_stats", v)
+
+    @property
+    def clip_jobs(self):
+        return self.client.get("clip_jobs")
+
+    @clip_jobs.setter
+    def clip_jobs(self, v):
+        self.client.set("clip_jobs", v)
+
+    def push_wave_event(self, wave, event, t=None):
+        """
+        Queues a wave start / end for the Camera (WaveEvents.py). wave: id, waves with different ids can overlap.
+        t: time.monotonic() of the event, now by default
+        Not called in production yet (only the wave "auto", from start_recording): the interface for per-surfer waves
+        """
+        self.client.push("wave_events", {"wave": wave, "event": event, "t": time.monotonic() if t is None else t})
+
+    def pop_wave_events(self):
+        return self.client.pop_all("wave_events")
+
+    @property
+    def storage_stats(self):
+        return self.client.get("storage_stats")
+
+    @storage_stats.setter
+    def storage_stats(self, v):
+        self.client.set("storage_stats", v)
+
     @property
     def timeStamp(self):
         return self.client.get("timeStamp")
@@ -347,6 +462,48 @@ class CameraState:
         self.client.set("timeStamp", v)
         
 
+class SerialPorts:
+    '''
+    Last known good serial device paths (udev /dev/serial/by-id links, persisted to db.txt) and the start up phase timings
+    '''
+    def __init__(self, connection):
+        self.client = RedisClient(connection)
+        self.client.set_initial("frontboard_port", '')
+        self.client.set_initial("zoom_port", '')
+        # startup_timings: Redis hash, phase name -> seconds, plus "started_at" (epoch of the broker start). Each phase
+        # is its own field, so the processes and threads recording phases at the same time don't overwrite each other
+
+    @property
+    def frontboard_port(self):
+        return self.client.get("frontboard_port")
+
+    @frontboard_port.setter
+    def frontboard_port(self, v):
+        self.client.set("frontboard_port", v)
+
+    @property
+    def zoom_port(self):
+        return self.client.get("zoom_port")
+
+    @zoom_port.setter
+    def zoom_port(self, v):
+        self.client.set("zoom_port", v)
+
+    @property
+    def startup_timings(self):
+        return self.client.hgetall("startup_timings")
+
+    @startup_timings.setter
+    def startup_timings(self, v):
+        self.client.r.delete("startup_timings")
+        for name, value in v.items():
+            self.client.hset("startup_timings", name, value)
+
+    def record_startup_phase(self, name, seconds):
+        self.client.hset("startup_timings", name, round(seconds, 3))
+        print(f"Startup phase {name}: {seconds:.2f} s")
+
+
 class WebApp:
     '''
     Handles everything related to the WebApp functioning and camera unit identification
@@ -360,6 +517,10 @@ class WebApp:
         self.client.set_initial("SessionStartTime", 0)
         self.client.set_initial("Uploading_Route", '')
         self.client.set_initial("ErrorStates", '')
+        # ErrorSources: Redis hash, subsystem -> error message, composed into ErrorStates. A pickled dict from an older
+        # version would make every hset fail with WRONGTYPE
+        if self.client.r.type("ErrorSources") == b"string":
+            self.client.r.delete("ErrorSources")
         self.client.set_initial("IsPaired", 'False')
 
     @property
@@ -426,6 +587,27 @@ class WebApp:
     def ErrorStates(self, v):
         self.client.set("ErrorStates", v)
         
+    def set_error(self, source, message):
+        '''
+        Sets the error reported by one subsystem. ErrorStates is the composition of every active error, '' when none
+        '''
+        if self.client.hget("ErrorSources", source) != message:
+            self.client.hset("ErrorSources", source, message)
+            self.compose_errors()
+
+    def clear_error(self, source):
+        if self.client.hdel("ErrorSources", source):
+            self.compose_errors()
+
+    def compose_errors(self):
+        # Retried when another process changes ErrorSources meanwhile (WATCH), so an older composition never
+        # overwrites a newer one
+        def compose(pipe):
+            errors = {k.decode(): pickle.loads(v) for k, v in pipe.hgetall("ErrorSources").items()}
+            pipe.multi()
+            pipe.set("ErrorStates", pickle.dumps("; ".join(errors[k] for k in sorted(errors))))
+        self.client.r.transaction(compose, "ErrorSources")
+
     @property
     def IsPaired(self):
         return self.client.get("IsPaired")
@@ -2,17 +2,21 @@
 import time
 import sys
 
+import SerialBroker
 import Camera
 import TrackingControlESPNOW_V2
 import WebServer
 import APIV2
+import PreviewServer
+import StorageManager
 
 from multiprocessing import Process, Manager
 import redis
 from db import RedisClient
 import utils
 
-# On boot, go through the recorded videos and delete older than 7 days
+# On boot, go through the recorded videos and delete older than 7 days (the StorageManager process keeps the
+# disk usage under its quota while running)
 # Also go through logs and if file is too big delete the old things
 utils.delete_old_videos(path='/home/idmind/surfcamera_deploy_test/videos', days=7) 
 utils.trim_log_file(path='/home/idmind/surfcamera_deploy_test/logs/startbash.txt', max_size_mb = 3)
@@ -23,9 +27,12 @@ client = RedisClient(r)
 PERSISTENT_FILENAME = "/home/idmind/surfcamera_deploy_test/db.txt"
 
 PROCESSES = [
+    SerialBroker, # Owns the Front IO Board and Zoom serial ports, serves the other processes
     WebServer, # Control Panel for manual control
     APIV2,       # Flask server API that serves the WebApp 
     Camera,    # Handles the recording, clipping and directory management of videos 
+    PreviewServer, # Live MJPEG preview, one encode shared by all viewers
+    StorageManager, # Disk quota and free space watermarks: deletes the oldest uploaded sessions
     TrackingControlESPNOW_V2 # Calculations based on gps coordinates: servo and autorecording controller
 ]
 
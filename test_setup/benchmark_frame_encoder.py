@@ -0,0 +1,82 @@
+import sys
+import os
+import timeit
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import FrontBoardProtocol
+
+'''
+Micro-benchmark of the Front IO Board frame building.
+Compares the previous list based build_message (plus the bytes conversion done by serial.write) with the
+FrameEncoder buffer and the cached frame templates. Also checks that every path produces identical frames.
+'''
+
+OP_CODES = FrontBoardProtocol.OP_CODES
+
+def legacy_build_message(op_code, data=[]):
+    msg = [0xff, 0xff]
+    if op_code not in OP_CODES.values():
+        raise Exception("build_message()", "Incorrect op_code (received {})".format(op_code))
+    if len(data) > 255:
+        raise Exception("build_message()", "Data Length exceeded (received {})".format(len(data)))
+    msg.append(op_code)
+    msg.append(0)
+    msg.append(len(data))
+    for d in data:
+        msg.append(d)
+    chk = sum(msg[2:])
+    msg.append((chk >> 8) & 0xff)
+    msg.append(chk & 0xff)
+    return msg
+
+def legacy_dynamixel_write(ID, ADDR, data):
+    ADDR_bytes = ADDR.to_bytes(2, byteorder="little")
+    data_bytes = data.to_bytes(4, byteorder='little', signed=True)
+    data2send = bytearray([ID, ADDR_bytes[1], ADDR_bytes[0], data_bytes[3], data_bytes[2], data_bytes[1], data_bytes[0]])
+    return bytes(legacy_build_message(OP_CODES["Dynamixel Write"], data2send))
+
+def legacy_set_position(tiltpos, tiltvel, panpos, panvel):
+    msg = [4]
+    for ID, ADDR, value in ((1, 116, tiltpos), (1, 112, tiltvel), (2, 116, panpos), (2, 112, panvel)):
+        ADDR_bytes = ADDR.to_bytes(2, byteorder="little")
+        data_bytes = value.to_bytes(4, byteorder="little", signed=True)
+        msg.extend([ID, ADDR_bytes[1], ADDR_bytes[0], data_bytes[3], data_bytes[2], data_bytes[1], data_bytes[0]])
+    return bytes(legacy_build_message(OP_CODES["Group Dynamixel Write"], bytearray(msg)))
+
+def legacy_tracker_poll():
+    return bytes(legacy_build_message(OP_CODES["Get Tracker Message"], []))
+
+
+def check_equivalence(encoder):
+    for value in (0, 1, -1, 255, 256, -300, 2047, -2047, 123456):
+        assert bytes(encoder.dynamixel_write(2, 104, value)) == legacy_dynamixel_write(2, 104, value), value
+        assert bytes(encoder.dynamixel_write(1, 116, abs(value))) == legacy_dynamixel_write(1, 116, abs(value)), value
+        args = (750 + abs(value) % 1000, 10, value, 5)
+        assert bytes(encoder.group_write(((1, 116), (1, 112), (2, 116), (2, 112)), args)) == legacy_set_position(*args), args
+    assert bytes(encoder.constant(OP_CODES["Get Tracker Message"])) == legacy_tracker_poll()
+    assert bytes(encoder.encode(OP_CODES["Set BackPanel LEDs"], [0x03])) == bytes(legacy_build_message(OP_CODES["Set BackPanel LEDs"], [0x03]))
+    print("Encoder output matches the legacy message builder")
+
+def run(number=200000):
+    encoder = FrontBoardProtocol.FrameEncoder()
+    check_equivalence(encoder)
+
+    registers = ((1, 116), (1, 112), (2, 116), (2, 112))
+    cases = [
+        ("goal velocity  legacy", lambda: legacy_dynamixel_write(2, 104, -120)),
+        ("goal velocity  template", lambda: encoder.dynamixel_write(2, 104, -120)),
+        ("set position   legacy", lambda: legacy_set_position(1200, 40, 5300, 80)),
+        ("set position   template", lambda: encoder.group_write(registers, (1200, 40, 5300, 80))),
+        ("tracker poll   legacy", legacy_tracker_poll),
+        ("tracker poll   cached", lambda: encoder.constant(OP_CODES["Get Tracker Message"])),
+        ("LEDs           legacy", lambda: bytes(legacy_build_message(OP_CODES["Set BackPanel LEDs"], [0x03]))),
+        ("LEDs           encoder", lambda: encoder.encode(OP_CODES["Set BackPanel LEDs"], b'\x03')),
+    ]
+    for name, fn in cases:
+        elapsed = min(timeit.repeat(fn, number=number, repeat=3))
+        print(f"{name:26s} {1e9 * elapsed / number:8.0f} ns/frame")
+
+if __name__ == "__main__":
+    run()
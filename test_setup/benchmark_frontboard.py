@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import argparse
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IOBoardDriver as GPIO
+from frontboard_emulator import FrontBoardEmulator
+
+'''
+Headless benchmark of the unmodified IOBoardDriver against the front board emulator (needs a local redis server,
+like the driver itself).
+
+Measures the driver start up time, the transaction rate and latency of the most used calls, and with error injection
+enabled, how many transactions fail and whether the link recovers afterwards.
+
+    python3 benchmark_frontboard.py --seconds 5 --corrupt 0.01 --garbage 0.01
+'''
+
+def timed_calls(name, fn, seconds):
+    latencies = []
+    failures = 0
+    end = time.time() + seconds
+    while time.time() < end:
+        t = time.perf_counter()
+        try:
+            result = fn()
+        except TypeError:       # Some driver calls index into a failed (None) response
+            result = None
+        latencies.append(time.perf_counter() - t)
+        if result is None:
+            failures += 1
+    latencies.sort()
+    n = len(latencies)
+    print(f"{name:22s} {n / seconds:7.1f} calls/s   p50 {1000 * latencies[n // 2]:6.2f} ms   "
+          f"p99 {1000 * latencies[min(n - 1, int(n * 0.99))]:6.2f} ms   failed {failures}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=3, help="Duration of each measurement")
+    parser.add_argument("--baudrate", type=int, default=1000000)
+    parser.add_argument("--drop", type=float, default=0.0, help="Probability of a reply being dropped")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="Probability of a reply with a bad checksum")
+    parser.add_argument("--garbage", type=float, default=0.0, help="Probability of a garbage byte before a reply")
+    parser.add_argument("--late", type=float, default=0.0, help="Probability of a reply arriving late")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    emulator = FrontBoardEmulator(baudrate=args.baudrate, seed=args.seed, hall_offset=600)
+    port = emulator.start()
+    print(f"Emulator on {port}")
+
+    t = time.perf_counter()
+    io = GPIO.FrontBoardDriver(port=port)
+    print(f"Driver start up took {time.perf_counter() - t:.2f} s")
+
+    # Inject errors only once the driver is up, so start up is comparable between runs
+    emulator.drop_rate = args.drop
+    emulator.corrupt_rate = args.corrupt
+    emulator.garbage_rate = args.garbage
+    emulator.late_rate = args.late
+
+    io.setPanVelocityControl()
+    failures = 0
+    failures += timed_calls("goal velocity write", lambda: io.bsr_frame(io.encoder.dynamixel_write(2, 104, 10)), args.seconds)
+    failures += timed_calls("getCurrentPanAngle", io.getCurrentPanAngle, args.seconds)
+    failures += timed_calls("getTrackerMessage", io.getTrackerMessage, args.seconds)
+    failures += timed_calls("group position write", lambda: io.groupDynamixelWrite(((1, 116), (1, 112), (2, 116), (2, 112)), (900, 20, 2500, 40)), args.seconds)
+    failures += timed_calls("getHallStatus", io.getHallStatus, args.seconds)
+    io.setPanGoalVelocity(0)
+
+    # Recovery check: with error injection off, every call should succeed again
+    emulator.drop_rate = emulator.corrupt_rate = emulator.garbage_rate = emulator.late_rate = 0
+    recovered = timed_calls("after errors stop", io.getHallStatus, 1.0) == 0
+    print(f"Emulator stats: {emulator.stats}")
+    print(f"Link recovered after injected errors: {recovered}")
+    emulator.stop()
+
+if __name__ == "__main__":
+    main()
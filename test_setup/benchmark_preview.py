@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+import http.client
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+'''
+Benchmark of the live preview (PreviewServer) with 1, 5 and 20 concurrent viewers, against one transcode per viewer
+(what test_setup/rtsp_mjpeg.py does).
+
+For each viewer count the preview server runs in its own process and the viewers connect to /preview.mjpg, a quarter
+of them reading slowly (--slow-delay between frames). Reported: CPU of the server process and its ffmpeg children,
+frames per second received by the normal and the slow viewers, the longest gap between frames, and how many frames
+the server skipped for slow viewers (they must not build up a backlog).
+
+Local RTSP test source, ex. with mediamtx running:
+
+    ffmpeg -re -f lavfi -i testsrc2=size=1920x1080:rate=25 -c:v libx264 -g 25 -f rtsp rtsp://127.0.0.1:8554/test
+    python3 benchmark_preview.py --rtsp rtsp://127.0.0.1:8554/test
+
+Without --rtsp the source is a 1080p ffmpeg test pattern read in real time (no network).
+'''
+
+TICKS = os.sysconf('SC_CLK_TCK')
+
+def source_args(args):
+    if args.rtsp:
+        import FfmpegSupervisor
+        return FfmpegSupervisor.rtsp_input_options() + ['-i', args.rtsp]
+    return ['-re', '-f', 'lavfi', '-i', 'testsrc2=size=1920x1080:rate=25']
+
+def process_tree(pid):
+    '''
+    pid and its descendants, from /proc
+    '''
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as fp:
+                    parents.setdefault(int(fp.read().rsplit(')', 1)[1].split()[1]), []).append(int(entry))
+            except (OSError, IndexError):
+                pass
+    tree, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        tree.append(p)
+        todo.extend(parents.get(p, []))
+    return tree
+
+def cpu_seconds(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as fp:
+                fields = fp.read().rsplit(')', 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / TICKS
+        except (OSError, IndexError):
+            pass
+    return total
+
+class Viewer(threading.Thread):
+
+    def __init__(self, port, delay=0):
+        super().__init__(daemon=True)
+        self.port = port
+        self.delay = delay
+        self.times = []
+        self.run_flag = True
+
+    def run(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        connection.request("GET", "/preview.mjpg")
+        response = connection.getresponse()
+        while self.run_flag:
+            length = None
+            while True:
+                line = response.fp.readline()
+                if not line:
+                    return
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+                elif line in (b"\r\n", b"\n") and length is not None:
+                    break
+            response.fp.read(length)
+            self.times.append(time.monotonic())
+            if self.delay:
+                time.sleep(self.delay)
+        connection.close()
+
+    def fps(self, start, end):
+        frames = [t for t in self.times if start <= t <= end]
+        return len(frames) / (end - start)
+
+    def max_gap(self, start, end):
+        frames = [t for t in self.times if start <= t <= end]
+        return max((b - a for a, b in zip(frames, frames[1:])), default=end - start)
+
+def serve(args):
+    import PreviewServer
+    PreviewServer.limit_cpu()
+    stream = PreviewServer.PreviewStream(source_args(args))
+    PreviewServer.serve(stream, port=args.port)
+    while True:
+        time.sleep(0.5)
+        stream.check()
+
+def preview_run(args, viewers):
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port)] +
+                              (["--rtsp", args.rtsp] if args.rtsp else []),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(2)
+    clients = [Viewer(args.port, args.slow_delay if i % 4 == 3 else 0) for i in range(viewers)]
+    for c in clients:
+        c.start()
+    time.sleep(args.warmup)
+    start, cpu_start = time.monotonic(), cpu_seconds(process_tree(server.pid))
+    time.sleep(args.seconds)
+    end, cpu_end = time.monotonic(), cpu_seconds(process_tree(server.pid))
+    stats = get_stats(args.port)
+    for c in clients:
+        c.run_flag = False
+    server.terminate()
+    for pid in process_tree(server.pid)[1:]:
+        try:
+            os.kill(pid, 15)
+        except OSError:
+            pass
+    server.wait()
+    report("shared encode", viewers, 100 * (cpu_end - cpu_start) / (end - start), clients, start, end,
+           stats.get("encoder", {}).get("starts"), stats.get("frames_skipped"))
+    args.port += 1
+
+def get_stats(port):
+    import json
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        connection.request("GET", "/preview_stats")
+        return json.loads(connection.getresponse().read())["state"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def legacy_run(args, viewers):
+    '''
+    One ffmpeg transcode per viewer, frames read as fast as they come
+    '''
+    processes = []
+    for _ in range(viewers):
+        command = ['ffmpeg', '-loglevel', 'error', *source_args(args), '-vf', 'fps=10,scale=640:-2', '-c:v', 'mjpeg',
+                   '-q:v', '8', '-f', 'image2pipe', '-']
+        processes.append(subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL))
+    readers = []
+    for p in processes:
+        t = threading.Thread(target=lambda p=p: [None for _ in iter(lambda: p.stdout.read(65536), b"")], daemon=True)
+        t.start()
+        readers.append(t)
+    time.sleep(args.warmup)
+    pids = [p.pid for p in processes]
+    start, cpu_start = time.monotonic(), cpu_seconds(pids)
+    time.sleep(args.seconds)
+    end, cpu_end = time.monotonic(), cpu_seconds(pids)
+    for p in processes:
+        p.kill()
+        p.wait()
+    print(f"{'per viewer ffmpeg':18s} {viewers:3d} viewers   CPU {100 * (cpu_end - cpu_start) / (end - start):6.1f} %   "
+          f"{viewers} RTSP pulls / encodes")
+
+def report(name, viewers, cpu, clients, start, end, encoder_starts, skipped):
+    normal = [c for c in clients if not c.delay]
+    slow = [c for c in clients if c.delay]
+    line = (f"{name:18s} {viewers:3d} viewers   CPU {cpu:6.1f} %   "
+            f"fps {min(c.fps(start, end) for c in normal):4.1f}-{max(c.fps(start, end) for c in normal):4.1f}")
+    if slow:
+        line += f"  (slow {sum(c.fps(start, end) for c in slow) / len(slow):4.1f})"
+    line += (f"   max gap {max(c.max_gap(start, end) for c in normal):.2f} s   encoder starts {encoder_starts}   "
+             f"frames skipped for slow viewers {skipped}")
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rtsp", help="RTSP test source (default: ffmpeg test pattern)")
+    parser.add_argument("--viewers", default="1,5,20")
+    parser.add_argument("--seconds", type=float, default=20, help="Measurement time per run")
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--slow-delay", type=float, default=0.5, help="Seconds a slow viewer waits between frames")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--legacy", action="store_true", help="Also measure one transcode per viewer")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    for viewers in [int(v) for v in args.viewers.split(",")]:
+        preview_run(args, viewers)
+        if args.legacy:
+            legacy_run(args, viewers)
+
+if __name__ == "__main__":
+    main()
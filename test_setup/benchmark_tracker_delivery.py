@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import argparse
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IOBoardDriver as GPIO
+from frontboard_emulator import FrontBoardEmulator
+
+'''
+Compares tracker message delivery by polling (op 0x65, older firmware) and by push (op 0x6A) against the front board
+emulator (needs a local redis server, like the driver itself).
+
+Runs a loop shaped like the tracking control loop: every tick it asks for a new tracker message, sends a pan velocity
+command when a fix arrives and reads the pan angle. Reports the serial transactions spent per delivered fix, how long
+a fix waits before the motion command that uses it and how many fixes were missed.
+
+    python3 benchmark_tracker_delivery.py --seconds 20 --tick 0.05
+'''
+
+def run(push_supported, seconds, tick, rate):
+    emulator = FrontBoardEmulator(push_supported=push_supported, hall_offset=600, seed=1)
+    port = emulator.start()
+    io = GPIO.FrontBoardDriver(port=port)
+    io.setPanVelocityControl()
+
+    # Only count what happens in the measured loop
+    for key in io.link_stats:
+        io.link_stats[key] = 0
+    start_ops = dict(emulator.ops)
+    start_pushed = emulator.stats["pushed"]
+
+    delivered = 0
+    end = time.time() + seconds
+    while time.time() < end:
+        if io.getTrackerMessage():
+            delivered += 1
+            io.setPanGoalVelocity(5)
+        io.getCurrentPanAngle()
+        time.sleep(tick)
+    io.setPanGoalVelocity(0)
+
+    stats = io.getTrackerStats()
+    requests = {op: emulator.ops[op] - start_ops[op] for op in emulator.ops if emulator.ops[op] - start_ops[op]}
+    emulator.stop()
+    produced = seconds * rate
+
+    print(f"--- {stats['mode']} ---")
+    print(f"fixes delivered          {delivered} of ~{produced:.0f} produced by the tracker")
+    print(f"tracker transactions/fix {stats['tracker_transactions_per_fix']}")
+    print(f"all transactions         {sum(requests.values())} ({', '.join(f'0x{op:02x}: {n}' for op, n in sorted(requests.items()))})")
+    print(f"pushed frames            {emulator.stats['pushed'] - start_pushed}")
+    print(f"fix -> command           avg {stats['fix_to_command_avg_ms']} ms   max {stats['fix_to_command_max_ms']} ms")
+    print(f"stale frames             {stats['stale_frames']}   checksum errors {stats['checksum_errors']}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10, help="Duration of each run")
+    parser.add_argument("--tick", type=float, default=0.05, help="Control loop sleep between iterations")
+    args = parser.parse_args()
+
+    run(push_supported=False, seconds=args.seconds, tick=args.tick, rate=10.0)
+    run(push_supported=True, seconds=args.seconds, tick=args.tick, rate=10.0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ZoomCurves
+import ZoomPlanner
+import Zoom_CBN8125 as ZoomController
+from visca_emulator import ViscaEmulator
+from replay_zoom_planner import synthetic_trace, true_distance, percentile
+
+'''
+Headless benchmark of the unmodified Zoom_CBN8125 driver against the VISCA emulator (needs a local redis server,
+like the driver itself).
+
+- start up time of the driver
+- command throughput (variable speed commands sent back to back) and position inquiry round trip
+- coalescing: a burst of zoom targets, how many reach the camera and whether the lens ends on the last one
+- closed loop: ZoomPlanner driving the lens along a synthetic session, framing error and command rate, with the lens
+  speed table right and 30% off
+- focus: time to sharp after zoom steps with the camera autofocus and with the zoom/focus presets
+
+    python3 benchmark_zoom.py --seconds 30
+'''
+
+def start(emulator, zoom_level=None):
+    '''
+    Driver attached to the emulator, after its start up zoom (then moved to zoom_level when given)
+    '''
+    port = emulator.start()
+    t = time.perf_counter()
+    zoom = ZoomController.SoarCameraZoomFocus(port=port)
+    startup = time.perf_counter() - t
+    zoom.waitCompletion(timeout=10)
+    if zoom_level is not None:
+        zoom.set_zoom_position(zoom_level)
+        zoom.waitCompletion(timeout=10)
+    return zoom, startup
+
+def throughput(count=100):
+    emulator = ViscaEmulator(seed=1)
+    zoom, startup = start(emulator)
+    print(f"driver start up          {1000 * startup:.0f} ms")
+    t = time.perf_counter()
+    for i in range(count):
+        zoom.set_zoom_speed(i % 8, "tele" if i % 2 else "wide")
+        zoom.waitCompletion(timeout=1)
+    elapsed = time.perf_counter() - t
+    zoom.stop_zoom()
+    zoom.waitCompletion()
+    print(f"command throughput       {count / elapsed:.1f} commands/s (ACK + completion, 9600 baud)")
+
+    replies = []
+    for _ in range(20):
+        before = zoom.stats["inquiries"]
+        t = time.perf_counter()
+        while zoom.stats["inquiries"] == before or zoom.waiting_inquiry:
+            time.sleep(0.0005)
+        replies.append(time.perf_counter() - t)
+    print(f"inquiry period (idle)    {sum(replies) / len(replies):.2f} s")
+    zoom.stop()
+    emulator.stop()
+
+def coalescing(count=100):
+    emulator = ViscaEmulator(seed=1)
+    zoom, _ = start(emulator)
+    rng = random.Random(1)
+    before = dict(zoom.getZoomStats())
+    targets = [round(rng.uniform(2, 20), 2) for _ in range(count)]
+    t = time.perf_counter()
+    for target in targets:
+        zoom.set_zoom_position(target)
+    queued = time.perf_counter() - t
+    zoom.waitCompletion(timeout=20)
+    stats = zoom.getZoomStats()
+    sent = stats["commands"] - before["commands"]
+    print(f"coalescing               {count} targets queued in {1000 * queued:.1f} ms, {sent} sent, "
+          f"{stats['superseded'] - before['superseded']} superseded, {stats['cancelled'] - before['cancelled']} cancelled by the camera")
+    print(f"                         lens at {emulator.zoom_level():.2f}x for a last target of {targets[-1]}x")
+    zoom.stop()
+    emulator.stop()
+
+def closed_loop(seconds, speed_scale):
+    curves = ZoomCurves.get_curves()
+    trace = [fix for fix in synthetic_trace(seed=1) if fix[0] >= 15][:int(seconds * 10)]
+    t0 = trace[0][0]
+    trace = [(t - t0, true, measured, recording) for t, true, measured, recording in trace]
+    emulator = ViscaEmulator(speed_scale=speed_scale, seed=1)
+    zoom, _ = start(emulator, zoom_level=curves.distance_to_zoom(trace[0][1]))
+    time.sleep(1)       # Lens position inquiry after the move
+    planner = ZoomPlanner.ZoomPlanner(curves, zoom, budget=4)
+    start_commands = len(emulator.command_log)
+    errors = []
+    begin = time.time()
+    fix_index = 0
+    last_step = 0
+    while True:
+        t = time.time() - begin
+        if t > trace[-1][0]:
+            break
+        while fix_index < len(trace) and trace[fix_index][0] <= t:
+            planner.update_range(t, trace[fix_index][2])
+            fix_index += 1
+        recording = trace[max(fix_index - 1, 0)][3]
+        if t - last_step >= 0.1:
+            last_step = t
+            planner.step(t, zoom.getZoomPosition(), 1, recording)
+        ideal = curves.distance_to_zoom(true_distance(trace, t))
+        errors.append(100 * abs(emulator.zoom_level() / ideal - 1))
+        time.sleep(0.01)
+    commands = [c for c in emulator.command_log[start_commands:] if c[1][1] == 0x01]
+    zoom.stop()
+    emulator.stop()
+    print(f"closed loop, lens rate x{speed_scale:.1f}  framing error mean {sum(errors) / len(errors):.1f} %  "
+          f"p95 {percentile(errors, 95):.1f} %   {len(commands) / trace[-1][0]:.2f} commands/s   {planner.getStats()['stalls']} stalls")
+
+def time_to_sharp(mode, steps, hold=0.3, timeout=8):
+    emulator = ViscaEmulator(seed=1)
+    calibration = dict(ZoomCurves.DEFAULT_CALIBRATION)
+    # As measured with measure_zoom_focus.py on the emulated scene
+    calibration["zoom_to_focus"] = [[z, round(emulator.true_focus(ZoomCurves.get_curves().zoom_to_position(z)))]
+                                    for z in range(1, 26)]
+    ZoomCurves.use_calibration(calibration)
+    zoom, _ = start(emulator)
+    zoom.set_focus_mode(mode)
+    results = []
+    for level in steps:
+        zoom.set_zoom_position(level)
+        t = time.time()
+        sharp_since = None
+        while time.time() - t < timeout:
+            if emulator.is_sharp() and emulator.zoom_target is None:
+                sharp_since = sharp_since or time.time()
+                if time.time() - sharp_since >= hold:
+                    break
+            else:
+                sharp_since = None
+            time.sleep(0.005)
+        results.append(sharp_since - t if sharp_since else timeout)
+    zoom.stop()
+    emulator.stop()
+    ZoomCurves.use_calibration(ZoomCurves.DEFAULT_CALIBRATION)
+    print(f"time to sharp, {mode:9s} mean {sum(results) / len(results):.2f} s   max {max(results):.2f} s   "
+          f"(zoom steps {', '.join(f'{s:g}x' for s in steps)})")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=30, help="Duration of each closed loop run")
+    args = parser.parse_args()
+
+    throughput()
+    coalescing()
+    closed_loop(args.seconds, 1.0)
+    closed_loop(args.seconds, 0.7)
+    steps = [4, 6, 5, 9, 12, 10, 15]
+    time_to_sharp("auto", steps)
+    time_to_sharp("preset", steps)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import math
+import timeit
+import random
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ZoomCurves
+
+'''
+Compares the previous distance -> zoom and zoom -> lens position calculations (dictionary scans and hand written
+interpolation, rebuilding the position list on every call) with the compiled ZoomCurves tables.
+Also reports how far the PCHIP tables are from the old piecewise linear curves and the inverse map round trip error.
+
+    python3 benchmark_zoom_curves.py
+'''
+
+calibration = ZoomCurves.DEFAULT_CALIBRATION
+distance_zoom_table = {d: z for d, z in calibration["distance_to_zoom"]}
+
+def legacy_distance_to_zoom(trackDistX, multiplier=1):
+    lower_distance = max([d for d in distance_zoom_table if d <= trackDistX], default=1)
+    upper_distance = min([d for d in distance_zoom_table if d >= trackDistX], default=15)
+    if lower_distance == upper_distance:
+        new_zoom_level = distance_zoom_table[lower_distance]
+    else:
+        x0, y0 = lower_distance, distance_zoom_table[lower_distance]
+        x1, y1 = upper_distance, distance_zoom_table[upper_distance]
+        new_zoom_level = y0 + (trackDistX - x0) * (y1-y0) / (x1-x0)
+        new_zoom_level = round(new_zoom_level * multiplier, 2)
+    return new_zoom_level
+
+def legacy_zoom_to_position(zoomValue):
+    zoomValue = max(min(zoomValue, 25), 0)
+    zoom_positions = [p for _, p in calibration["zoom_to_position"]]
+    if isinstance(zoomValue, int):
+        return zoom_positions[zoomValue - 1]
+    x0, y0 = math.floor(zoomValue), zoom_positions[math.floor(zoomValue) - 1]
+    x1, y1 = math.floor(zoomValue) + 1, zoom_positions[math.floor(zoomValue)]
+    return int(y0 + (zoomValue - x0) * (y1 - y0) / (x1 - x0))
+
+def main(number=200000):
+    curves = ZoomCurves.ZoomCurves(calibration)
+    rng = random.Random(1)
+    distances = [rng.uniform(1, 600) for _ in range(1000)]
+    zooms = [rng.uniform(1, 24.99) for _ in range(1000)]
+
+    cases = [
+        ("distance->zoom  legacy", lambda: legacy_distance_to_zoom(distances[137])),
+        ("distance->zoom  table", lambda: curves.distance_to_zoom(distances[137])),
+        ("zoom->position  legacy", lambda: legacy_zoom_to_position(zooms[42])),
+        ("zoom->position  table", lambda: curves.zoom_to_position(zooms[42])),
+        ("position->zoom  table", lambda: curves.position_to_zoom(13000)),
+    ]
+    for name, fn in cases:
+        elapsed = min(timeit.repeat(fn, number=number, repeat=3))
+        print(f"{name:26s} {1e9 * elapsed / number:8.0f} ns/call")
+
+    t = timeit.timeit(lambda: ZoomCurves.ZoomCurves(calibration), number=10) / 10
+    print(f"compiling both curves       {1000 * t:8.1f} ms (once per process)")
+
+    # Accuracy: exact on the calibration points, difference to the old linear interpolation in between
+    knots = max(abs(curves.zoom_to_position(z) - p) for z, p in calibration["zoom_to_position"])
+    linear = max(abs(curves.distance_to_zoom(d) - legacy_distance_to_zoom(d)) for d in distances)
+    round_trip = max(abs(curves.position_to_zoom(curves.zoom_to_position(z)) - z) for z in zooms)
+    print(f"max error on calibration points           {knots:.4f} lens units")
+    print(f"max distance->zoom difference to linear   {linear:.3f}x")
+    print(f"max zoom->position->zoom round trip error {round_trip:.4f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import sys
+import json
+import argparse
+
+'''
+Per clip report of a session manifest (written by ClipWorkers): clipping time, start offset (requested pre-roll start
+minus the keyframe the clip starts on, negative when the clip starts late) and delay from the wave end.
+
+    python3 clip_report.py /home/idmind/surfcamera_deploy_test/manifests/<SessionID>.jsonl
+'''
+
+def summary(name, values, unit):
+    if not values:
+        return f"{name:14s} -"
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return (f"{name:14s} mean {sum(values) / len(values):7.3f} {unit}   p95 {p95:7.3f} {unit}   "
+            f"min {values[0]:7.3f} {unit}   max {values[-1]:7.3f} {unit}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest")
+    args = parser.parse_args()
+
+    entries = []
+    with open(args.manifest) as fp:
+        for line in fp:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+
+    print(f"{'clip':>8s} {'status':>8s} {'attempts':>8s} {'clip s':>8s} {'offset s':>9s} {'delay s':>8s}")
+    for e in entries:
+        clip_seconds = "-" if e.get("clip_seconds") is None else f"{e['clip_seconds']:.3f}"
+        offset = "-" if e.get("start_offset") is None else f"{e['start_offset']:+.3f}"
+        print(f"{e['file']:>8s} {e['status']:>8s} {e['attempts']:8d} {clip_seconds:>8s} {offset:>9s} {e['delay']:8.2f}")
+
+    done = [e for e in entries if e["status"] == "done"]
+    print(f"\n{len(done)} of {len(entries)} clips done")
+    print(summary("clipping time", [e["clip_seconds"] for e in done if e.get("clip_seconds") is not None], "s"))
+    print(summary("start offset", [e["start_offset"] for e in done if e.get("start_offset") is not None], "s"))
+    print(summary("delay", [e["delay"] for e in done], "s"))
+
+if __name__ == "__main__":
+    main()
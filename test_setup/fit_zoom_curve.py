@@ -0,0 +1,118 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import numpy as np
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ZoomCurves
+
+'''
+Builds a zoom calibration curve from measured points and stores it in zoom_calibration/<model>.json.
+
+The input is a CSV file with one measurement per line (header optional), ex for the lens curve: zoom,lens_position
+(read with the zoom position inquiry) and for the tracking curve: distance_m,zoom (the zoom that framed the surfer
+well at that distance), and for the focus curve: zoom,focus_position (written by measure_zoom_focus.py).
+Repeated measurements of the same x are averaged, the result is made non decreasing with an isotonic fit (pool
+adjacent violators, not for the focus curve which can have any shape), and optionally reduced to the fewest knots
+that keep the PCHIP curve within --tolerance of the fitted points.
+
+    python3 fit_zoom_curve.py measured_lens.csv --curve zoom_to_position --model CBN8125 --tolerance 20
+    python3 fit_zoom_curve.py framing.csv --curve distance_to_zoom --tolerance 0.1 --dry-run
+'''
+
+def read_points(path):
+    points = {}
+    with open(path) as fp:
+        for row in csv.reader(fp):
+            try:
+                x, y = float(row[0]), float(row[1])
+            except (ValueError, IndexError):
+                continue        # Header or blank line
+            points.setdefault(x, []).append(y)
+    return sorted((x, sum(ys) / len(ys), len(ys)) for x, ys in points.items())
+
+def isotonic_fit(points):
+    '''
+    Pool adjacent violators: closest non decreasing sequence (weighted by the number of measurements per x)
+    '''
+    blocks = []     # [mean, weight, count of x values]
+    for _, y, weight in points:
+        blocks.append([y, weight, 1])
+        while len(blocks) > 1 and blocks[-2][0] > blocks[-1][0]:
+            y1, w1, n1 = blocks.pop()
+            y0, w0, n0 = blocks.pop()
+            blocks.append([(y0 * w0 + y1 * w1) / (w0 + w1), w0 + w1, n0 + n1])
+    fitted = []
+    for y, _, count in blocks:
+        fitted.extend([y] * count)
+    return [(x, y) for (x, _, _), y in zip(points, fitted)]
+
+def thin_knots(points, tolerance):
+    '''
+    Greedily removes the knot whose removal changes the curve the least, while the PCHIP through the remaining knots
+    stays within tolerance of every fitted point
+    '''
+    xs = np.array([p[0] for p in points])
+    ys = np.array([p[1] for p in points])
+    keep = list(range(len(points)))
+    while len(keep) > 2:
+        best, best_error = None, None
+        for i in keep[1:-1]:
+            trial = [k for k in keep if k != i]
+            error = np.max(np.abs(ZoomCurves.pchip_sample(xs[trial], ys[trial], xs) - ys))
+            if best_error is None or error < best_error:
+                best, best_error = i, error
+        if best_error > tolerance:
+            break
+        keep.remove(best)
+    return [points[k] for k in keep]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("csv", help="Measured points: x,y per line")
+    parser.add_argument("--curve", choices=["distance_to_zoom", "zoom_to_position", "zoom_to_focus"], required=True)
+    parser.add_argument("--model", default=ZoomCurves.DEFAULT_MODEL)
+    parser.add_argument("--tolerance", type=float, default=0.0, help="Allowed curve error when removing knots (0 keeps all)")
+    parser.add_argument("--dry-run", action="store_true", help="Print the result without writing the calibration file")
+    args = parser.parse_args()
+
+    measured = read_points(args.csv)
+    if len(measured) < 2:
+        sys.exit("Need at least 2 distinct x values")
+    if args.curve == "zoom_to_focus":
+        fitted = [(x, y) for x, y, _ in measured]
+    else:
+        fitted = isotonic_fit(measured)
+    adjusted = sum(1 for (_, y0, _), (_, y1) in zip(measured, fitted) if abs(y0 - y1) > 1e-9)
+    knots = thin_knots(fitted, args.tolerance) if args.tolerance > 0 else fitted
+
+    xs = np.array([p[0] for p in fitted])
+    ys = np.array([p[1] for p in fitted])
+    curve = ZoomCurves.pchip_sample([k[0] for k in knots], [k[1] for k in knots], xs)
+    print(f"{len(measured)} measured x values, {adjusted} adjusted to be monotone, {len(knots)} knots kept")
+    print(f"Max error of the curve to the fitted points: {np.max(np.abs(curve - ys)):.4f}")
+    decimals = 3 if args.curve == "distance_to_zoom" else 0
+    knots = [[round(x, 3), round(y, decimals) if decimals else int(round(y))] for x, y in knots]
+    print(json.dumps(knots))
+
+    if args.dry_run:
+        return
+    path = ZoomCurves.calibration_path(args.model)
+    try:
+        with open(path) as fp:
+            calibration = json.load(fp)
+    except FileNotFoundError:
+        calibration = dict(ZoomCurves.DEFAULT_CALIBRATION, model=args.model)
+    calibration[args.curve] = knots
+    ZoomCurves.ZoomCurves(calibration)      # Check it compiles before saving
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        json.dump(calibration, fp, indent=2)
+    print(f"Saved {args.curve} to {path}")
+
+if __name__ == "__main__":
+    main()
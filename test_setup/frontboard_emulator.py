@@ -0,0 +1,450 @@
+import os
+import sys
+import tty
+import time
+import math
+import random
+import select
+import struct
+import threading
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import FrontBoardProtocol
+
+'''
+Software emulator of the Front IO Board (ESP32) serial protocol, for running IOBoardDriver without the hardware.
+
+The emulator opens a pseudo-terminal and serves the board protocol on its master side, so the driver is attached to
+the slave path exactly like to the real board: FrontBoardDriver(port=emulator.port)
+
+Emulated:
+- Every op code of IOBoardDriver.get_op_codes()
+- Two Dynamixel servos (ID 1 tilt, ID 2 pan) with a register map, velocity / position / extended position modes,
+  profile velocity and acceleration dynamics and hardware error bits
+- The pan hall effect sensor, the back panel LEDs, shutdown and push button state and the tracker pairing process
+- Tracker GPS messages following a scripted path, polled (0x65) or pushed as they arrive (0x6A, enabled with 0x6B)
+- Serial timing at the configured baud rate, plus error injection (dropped replies, bad checksums, garbage bytes, late replies)
+
+Run standalone to get a pty path to point the driver at:
+    python3 frontboard_emulator.py
+'''
+
+OP = FrontBoardProtocol.OP_CODES
+
+PULSES_PER_REV = 4096
+VELOCITY_UNIT_RPM = 0.229
+ACCELERATION_UNIT_RPM2 = 214.577
+
+# Dynamixel X series control table addresses used by the driver
+ADDR_DRIVE_MODE = 10
+ADDR_OPERATING_MODE = 11
+ADDR_VELOCITY_LIMIT = 44
+ADDR_TORQUE_ENABLE = 64
+ADDR_HARDWARE_ERROR = 70
+ADDR_PROFILE_ACCELERATION = 108
+ADDR_PROFILE_VELOCITY = 112
+ADDR_GOAL_VELOCITY = 104
+ADDR_GOAL_POSITION = 116
+ADDR_PRESENT_VELOCITY = 128
+ADDR_PRESENT_POSITION = 132
+ADDR_PRESENT_TEMPERATURE = 146
+
+MODE_VELOCITY = 1
+MODE_POSITION = 3
+MODE_EXTENDED_POSITION = 4
+
+
+class DynamixelServo:
+    def __init__(self, ID, position=2048):
+        self.ID = ID
+        self.registers = {
+            ADDR_DRIVE_MODE: 0,
+            ADDR_OPERATING_MODE: MODE_POSITION,
+            ADDR_VELOCITY_LIMIT: 265,
+            ADDR_TORQUE_ENABLE: 0,
+            ADDR_HARDWARE_ERROR: 0,
+            76: 1920, 78: 100,              # Velocity I, P
+            80: 0, 82: 0, 84: 800,          # Position D, I, P
+            ADDR_GOAL_VELOCITY: 0,
+            ADDR_PROFILE_ACCELERATION: 0,
+            ADDR_PROFILE_VELOCITY: 0,
+            ADDR_GOAL_POSITION: position,
+            ADDR_PRESENT_VELOCITY: 0,
+            ADDR_PRESENT_POSITION: position,
+            ADDR_PRESENT_TEMPERATURE: 35,
+        }
+        self.position = float(position)   # pulses
+        self.velocity = 0.0               # rpm
+        self.last_update = time.time()
+
+    def reboot(self):
+        self.registers[ADDR_TORQUE_ENABLE] = 0
+        self.registers[ADDR_HARDWARE_ERROR] = 0
+        self.registers[ADDR_GOAL_VELOCITY] = 0
+        self.velocity = 0.0
+
+    def read(self, ADDR):
+        self.update()
+        return self.registers.get(ADDR, 0)
+
+    def write(self, ADDR, value):
+        self.update()
+        if ADDR == ADDR_OPERATING_MODE and self.registers[ADDR_TORQUE_ENABLE]:
+            return 0x02    # Real servos refuse EEPROM writes with torque ON (data range error bit)
+        if ADDR == ADDR_GOAL_POSITION and self.registers[ADDR_OPERATING_MODE] == MODE_POSITION:
+            value = min(max(value, 0), PULSES_PER_REV - 1)
+        self.registers[ADDR] = value
+        return 0
+
+    def update(self):
+        now = time.time()
+        dt = now - self.last_update
+        self.last_update = now
+        if dt <= 0:
+            return
+        regs = self.registers
+        limit_rpm = regs[ADDR_VELOCITY_LIMIT] * VELOCITY_UNIT_RPM
+        accel = regs[ADDR_PROFILE_ACCELERATION] * ACCELERATION_UNIT_RPM2 / 60   # rpm per second
+        mode = regs[ADDR_OPERATING_MODE]
+
+        if not regs[ADDR_TORQUE_ENABLE] or regs[ADDR_HARDWARE_ERROR]:
+            target_rpm = 0.0
+        elif mode == MODE_VELOCITY:
+            target_rpm = min(max(regs[ADDR_GOAL_VELOCITY] * VELOCITY_UNIT_RPM, -limit_rpm), limit_rpm)
+        else:
+            profile_rpm = regs[ADDR_PROFILE_VELOCITY] * VELOCITY_UNIT_RPM or limit_rpm
+            error = regs[ADDR_GOAL_POSITION] - self.position
+            # Slow down so we stop on the goal: v = sqrt(2 a d), capped by the profile velocity
+            stopping_rpm = math.sqrt(2 * (accel or 1e6) * abs(error) / PULSES_PER_REV * 60)
+            target_rpm = math.copysign(min(profile_rpm, stopping_rpm), error) if abs(error) > 0.5 else 0.0
+
+        if accel:
+            step = accel * dt
+            self.velocity += min(max(target_rpm - self.velocity, -step), step)
+        else:
+            self.velocity = target_rpm
+
+        previous = self.position
+        self.position += self.velocity / 60 * PULSES_PER_REV * dt
+        if mode in (MODE_POSITION, MODE_EXTENDED_POSITION) and regs[ADDR_TORQUE_ENABLE]:
+            goal = regs[ADDR_GOAL_POSITION]
+            if (previous - goal) * (self.position - goal) <= 0:   # Crossed or reached the goal
+                self.position = float(goal)
+                self.velocity = 0.0
+        regs[ADDR_PRESENT_POSITION] = int(round(self.position))
+        regs[ADDR_PRESENT_VELOCITY] = int(round(self.velocity / VELOCITY_UNIT_RPM))
+        load = abs(self.velocity) / max(limit_rpm, 1)
+        regs[ADDR_PRESENT_TEMPERATURE] = int(35 + 10 * load)
+
+
+def scripted_path(center=(38.9878, -9.4187), radius_m=120, period=90.0, rate=10.0):
+    '''
+    Default tracker path: a surfer going back and forth along an arc in front of the camera at `rate` fixes per second.
+    Yields (t, lat, lon) with t in seconds from the start of the script.
+    '''
+    i = 0
+    while True:
+        t = i / rate
+        angle = math.radians(60) * math.sin(2 * math.pi * t / period)
+        dlat = radius_m * math.cos(angle) / 111000
+        dlon = radius_m * math.sin(angle) / (111000 * math.cos(math.radians(center[0])))
+        yield t, center[0] + dlat, center[1] + dlon
+        i += 1
+
+
+class FrontBoardEmulator:
+    def __init__(self, baudrate=1000000, processing_delay=0.0005, path=None,
+                 drop_rate=0.0, corrupt_rate=0.0, garbage_rate=0.0, late_rate=0.0, late_delay=0.05,
+                 hall_offset=3000, hall_window=200, paired=True, push_supported=True, seed=None):
+        '''
+        baudrate: used to delay every reply by its transmission time (10 bits per byte) in both directions
+        processing_delay: board side processing time per request, in seconds
+        path: iterable of (t, lat, lon) tracker fixes, defaults to scripted_path()
+        drop_rate, corrupt_rate, garbage_rate, late_rate: probability per reply of not answering, sending a bad
+            checksum, prefixing a garbage byte, or answering late_delay seconds late
+        hall_offset, hall_window: pan pulses from the starting position where the hall sensor triggers, and its width
+        paired: start with a tracker already paired, so fixes flow straight away
+        push_supported: emulate firmware that knows the tracker push op codes, False to emulate older firmware that
+            ignores them (the driver should fall back to polling)
+        '''
+        self.baudrate = baudrate
+        self.processing_delay = processing_delay
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.garbage_rate = garbage_rate
+        self.late_rate = late_rate
+        self.late_delay = late_delay
+        self.random = random.Random(seed)
+
+        self.servos = {1: DynamixelServo(1, position=750), 2: DynamixelServo(2, position=2048)}
+        self.hall_position = self.servos[2].position + hall_offset
+        self.hall_window = hall_window
+
+        self.path = iter(path if path is not None else scripted_path())
+        self.path_start = None
+        self.next_fix = None
+        self.pending_fix = None
+
+        self.leds = 0
+        self.shutdown_seconds = 0
+        self.button_pressed = 0
+        self.paired = 1 if paired else 0
+        self.pairing_since = None
+        self.push_mode = False
+        self.board_start = time.time()
+
+        self.stats = {"requests": 0, "dropped": 0, "corrupted": 0, "garbage": 0, "late": 0, "bad_requests": 0, "pushed": 0}
+        self.ops = {op: 0 for op in OP.values()}
+        if not push_supported:
+            del self.ops[OP["Tracker Message Push"]], self.ops[OP["Set Tracker Push Mode"]]
+
+        self.master = None
+        self.port = None
+        self.running = False
+        self.thread = None
+        self.rx = bytearray()
+
+    # ---------------------------------------------------------------- pty plumbing
+
+    def start(self):
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave     # Keep the slave open so the pty survives driver reconnects
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def byte_time(self, n):
+        return n * 10 / self.baudrate
+
+    def serve(self):
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.002 if self.push_mode else 0.05)
+            if self.push_mode:
+                self.push_tracker()
+            if not ready:
+                continue
+            try:
+                chunk = os.read(self.master, 4096)
+            except OSError:
+                continue
+            self.rx += chunk
+            for op_code, data in self.extract_frames():
+                time.sleep(self.byte_time(7 + len(data)) + self.processing_delay)
+                self.reply(op_code, self.handle(op_code, data))
+
+    def extract_frames(self):
+        rx = self.rx
+        while True:
+            start = rx.find(b'\xff\xff')
+            if start < 0:
+                del rx[:max(len(rx) - 1, 0)]
+                return
+            if start:
+                del rx[:start]
+            if len(rx) < FrontBoardProtocol.HEADER_SIZE:
+                return
+            length = rx[4]
+            total = FrontBoardProtocol.HEADER_SIZE + length + FrontBoardProtocol.CHECKSUM_SIZE
+            if len(rx) < total:
+                return
+            frame = bytes(rx[:total])
+            del rx[:total]
+            if FrontBoardProtocol.frame_checksum(frame) != int.from_bytes(frame[-2:], "big") or frame[2] not in self.ops:
+                self.stats["bad_requests"] += 1
+                continue
+            yield frame[2], frame[FrontBoardProtocol.HEADER_SIZE:-FrontBoardProtocol.CHECKSUM_SIZE]
+
+    def reply(self, op_code, data):
+        self.stats["requests"] += 1
+        self.ops[op_code] += 1
+        r = self.random.random
+        if r() < self.drop_rate:
+            self.stats["dropped"] += 1
+            return
+        frame = FrontBoardProtocol.build_frame(op_code, data)
+        if r() < self.corrupt_rate:
+            self.stats["corrupted"] += 1
+            frame[-1] ^= 0x5A
+        if r() < self.garbage_rate:
+            self.stats["garbage"] += 1
+            frame = bytearray([self.random.randrange(256)]) + frame
+        if r() < self.late_rate:
+            self.stats["late"] += 1
+            time.sleep(self.late_delay)
+        self.write(frame)
+
+    def push_tracker(self):
+        '''
+        In push mode the board sends every new fix as soon as it arrives from the tracker, without being asked
+        '''
+        self.update_pairing()
+        fix = self.latest_fix()
+        if fix is None:
+            return
+        _, lat, lon = fix
+        board_time = int((time.time() - self.board_start) * 1000) & 0xFFFFFFFF
+        data = struct.pack('<iiI', int(round(lat * 10000000)), int(round(lon * 10000000)), board_time)
+        self.stats["pushed"] += 1
+        self.write(FrontBoardProtocol.build_frame(OP["Tracker Message Push"], data))
+
+    def write(self, frame):
+        time.sleep(self.byte_time(len(frame)))
+        os.write(self.master, frame)
+
+    # ---------------------------------------------------------------- board behaviour
+
+    def hall_triggered(self):
+        pan = self.servos[2]
+        pan.update()
+        return abs(pan.position - self.hall_position) <= self.hall_window
+
+    def latest_fix(self):
+        '''
+        Advances the scripted path to the current time, returns the newest fix not yet delivered (or None)
+        '''
+        now = time.time()
+        if self.path_start is None:
+            self.path_start = now
+        if not self.paired:
+            return None
+        while True:
+            if self.next_fix is None:
+                self.next_fix = next(self.path, None)
+                if self.next_fix is None:
+                    break
+            if self.path_start + self.next_fix[0] > now:
+                break
+            self.pending_fix = self.next_fix
+            self.next_fix = None
+        fix, self.pending_fix = self.pending_fix, None
+        return fix
+
+    def update_pairing(self):
+        if self.pairing_since is not None and time.time() - self.pairing_since >= 2:
+            self.pairing_since = None
+            self.paired = 1
+
+    def handle(self, op_code, data):
+        servos = self.servos
+        if op_code == OP["Firmware"]:
+            return b'EMU\x01'
+
+        if op_code == OP["Dynamixel Write"]:
+            ID, ADDR, value = FrontBoardProtocol.DYNAMIXEL_WRITE.unpack(data)
+            error = servos[ID].write(ADDR, value) if ID in servos else 0x80
+            return bytes([ID, error])
+
+        if op_code == OP["Dynamixel Read"]:
+            ID, ADDR = FrontBoardProtocol.DYNAMIXEL_ADDR.unpack(data)
+            servo = servos.get(ID)
+            value = servo.read(ADDR) if servo else 0
+            error = servo.registers[ADDR_HARDWARE_ERROR] if servo else 0x80
+            return bytes([ID, error]) + struct.pack('>i', value)
+
+        if op_code == OP["Group Dynamixel Write"]:
+            count = data[0]
+            for i in range(count):
+                ID, ADDR, value = FrontBoardProtocol.DYNAMIXEL_WRITE.unpack_from(data, 1 + i * 7)
+                if ID in servos:
+                    servos[ID].write(ADDR, value)
+            return bytes([count])
+
+        if op_code == OP["Group Dynamixel Read"]:
+            out = bytearray()
+            for i in range(data[0]):
+                ID, ADDR = FrontBoardProtocol.DYNAMIXEL_ADDR.unpack_from(data, 1 + i * 3)
+                out += struct.pack('>i', servos[ID].read(ADDR) if ID in servos else 0)
+            return bytes(out)
+
+        if op_code == OP["Bulk Dynamixel Read"]:
+            out = bytearray()
+            for ID in (1, 2):
+                servo = servos[ID]
+                position = servo.read(ADDR_PRESENT_POSITION) & 0xFFFF
+                velocity = servo.read(ADDR_PRESENT_VELOCITY) & 0xFFFF
+                out += struct.pack('>BBHH', ID, servo.registers[ADDR_HARDWARE_ERROR], position, velocity)
+            return bytes(out)
+
+        if op_code == OP["Bulk Temperature Read"]:
+            out = bytearray()
+            for ID in (1, 2):
+                servo = servos[ID]
+                out += bytes([ID, servo.registers[ADDR_HARDWARE_ERROR], servo.read(ADDR_PRESENT_TEMPERATURE)])
+            return bytes(out)
+
+        if op_code == OP["Set Shutdown"]:
+            self.shutdown_seconds = int.from_bytes(data[:2], 'little') if len(data) >= 2 else 0
+            return b'\x01'
+
+        if op_code == OP["Get Shutdown&PushButton"]:
+            return bytes([(self.button_pressed << 1) | (1 if self.shutdown_seconds else 0)])
+
+        if op_code == OP["Set BackPanel LEDs"]:
+            self.leds = data[0] if data else 0
+            return bytes([self.leds])
+
+        if op_code == OP["Get Mac Address"]:
+            return b'\x02\x00\x5e\x10\x20\x30'
+
+        if op_code == OP["Get Hall Status"]:
+            return b'\x00' if self.hall_triggered() else b'\x01'
+
+        if op_code == OP["Get Tracker Message"]:
+            self.update_pairing()
+            fix = self.latest_fix()
+            if fix is None:
+                return b''
+            _, lat, lon = fix
+            return struct.pack('<ii', int(round(lat * 10000000)), int(round(lon * 10000000)))
+
+        if op_code == OP["Set Tracker Push Mode"]:
+            self.push_mode = bool(data and data[0])
+            return bytes([1 if self.push_mode else 0])
+
+        if op_code == OP["Start Tracker Pairing"]:
+            if not self.paired and self.pairing_since is None:
+                self.pairing_since = time.time()
+                return b'\x01'
+            return b'\x00'
+
+        if op_code == OP["Check Tracker Pairing"]:
+            self.update_pairing()
+            return bytes([self.paired, 1 if self.pairing_since is not None else 0])
+
+        if op_code == OP["Cancel Current Pairing"]:
+            was_paired = self.paired or self.pairing_since is not None
+            self.paired = 0
+            self.pairing_since = None
+            return b'\x01' if was_paired else b'\x00'
+
+        if op_code == OP["Reboot both Dynamixel"]:
+            for servo in servos.values():
+                servo.reboot()
+            return b'\x01'
+
+        return b''
+
+
+if __name__ == "__main__":
+    emulator = FrontBoardEmulator()
+    port = emulator.start()
+    print(f"Front board emulator running on {port}")
+    print("Attach the driver with IOBoardDriver.FrontBoardDriver(port=...). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"Emulator stats: {emulator.stats}")
+    except KeyboardInterrupt:
+        emulator.stop()
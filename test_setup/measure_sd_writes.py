@@ -0,0 +1,69 @@
+import os
+import time
+import argparse
+
+'''
+Measures the data written to the SD card (block device counters in /sys/block/<device>/stat), to compare the write
+load of a session before and after a recording change. Run it during a session (tracking enabled, a few waves) and stop
+it with Ctrl+C, or give --seconds.
+
+    python3 measure_sd_writes.py --seconds 600
+    python3 measure_sd_writes.py --device mmcblk0 --interval 30
+'''
+
+SECTOR = 512    # /sys/block stat counts 512 byte sectors whatever the device
+
+def device_of(path):
+    '''
+    Block device (ex: mmcblk0) holding path, from /proc/mounts
+    '''
+    path = os.path.realpath(path)
+    best = ("", "")
+    with open("/proc/mounts") as fp:
+        for line in fp:
+            source, mount = line.split()[:2]
+            if source.startswith("/dev/") and (path == mount or path.startswith(mount.rstrip("/") + "/")):
+                if len(mount) > len(best[1]):
+                    best = (source, mount)
+    partition = os.path.basename(os.path.realpath(best[0])) if best[0] else ""
+    for device in os.listdir("/sys/block"):
+        if partition == device or os.path.exists(os.path.join("/sys/block", device, partition)):
+            return device
+    return None
+
+def sectors_written(device):
+    with open(f"/sys/block/{device}/stat") as fp:
+        return int(fp.read().split()[6])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", help="Block device, default: the one holding --path")
+    parser.add_argument("--path", default="/home/idmind/surfcamera_deploy_test", help="Where the videos are stored")
+    parser.add_argument("--seconds", type=float, help="Measurement duration (default: until Ctrl+C)")
+    parser.add_argument("--interval", type=float, default=60, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    device = args.device or device_of(args.path if os.path.exists(args.path) else "/")
+    if device is None:
+        print("Block device not found, give it with --device")
+        return
+    print(f"Measuring writes to /dev/{device}")
+    start = time.monotonic()
+    first = last = sectors_written(device)
+    last_print = start
+    try:
+        while args.seconds is None or time.monotonic() - start < args.seconds:
+            time.sleep(1)
+            if time.monotonic() - last_print >= args.interval:
+                now = sectors_written(device)
+                print(f"{time.monotonic() - start:7.0f} s  {(now - last) * SECTOR / 1e6:8.1f} MB in the last "
+                      f"{time.monotonic() - last_print:.0f} s")
+                last, last_print = now, time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.monotonic() - start
+    written = (sectors_written(device) - first) * SECTOR / 1e6
+    print(f"{written:.1f} MB written in {elapsed:.0f} s ({60 * written / max(elapsed, 1):.1f} MB/min)")
+
+if __name__ == "__main__":
+    main()
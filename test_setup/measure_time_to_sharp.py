@@ -0,0 +1,83 @@
+import os
+import sys
+import argparse
+import subprocess
+import numpy as np
+
+'''
+Measures how long recorded footage takes to become sharp after a zoom change (or the clip start), to compare the
+focus modes (camera autofocus vs zoom/focus presets) on the same scene.
+
+Frames are decoded with ffmpeg (grey, downscaled) and scored with the variance of the Laplacian. For each event the
+reference is the 90th percentile sharpness over the following --window seconds, and the time to sharp is the first
+moment the score reaches --level of that reference and stays there for --hold seconds.
+
+    python3 measure_time_to_sharp.py clip_auto.mp4 clip_preset.mp4
+    python3 measure_time_to_sharp.py session.mp4 --events 12.5,40,71.2 --window 8
+'''
+
+WIDTH = 320
+
+def read_frames(path, fps):
+    probe = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height',
+                            '-of', 'csv=p=0', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    width, height = [int(v) for v in probe.stdout.strip().split(",")[:2]]
+    height = int(round(height * WIDTH / width / 2)) * 2
+    command = ['ffmpeg', '-v', 'error', '-i', path, '-vf', f'fps={fps},scale={WIDTH}:{height},format=gray',
+               '-f', 'rawvideo', 'pipe:1']
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as p:
+        frame_size = WIDTH * height
+        while True:
+            data = p.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            yield np.frombuffer(data, dtype=np.uint8).reshape(height, WIDTH).astype(np.float32)
+
+def sharpness(frame):
+    laplacian = (frame[1:-1, :-2] + frame[1:-1, 2:] + frame[:-2, 1:-1] + frame[2:, 1:-1] - 4 * frame[1:-1, 1:-1])
+    return float(laplacian.var())
+
+def time_to_sharp(times, scores, event, window, level, hold):
+    inside = (times >= event) & (times < event + window)
+    if not inside.any():
+        return None, None
+    reference = np.percentile(scores[inside], 90)
+    sharp = inside & (scores >= level * reference)
+    for i in np.flatnonzero(inside):
+        if not sharp[i]:
+            continue
+        held = (times >= times[i]) & (times < times[i] + hold)
+        if sharp[held].all():
+            return times[i] - event, reference
+    return None, reference
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("clips", nargs="+")
+    parser.add_argument("--events", default="0", help="Comma separated zoom change times in seconds (default: clip start)")
+    parser.add_argument("--fps", type=float, default=15, help="Frames per second analysed")
+    parser.add_argument("--window", type=float, default=6, help="Seconds after each event used for the reference")
+    parser.add_argument("--level", type=float, default=0.9, help="Fraction of the reference sharpness counted as sharp")
+    parser.add_argument("--hold", type=float, default=0.5, help="Seconds the sharpness must hold")
+    args = parser.parse_args()
+    events = [float(e) for e in args.events.split(",")]
+
+    for clip in args.clips:
+        scores = np.array([sharpness(f) for f in read_frames(clip, args.fps)])
+        if not len(scores):
+            print(f"{os.path.basename(clip)}: no frames decoded")
+            continue
+        times = np.arange(len(scores)) / args.fps
+        results = []
+        for event in events:
+            elapsed, reference = time_to_sharp(times, scores, event, args.window, args.level, args.hold)
+            results.append(elapsed)
+            shown = "never" if elapsed is None else f"{elapsed:.2f} s"
+            print(f"{os.path.basename(clip)} @ {event:g} s: sharp after {shown} (reference {reference or 0:.0f})")
+        measured = [r for r in results if r is not None]
+        if len(events) > 1 and measured:
+            print(f"{os.path.basename(clip)}: mean {np.mean(measured):.2f} s, max {max(measured):.2f} s, "
+                  f"{len(results) - len(measured)} never sharp")
+
+if __name__ == "__main__":
+    main()
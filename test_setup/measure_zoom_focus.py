@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import argparse
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ZoomCurves
+import Zoom_CBN8125 as ZoomController
+
+'''
+Measures the zoom -> focus calibration points of the camera, using its autofocus on a real scene (needs a local redis
+server like the driver, and the SerialBroker stopped so the zoom port is free).
+
+For each zoom level the lens is zoomed, the autofocus is left to settle on a target at about the distance the
+tracking frames at that zoom (printed, ex: a buoy or the end of a pier), and the settled focus position is written to
+the CSV file. Then build the curve with:
+
+    python3 measure_zoom_focus.py focus.csv --port /dev/ttyUSB1
+    python3 fit_zoom_curve.py focus.csv --curve zoom_to_focus
+'''
+
+def settled_focus(zoom, timeout, stable_reads=3):
+    '''
+    Focus position once the autofocus stops moving it (same value over stable_reads focus inquiries)
+    '''
+    values = []
+    end = time.time() + timeout
+    while time.time() < end:
+        time.sleep(ZoomController.FOCUS_INQUIRY_EVERY * ZoomController.INQUIRY_PERIOD_IDLE)
+        values.append(zoom.getFocusPosition())
+        if len(values) >= stable_reads and values[-1] is not None and len(set(values[-stable_reads:])) == 1:
+            return values[-1]
+    return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("csv", help="Output file, zoom,focus_position per line")
+    parser.add_argument("--port", help="Zoom controller device, scanned when not given")
+    parser.add_argument("--levels", default="1,2,3,4,5,6,8,10,12,14,16,18,20,22,25", help="Zoom levels to measure")
+    parser.add_argument("--timeout", type=float, default=30, help="Max seconds to wait for the autofocus per level")
+    args = parser.parse_args()
+
+    curves = ZoomCurves.get_curves()
+    zoom = ZoomController.SoarCameraZoomFocus(port=args.port)
+    zoom.set_focus_mode("auto")
+    with open(args.csv, "a") as fp:
+        for level in [float(z) for z in args.levels.split(",")]:
+            zoom.set_zoom_position(level)
+            zoom.waitCompletion(timeout=10)
+            input(f"Zoom {level:g}x: aim at a target around {curves.zoom_to_distance(level):.0f} m and press Enter")
+            focus = settled_focus(zoom, args.timeout)
+            if focus is None:
+                print(f"Zoom {level:g}x: the autofocus didn't settle, skipped")
+                continue
+            fp.write(f"{level},{focus}\n")
+            fp.flush()
+            print(f"Zoom {level:g}x: focus position {focus}")
+    zoom.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import os
+import sys
+import csv
+import math
+import random
+import argparse
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ZoomCurves
+import ZoomPlanner
+
+'''
+Replays a surfer range trace through the previous zoom logic (Zoom Direct when the level changes by 0.25, frozen while
+recording) and through ZoomPlanner, against a simulated lens, and reports the framing error: how far the lens zoom
+is from the ideal zoom for the true range at that instant, as a subject size error in percent.
+
+The trace is a CSV file with time_s,distance_m[,recording] per line (ex: exported from the tracker GPS logs), or a
+synthetic session (paddling, a ride towards the camera while recording, a ride away) with GPS noise.
+
+    python3 replay_zoom_planner.py --synthetic
+    python3 replay_zoom_planner.py session_ranges.csv --budget 4
+
+The lens model moves the raw position at the calibrated rate of each VISCA speed (zoom_speed_rates), answers commands
+after a serial latency and reports its position like the zoom driver inquiries (every 100 ms while moving, 1 s idle).
+'''
+
+TICK = 0.01
+FIX_LATENCY = 0.2           # seconds between a GPS fix and it reaching the tracking loop
+COMMAND_LATENCY = 0.03      # VISCA command over 9600 baud plus the camera processing
+DIRECT_SPEED = 4            # Zoom Direct moves the lens at about this variable speed
+
+
+class SimulatedLens:
+    def __init__(self, curves, zoom=2.0):
+        self.curves = curves
+        self.position = curves.zoom_to_position(zoom)
+        self.max_position = curves.zoom_to_position(ZoomPlanner.MAX_ZOOM)
+        self.rate = 0.0             # lens units per second, signed
+        self.direct_target = None
+        self.queue = []             # (apply time, command)
+        self.now = 0.0
+        self.command_times = []
+        self.reported = curves.position_to_zoom(self.position)
+        self.last_report = 0.0
+        self.reversals = 0
+        self.last_direction = 0
+
+    def send(self, command):
+        self.command_times.append(self.now)
+        self.queue.append((self.now + COMMAND_LATENCY, command))
+
+    def set_zoom_speed(self, speed, direction="tele"):
+        rate = self.curves.speed_rates[speed]
+        self.send(("speed", rate if direction == "tele" else -rate))
+
+    def stop_zoom(self):
+        self.send(("speed", 0.0))
+
+    def set_zoom_position(self, zoom):
+        self.send(("direct", self.curves.zoom_to_position(max(min(zoom, 25), 1))))
+
+    def advance(self, now):
+        dt = now - self.now
+        self.now = now
+        while self.queue and self.queue[0][0] <= now:
+            _, (kind, value) = self.queue.pop(0)
+            if kind == "speed":
+                self.rate, self.direct_target = value, None
+            else:
+                self.direct_target = value
+                self.rate = math.copysign(self.curves.speed_rates[DIRECT_SPEED], value - self.position)
+        if self.rate:
+            direction = 1 if self.rate > 0 else -1
+            if self.last_direction and direction != self.last_direction:
+                self.reversals += 1
+            self.last_direction = direction
+        new_position = min(max(self.position + self.rate * dt, 0), self.max_position)
+        if self.direct_target is not None and (new_position - self.direct_target) * (self.position - self.direct_target) <= 0:
+            new_position, self.rate, self.direct_target = self.direct_target, 0.0, None
+        self.position = new_position
+        period = 0.1 if self.rate else 1.0
+        if now - self.last_report >= period:
+            self.last_report = now
+            self.reported = round(self.curves.position_to_zoom(self.position), 2)
+
+    @property
+    def zoom(self):
+        return self.curves.position_to_zoom(self.position)
+
+
+class LegacyZoom:
+    '''
+    The zoom logic before the planner: Zoom Direct on each fix when the level changed by 0.25, not while recording
+    '''
+    def __init__(self, curves, lens):
+        self.curves = curves
+        self.lens = lens
+        self.target = None
+
+    def on_fix(self, t, distance, recording):
+        if recording:
+            return
+        level = round(self.curves.distance_to_zoom(distance), 2)
+        if self.target is None or abs(level - self.target) >= 0.25:
+            self.lens.set_zoom_position(level)
+            self.target = level
+
+    def on_tick(self, t, recording):
+        pass
+
+
+class PlannerZoom:
+    def __init__(self, curves, lens, budget):
+        self.lens = lens
+        self.planner = ZoomPlanner.ZoomPlanner(curves, lens, budget=budget)
+        self.last_step = 0
+
+    def on_fix(self, t, distance, recording):
+        self.planner.update_range(t, distance)
+
+    def on_tick(self, t, recording):
+        if t - self.last_step >= 0.1:
+            self.last_step = t
+            self.planner.step(t, self.lens.reported, 1, recording)
+
+
+def synthetic_trace(seed=1, noise=2.0):
+    '''
+    (time, true distance, measured distance, recording) at 10 Hz
+    '''
+    rng = random.Random(seed)
+    segments = [      # (duration s, start m, end m, recording)
+        (20, 160, 170, False),      # Waiting
+        (12, 170, 60, True),        # Ride towards the camera
+        (10, 60, 60, False),
+        (15, 60, 140, False),       # Paddling back out
+        (10, 140, 220, True),       # Ride away along the beach
+        (10, 220, 210, False),
+    ]
+    trace, t = [], 0.0
+    for duration, start, end, recording in segments:
+        for i in range(int(duration * 10)):
+            x = start + (end - start) * i / (duration * 10)
+            trace.append((t, x, x + rng.gauss(0, noise), recording))
+            t += 0.1
+    return trace
+
+def read_trace(path):
+    trace = []
+    with open(path) as fp:
+        for row in csv.reader(fp):
+            try:
+                t, d = float(row[0]), float(row[1])
+            except (ValueError, IndexError):
+                continue
+            recording = len(row) > 2 and row[2].strip() not in ("", "0", "False", "false")
+            trace.append((t, d, d, recording))
+    t0 = trace[0][0]
+    return [(t - t0, true, measured, rec) for t, true, measured, rec in trace]
+
+def true_distance(trace, t):
+    # Linear interpolation of the true range at time t
+    lo, hi = 0, len(trace) - 1
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if trace[mid][0] <= t:
+            lo = mid
+        else:
+            hi = mid
+    t0, d0 = trace[lo][0], trace[lo][1]
+    t1, d1 = trace[hi][0], trace[hi][1]
+    return d0 if t1 == t0 else d0 + (d1 - d0) * min(max((t - t0) / (t1 - t0), 0), 1)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(p / 100 * len(values)), len(values) - 1)] if values else 0
+
+def run(name, trace, curves, controller_factory):
+    lens = SimulatedLens(curves, zoom=curves.distance_to_zoom(trace[0][1]))
+    controller = controller_factory(curves, lens)
+    errors, recording_errors = [], []
+    fix_index = 0
+    end = trace[-1][0] + FIX_LATENCY
+    t = 0.0
+    while t < end:
+        lens.advance(t)
+        while fix_index < len(trace) and trace[fix_index][0] + FIX_LATENCY <= t:
+            _, _, measured, recording = trace[fix_index]
+            controller.on_fix(t, measured, recording)
+            fix_index += 1
+        recording = trace[max(fix_index - 1, 0)][3]
+        controller.on_tick(t, recording)
+        ideal = curves.distance_to_zoom(true_distance(trace, t))
+        error = 100 * abs(lens.zoom / ideal - 1)
+        errors.append(error)
+        if recording:
+            recording_errors.append(error)
+        t += TICK
+
+    times = lens.command_times
+    window_max = 0
+    start = 0
+    for i, ct in enumerate(times):
+        while ct - times[start] >= 1.0:
+            start += 1
+        window_max = max(window_max, i - start + 1)
+    print(f"--- {name} ---")
+    print(f"framing error            mean {sum(errors) / len(errors):5.1f} %   p95 {percentile(errors, 95):5.1f} %   max {max(errors):5.1f} %")
+    if recording_errors:
+        print(f"framing error recording  mean {sum(recording_errors) / len(recording_errors):5.1f} %   p95 {percentile(recording_errors, 95):5.1f} %")
+    print(f"VISCA commands           {len(times)} ({len(times) / end:.2f}/s avg, max {window_max} in 1 s)")
+    print(f"lens direction reversals {lens.reversals}")
+    planner = getattr(controller, "planner", None)
+    if planner:
+        print(f"planner stats            {planner.getStats()}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("csv", nargs="?", help="time_s,distance_m[,recording] per line")
+    parser.add_argument("--synthetic", action="store_true", help="Replay a generated session instead of a file")
+    parser.add_argument("--budget", type=float, default=4, help="Planner VISCA commands per second")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if args.csv:
+        trace = read_trace(args.csv)
+    elif args.synthetic:
+        trace = synthetic_trace(args.seed)
+    else:
+        parser.error("Give a trace file or --synthetic")
+
+    curves = ZoomCurves.ZoomCurves(ZoomCurves.DEFAULT_CALIBRATION)
+    run("previous (0.25x steps, frozen while recording)", trace, curves, LegacyZoom)
+    run(f"planner (budget {args.budget:g}/s)", trace, curves, lambda c, l: PlannerZoom(c, l, args.budget))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import SegmentRing
+import ClipWorkers
+import SessionManifest
+import WaveEvents
+
+'''
+Overlapping wave extraction against a synthetic RTSP source, without the rest of the system (no redis, no camera).
+
+The segment ring records the source continuously while several simulated surfers start and end waves: each surfer
+alternates waves (--min-wave to --max-wave seconds) and rests, some of them back to back, so the waves of different
+surfers overlap. Every ended wave is clipped by the clip worker pool from the same ring, as in Camera.py. At the end
+every clip is checked with ffprobe: it must exist and cover its wave plus the pre-roll.
+
+Synthetic RTSP source: with mediamtx (https://github.com/bluenviron/mediamtx) on the PATH the script starts it and
+publishes an ffmpeg test pattern (H.264, 1 s GOP) to rtsp://127.0.0.1:8554/synthetic. Otherwise start any RTSP
+source and pass it with --rtsp.
+
+    python3 synthetic_waves.py --minutes 5 --surfers 4 --waves-per-minute 20
+'''
+
+RTSP_PORT = 8554
+
+def start_source():
+    if shutil.which("mediamtx") is None:
+        sys.exit("mediamtx not found, start an RTSP source and pass it with --rtsp")
+    server = subprocess.Popen(["mediamtx"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1)
+    url = f"rtsp://127.0.0.1:{RTSP_PORT}/synthetic"
+    publisher = subprocess.Popen(['ffmpeg', '-loglevel', 'error', '-re', '-f', 'lavfi',
+                                  '-i', 'testsrc2=size=1920x1080:rate=25', '-c:v', 'libx264', '-preset', 'ultrafast',
+                                  '-g', '25', '-pix_fmt', 'yuv420p', '-f', 'rtsp', '-rtsp_transport', 'tcp', url])
+    time.sleep(2)
+    return url, [publisher, server]
+
+def schedule(args, start):
+    '''
+    (t, wave id, "start" / "end") for every surfer, sorted by time
+    '''
+    rng = random.Random(args.seed)
+    mean_wave = (args.min_wave + args.max_wave) / 2
+    mean_rest = max(60 * args.surfers / args.waves_per_minute - mean_wave, 0)
+    events = []
+    for surfer in range(args.surfers):
+        t = start + rng.uniform(0, mean_rest)
+        n = 0
+        while True:
+            duration = rng.uniform(args.min_wave, args.max_wave)
+            if t + duration > start + 60 * args.minutes:
+                break
+            wave = f"surfer{surfer}_{n}"
+            events.append((t, wave, "start"))
+            events.append((t + duration, wave, "end"))
+            n += 1
+            # Back to back (next wave starts as this one ends) or a rest
+            t += duration + (0 if rng.random() < args.back_to_back else rng.expovariate(1 / mean_rest) if mean_rest else 0)
+    return sorted(events)
+
+def clip_duration(path):
+    result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        return float(json.loads(result.stdout)["format"]["duration"])
+    except (ValueError, KeyError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rtsp", help="RTSP source (default: mediamtx with an ffmpeg test pattern)")
+    parser.add_argument("--minutes", type=float, default=3)
+    parser.add_argument("--surfers", type=int, default=3)
+    parser.add_argument("--waves-per-minute", type=float, default=12)
+    parser.add_argument("--min-wave", type=float, default=5)
+    parser.add_argument("--max-wave", type=float, default=15)
+    parser.add_argument("--back-to-back", type=float, default=0.25, help="Fraction of waves followed right away by another")
+    parser.add_argument("--pre-roll", type=float, default=12, help="Camera.BUFFER_TIME_BEFORE")
+    parser.add_argument("--min-duration", type=float, default=4, help="Camera.MINIMUM_CLIP_TIME")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="Keep the clips and the manifest")
+    args = parser.parse_args()
+
+    processes = []
+    url = args.rtsp
+    if url is None:
+        url, processes = start_source()
+    work = tempfile.mkdtemp(prefix="synthetic_waves_")
+    ring = SegmentRing.SegmentRing(url, os.path.join(work, "ring"))
+    pool = ClipWorkers.ClipWorkerPool()
+    waves = WaveEvents.WaveTracker(ring, args.pre_roll, args.min_duration)
+    manifest = SessionManifest.SessionManifest("synthetic", directory=work)
+    pending = []
+    jobs = []
+    pool.start()
+    try:
+        ring.start()
+        print(f"Recording {url}, waiting {args.pre_roll + 2 * SegmentRing.SEGMENT_TIME:.0f} s for the pre-roll")
+        warmup = time.monotonic() + args.pre_roll + 2 * SegmentRing.SEGMENT_TIME
+        while time.monotonic() < warmup:
+            ring.poll()
+            time.sleep(0.05)
+        events = schedule(args, time.monotonic())
+        print(f"{len(events) // 2} waves over {args.minutes} min, {args.surfers} surfers")
+        end = events[-1][0] if events else time.monotonic()
+        while events or pending or pool.running_jobs or pool.jobs.qsize():
+            time.sleep(0.02)
+            ring.poll()
+            if ring.restart_due():
+                ring.start()
+            while events and events[0][0] <= time.monotonic():
+                t, wave, kind = events.pop(0)
+                if kind == "start":
+                    waves.start(wave, t)
+                    continue
+                w = waves.end(wave, t)
+                if w is not None:
+                    job = ClipWorkers.ClipJob(len(jobs), os.path.join(work, f"{len(jobs)}.mp4"), w.start, w.end,
+                                              args.pre_roll, w.pin, manifest)
+                    job.wave = w.wave
+                    job.record()
+                    jobs.append(job)
+                    pending.append(job)
+            # As Camera.submit_clips
+            for job in list(pending):
+                if ring.covered_until() < job.end and time.monotonic() - job.end < 10:
+                    break
+                job.segments = ring.segments_between(job.start, job.end)
+                if not pool.submit(job):
+                    break
+                pending.remove(job)
+            while len(pending) > ClipWorkers.MAX_BACKLOG:
+                job = pending.pop(0)
+                pool.drop(job, "clip backlog full")
+                ring.unpin(job.pin)
+            for job in pool.results():
+                ring.unpin(job.pin)
+            if time.monotonic() > end + 60:
+                print("Clips still pending 60 s after the last wave")
+                break
+        ring.stop()
+        pool.stop()
+        for job in pool.results():
+            ring.unpin(job.pin)
+
+        bad = []
+        delays = []
+        for record, job in zip(manifest.clips(), jobs):
+            expected = job.end - job.start
+            duration = clip_duration(record["path"]) if record.get("status") == "done" else None
+            if duration is None or duration < expected - 0.5:
+                bad.append((job.wave, record.get("status"), round(expected, 2), duration, record.get("error")))
+            if record.get("delay") is not None:
+                delays.append(record["delay"])
+        stats = pool.getStats()
+        print(f"Waves: {waves.stats['started']} started, {len(jobs)} clipped, {waves.stats['too_short']} too short, "
+              f"max {waves.stats['max_open']} open at once")
+        print(f"Clips: {stats['done']} done, {stats['failed']} failed, {stats['dropped']} dropped, "
+              f"{stats['retries']} retries, {stats['queue_full']} times queue full")
+        if delays:
+            print(f"Wave end to clip: mean {sum(delays) / len(delays):.2f} s, max {max(delays):.2f} s")
+        print(f"Ring: {ring.getStats()}")
+        for b in bad:
+            print(f"  BAD clip {b[0]}: status {b[1]}, wave + pre-roll {b[2]} s, clip {b[3]} s, {b[4]}")
+        print("OK" if not bad else f"{len(bad)} bad clips")
+    finally:
+        if ring.running:
+            ring.stop()
+        for p in processes:
+            p.terminate()
+            p.wait()
+        if args.keep:
+            print(f"Clips and manifest kept in {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import socket
+import threading
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import CameraProbe
+
+'''
+CameraProbe state changes against local sockets (no camera needed).
+
+    python3 -m pytest test_setup/test_camera_probe.py    or    python3 test_setup/test_camera_probe.py
+'''
+
+class FakeWebApp():
+    def __init__(self):
+        self.errors = {}
+
+    def set_error(self, source, message):
+        self.errors[source] = message
+
+    def clear_error(self, source):
+        self.errors.pop(source, None)
+
+def closed_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def rtsp_server():
+    '''
+    Answers every connection with an RTSP reply, returns its port
+    '''
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    def serve():
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                conn.recv(1024)
+                conn.sendall(b"RTSP/1.0 200 OK\r\nCSeq: 1\r\n\r\n")
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1]
+
+def test_down_at_boot():
+    webapp = FakeWebApp()
+    probe = CameraProbe.CameraProbe(f"rtsp://127.0.0.1:{closed_port()}/stream", webapp, timeout=0.2)
+    for _ in range(CameraProbe.DOWN_AFTER):
+        probe.update(probe.probe(), 0, 0)
+    assert probe.state == "down"
+    assert not probe.wait_up(0)
+    assert "camera" in webapp.errors
+
+def test_up_at_boot_then_down():
+    webapp = FakeWebApp()
+    probe = CameraProbe.CameraProbe(f"rtsp://127.0.0.1:{rtsp_server()}/stream", webapp, timeout=0.5)
+    probe.update(probe.probe(), 0, 0)
+    assert probe.state == "up" and probe.wait_up(0)
+    assert "camera" not in webapp.errors
+    for i in range(CameraProbe.DOWN_AFTER):
+        assert probe.state == "up"     # Hysteresis: one lost reply doesn't flap it
+        probe.update("timed out", 0, 0)
+    assert probe.state == "down" and "camera" in webapp.errors
+    for _ in range(CameraProbe.UP_AFTER):
+        probe.update(None, 0, 0)
+    assert probe.state == "up" and "camera" not in webapp.errors
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} OK")
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import SerialBroker
+
+'''
+BrokerClient calls through a real Unix socket, against fake drivers (no serial ports, no redis).
+
+    python3 -m pytest test_setup/test_serial_broker.py    or    python3 test_setup/test_serial_broker.py
+'''
+
+class FakeFrontBoard():
+    '''
+    Records the calls, with the same signatures as IOBoardDriver.FrontBoardDriver
+    '''
+    def __init__(self):
+        self.calls = []
+
+    def setBackPanelLEDs(self, first=False, second=False):
+        self.calls.append(("setBackPanelLEDs", first, second))
+
+    def setShutdown(self, seconds=15):
+        self.calls.append(("setShutdown", seconds))
+        return seconds
+
+    def setAngles(self, pan, tilt, pan_speed=None, tilt_speed=None):
+        self.calls.append(("setAngles", pan, tilt, pan_speed, tilt_speed))
+
+    def setTiltAngle(self, tilt, tilt_speed=None):
+        self.calls.append(("setTiltAngle", tilt, tilt_speed))
+
+    def getFirmware(self):
+        return "fake"
+
+    def serviceHealth(self):
+        pass
+
+def start_broker(frontboard):
+    socket_path = os.path.join(tempfile.mkdtemp(), "broker.sock")
+    broker = SerialBroker.SerialBroker(socket_path, targets={"frontboard": frontboard})
+    d = {"stop": False}
+    threading.Thread(target=broker.serve, args=(d,), daemon=True).start()
+    while not os.path.exists(socket_path):
+        time.sleep(0.01)
+    return SerialBroker.FrontBoardClient(socket_path), d
+
+def test_keyword_arguments():
+    board = FakeFrontBoard()
+    client, d = start_broker(board)
+    try:
+        assert client.setShutdown(seconds=5) == 5         # Two way
+        client.setBackPanelLEDs(first=True, second=False)  # One way, coalesced
+        client.setTiltAngle(tilt=12.5)
+        client.setAngles(pan=0, tilt=5, pan_speed=1, tilt_speed=1)
+        client.setAngles(3, tilt=4)
+        assert client.getFirmware() == "fake"   # Served after the one way calls queued before it (same connection)
+    finally:
+        d["stop"] = True
+    assert ("setShutdown", 5) in board.calls
+    assert ("setBackPanelLEDs", True, False) in board.calls
+    assert ("setTiltAngle", 12.5, None) in board.calls
+    angles = [c for c in board.calls if c[0] == "setAngles"]
+    assert angles[-1] == ("setAngles", 3, 4, None, None)
+    assert ("setAngles", 0, 5, 1, 1) in angles or len(angles) == 1     # May be coalesced by the newer one
+
+def test_coalescing_with_keyword_arguments():
+    board = FakeFrontBoard()
+    socket_path = os.path.join(tempfile.mkdtemp(), "broker.sock")
+    broker = SerialBroker.SerialBroker(socket_path, targets={"frontboard": board})
+    method = SerialBroker.METHOD_IDS[("frontboard", "setTiltAngle")]
+    for tilt in (1, 2, 3):      # Queued while the worker isn't running: only the latest is kept
+        broker.submit({"method": method, "flags": SerialBroker.FLAG_ONEWAY, "args": (), "kwargs": {"tilt": tilt},
+                       "t_enqueue": time.time()})
+    assert broker.queue_size == 1
+    job = broker.next_job(0)
+    assert job["kwargs"] == {"tilt": 3}
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} OK")
@@ -5,6 +5,9 @@
 # Base directory where your scripts live
 BASE_DIR="/home/idmind/surfcamera_deploy_test/test_setup"
 
+echo "Starting Serial Broker..."
+nohup python3 "$BASE_DIR/../SerialBroker.py" &
+
 echo "Starting RTSP MJPEG server..."
 nohup python3 "$BASE_DIR/rtsp_mjpeg.py" 
 
@@ -0,0 +1,85 @@
+import os
+import sys
+import shutil
+import tempfile
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import SessionManifest
+import StorageManager
+
+'''
+StorageManager eviction on temporary folders (no redis, no camera).
+
+    python3 -m pytest test_setup/test_storage_manager.py    or    python3 test_setup/test_storage_manager.py
+'''
+
+class FakeWebApp():
+    def __init__(self, session_id):
+        self.SessionID = session_id
+        self.errors = {}
+
+    def set_error(self, source, message):
+        self.errors[source] = message
+
+    def clear_error(self, source):
+        self.errors.pop(source, None)
+
+def make_session(index, name, size, **fields):
+    folder = os.path.join(index.videos_directory, name)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "0.mp4"), "wb") as fp:
+        fp.write(b"x" * size)
+    index.register(name)
+    index.update(name, bytes=size, **fields)
+    return folder
+
+def test_no_session_folder_is_protected():
+    work = tempfile.mkdtemp()
+    saved = {k: getattr(StorageManager, k) for k in ("STORAGE_DIRECTORY", "GPS_LOGS_DIRECTORY", "MIN_FREE_BYTES",
+                                                      "TARGET_FREE_BYTES")}
+    try:
+        StorageManager.STORAGE_DIRECTORY = work
+        StorageManager.GPS_LOGS_DIRECTORY = os.path.join(work, "gps_logs")
+        StorageManager.MIN_FREE_BYTES = StorageManager.TARGET_FREE_BYTES = 1 << 60    # Card "full": evict everything allowed
+        index = SessionManifest.SessionIndex(os.path.join(work, "manifests"), os.path.join(work, "videos"))
+        uploaded = make_session(index, "5", 100, uploaded=1)
+        not_uploaded = make_session(index, "6", 100)
+        webapp = FakeWebApp(-1)     # No session: WebApp.SessionID is the int -1
+        recording = make_session(index, SessionManifest.session_name(webapp.SessionID), 100)   # As Camera.worker
+
+        manager = StorageManager.StorageManager(index, webapp)
+        manager.check(StorageManager.active_sessions(webapp))
+
+        assert os.path.isdir(recording)
+        assert not os.path.exists(uploaded) and not os.path.exists(not_uploaded)
+        assert "storage" in webapp.errors
+    finally:
+        for k, v in saved.items():
+            setattr(StorageManager, k, v)
+        shutil.rmtree(work, ignore_errors=True)
+
+def test_outside_session_evicted_first():
+    work = tempfile.mkdtemp()
+    saved = StorageManager.STORAGE_DIRECTORY, StorageManager.GPS_LOGS_DIRECTORY
+    try:
+        StorageManager.STORAGE_DIRECTORY = work
+        StorageManager.GPS_LOGS_DIRECTORY = os.path.join(work, "gps_logs")
+        index = SessionManifest.SessionIndex(os.path.join(work, "manifests"), os.path.join(work, "videos"))
+        make_session(index, SessionManifest.NO_SESSION, 100)
+        make_session(index, "-1", 100)      # Left by the versions that named it after the SessionID
+        make_session(index, "7", 100)
+        manager = StorageManager.StorageManager(index)
+        free = StorageManager.MIN_FREE_BYTES      # Not about to be full: only the first choice candidates
+        names = [r["session"] for r in manager.candidates(StorageManager.active_sessions(FakeWebApp(7)), free)]
+        assert sorted(names) == sorted([SessionManifest.NO_SESSION, "-1"])
+    finally:
+        StorageManager.STORAGE_DIRECTORY, StorageManager.GPS_LOGS_DIRECTORY = saved
+        shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} OK")
@@ -0,0 +1,88 @@
+import os
+import sys
+import shutil
+import tempfile
+import pytest
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import db
+import Camera
+import WaveEvents
+import SessionManifest
+
+'''
+Overlapping waves queued on camera_state.wave_events, through Camera.wave_event (fake redis, no camera, no ring).
+
+    python3 -m pytest test_setup/test_wave_events.py    or    python3 test_setup/test_wave_events.py
+'''
+
+class FakeRing():
+    '''
+    Pins of SegmentRing.SegmentRing, without segments
+    '''
+    def __init__(self):
+        self.pins = {}
+        self.next_pin = 0
+
+    def pin(self, t):
+        self.next_pin += 1
+        self.pins[self.next_pin] = t
+        return self.next_pin
+
+    def unpin(self, pin):
+        self.pins.pop(pin, None)
+
+def make_camera(work):
+    cam = Camera.Cam.__new__(Camera.Cam)    # Without __init__: no camera probe
+    cam.camera_state = db.CameraState(fakeredis.FakeRedis())
+    cam.camera_state.wave_nr = 0
+    cam.ring = FakeRing()
+    cam.waves = WaveEvents.WaveTracker(cam.ring, Camera.BUFFER_TIME_BEFORE, Camera.MINIMUM_CLIP_TIME)
+    cam.manifest = SessionManifest.SessionManifest("1", work)
+    cam.trajectory = None
+    cam.pending_clips = []
+    return cam
+
+def test_overlapping_waves():
+    work = tempfile.mkdtemp()
+    try:
+        cam = make_camera(work)
+        state = cam.camera_state
+        state.push_wave_event("surfer 1", "start", t=100)
+        state.push_wave_event("surfer 2", "start", t=103)
+        state.push_wave_event("surfer 1", "end", t=110)     # Surfer 2 still riding
+        state.push_wave_event("surfer 2", "end", t=115)
+        for event in state.pop_wave_events():
+            cam.wave_event(event, work)
+        assert state.pop_wave_events() == []
+
+        first, second = cam.pending_clips
+        assert (first.clip, first.start, first.end) == (0, 100 - Camera.BUFFER_TIME_BEFORE, 110)
+        assert (second.clip, second.start, second.end) == (1, 103 - Camera.BUFFER_TIME_BEFORE, 115)
+        assert first.output_file != second.output_file
+        assert first.pin != second.pin and set(cam.ring.pins) == {first.pin, second.pin}   # Until clipped
+        assert not cam.waves.open
+        assert [r["status"] for r in SessionManifest.SessionManifest("1", work).clips()] == ["pending", "pending"]
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def test_back_to_back_auto_waves():
+    work = tempfile.mkdtemp()
+    try:
+        cam = make_camera(work)
+        for start, end in ((100, 110), (110, 120)):     # start_recording toggled by AutoRecording, the wave "auto"
+            cam.wave_event({"wave": "auto", "event": "start", "t": start}, work)
+            cam.wave_event({"wave": "auto", "event": "end", "t": end}, work)
+        assert [(j.clip, j.end) for j in cam.pending_clips] == [(0, 110), (1, 120)]
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} OK")
@@ -5,12 +5,11 @@ import os
 ## Make sure to adjust this path as needed
 sys.path.append(os.path.join(os.path.dirname(__file__), '/home/idmind/surfcamera_deploy_test')) 
 
-import IOBoardDriver as GPIO
-import Zoom_CBN8125 as ZoomController
+import SerialBroker
 
 def main():
-    IO = GPIO.FrontBoardDriver()
-    Zoom = ZoomController.SoarCameraZoomFocus()
+    IO = SerialBroker.FrontBoardClient()     # Requires the SerialBroker process to be running
+    Zoom = SerialBroker.ZoomClient()
 
     r = redis.Redis(host='localhost', port=6379, db=1, decode_responses=True)
 
@@ -0,0 +1,348 @@
+import os
+import sys
+import tty
+import time
+import math
+import random
+import select
+import threading
+
+## Make sure to adjust this path as needed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ZoomCurves
+
+'''
+Software emulator of the SOAR CBN8125 zoom/focus controller (VISCA over RS232), for running Zoom_CBN8125 without
+the camera.
+
+The emulator opens a pseudo-terminal and serves VISCA on its master side, so the driver is attached to the slave path
+like to the real USB-RS232 converter: SoarCameraZoomFocus(port=emulator.port)
+
+Emulated:
+- Zoom position 0 to 0x4000 moving at the calibrated rate of each variable speed (zoom_speed_rates of the camera
+  calibration, scaled by speed_scale to emulate a badly calibrated table), Zoom Direct at direct_speed, standard
+  tele / wide and stop
+- Focus position with its own motor rate, Focus Direct, Zoom Focus Direct, auto / manual focus and one push AF.
+  The autofocus hunts around the sharp position for af_hunt_time seconds after the lens moves, then settles
+  (true_focus() is the sharp position of the scene for a zoom position, is_sharp() tells if the image is sharp now)
+- ACK (90 4y FF) on receipt and Completion (90 5y FF) when the motion finished, with 2 command sockets: a command
+  arriving while both are busy gets a command buffer full error (90 6y 03 FF), a new motion command cancels the
+  previous one of the same motor (90 6y 04 FF). Unknown commands get a syntax error (90 60 02 FF)
+- Zoom and focus position inquiries (81 09 04 47 FF, 81 09 04 48 FF)
+- Serial timing at 9600 baud (10 bits per byte) in both directions plus a processing delay, and error injection
+  (dropped replies)
+
+Run standalone to get a pty path to point the driver at:
+    python3 visca_emulator.py
+'''
+
+ZOOM_MAX = 0x4000
+FOCUS_NEAR = 0x1000
+FOCUS_FAR = 0xC000
+TICK = 0.005
+
+
+class ViscaEmulator:
+    def __init__(self, baudrate=9600, processing_delay=0.002, zoom=0, speed_rates=None, speed_scale=1.0,
+                 direct_speed=4, focus_rate=12000, af_hunt_time=1.5, af_hunt_amplitude=900, sharp_tolerance=60,
+                 drop_rate=0.0, seed=None):
+        '''
+        baudrate: used to delay every byte by its transmission time (10 bits per byte) in both directions
+        processing_delay: camera side time before the ACK, in seconds
+        speed_rates: zoom position units per second of the variable speeds 0 to 7, from the camera calibration when
+            not given. speed_scale multiplies them (ex: 0.8 for a lens slower than the calibration says)
+        direct_speed: variable speed equivalent of Zoom Direct and Zoom Focus Direct moves
+        focus_rate: focus position units per second
+        af_hunt_time, af_hunt_amplitude: how long and how far the autofocus hunts after the lens moved
+        sharp_tolerance: focus units from true_focus() still counted as sharp
+        drop_rate: probability of not answering a command or inquiry at all
+        '''
+        self.baudrate = baudrate
+        self.processing_delay = processing_delay
+        rates = speed_rates or ZoomCurves.DEFAULT_CALIBRATION["zoom_speed_rates"]
+        self.speed_rates = [r * speed_scale for r in rates]
+        self.direct_rate = self.speed_rates[direct_speed]
+        self.focus_rate = focus_rate
+        self.af_hunt_time = af_hunt_time
+        self.af_hunt_amplitude = af_hunt_amplitude
+        self.sharp_tolerance = sharp_tolerance
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+
+        self.zoom = float(zoom)
+        self.zoom_velocity = 0.0        # Variable speed zoom, units per second
+        self.zoom_target = None         # Zoom Direct target
+        self.focus = float(self.true_focus())
+        self.focus_target = None
+        self.focus_auto = True
+        self.af_until = 0               # Autofocus hunting until this time
+        self.af_settle = False          # Hunting ended, moving to the sharp position
+        self.sockets = {}               # socket number -> motor ("zoom", "focus", "af") waiting for its completion
+        self.pending_replies = []       # Completions to send, written outside the lock
+
+        self.stats = {"commands": 0, "inquiries": 0, "acks": 0, "completions": 0, "buffer_full": 0, "cancelled": 0,
+                      "syntax_errors": 0, "dropped": 0, "bytes_in": 0, "bytes_out": 0}
+        self.command_log = []           # (time, command bytes)
+        self.lock = threading.Lock()
+        self.master = None
+        self.port = None
+        self.running = False
+        self.thread = None
+        self.rx = bytearray()
+        self.last_update = time.time()
+
+    # ---------------------------------------------------------------- pty plumbing
+
+    def start(self):
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave     # Keep the slave open so the pty survives driver reconnects
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def byte_time(self, n):
+        return n * 10 / self.baudrate
+
+    def write(self, data):
+        time.sleep(self.byte_time(len(data)))
+        self.stats["bytes_out"] += len(data)
+        os.write(self.master, bytes(data))
+
+    def serve(self):
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], TICK)
+            self.update()
+            self.flush_replies()
+            if not ready:
+                continue
+            try:
+                chunk = os.read(self.master, 256)
+            except OSError:
+                continue
+            self.rx += chunk
+            while 0xFF in self.rx:
+                end = self.rx.index(0xFF)
+                message, self.rx = bytes(self.rx[:end + 1]), self.rx[end + 1:]
+                self.stats["bytes_in"] += len(message)
+                time.sleep(self.byte_time(len(message)) + self.processing_delay)
+                self.handle(message)
+
+    # ---------------------------------------------------------------- lens model
+
+    def true_focus(self, zoom=None):
+        '''
+        Sharp focus position for the scene at a zoom position (the far subjects of a surf spot)
+        '''
+        zoom = self.zoom if zoom is None else zoom
+        return FOCUS_NEAR + 0x2000 * (zoom / ZOOM_MAX) ** 2 + 0x600 * zoom / ZOOM_MAX
+
+    def is_sharp(self):
+        with self.lock:
+            return abs(self.focus - self.true_focus()) <= self.sharp_tolerance
+
+    def zoom_level(self):
+        return ZoomCurves.get_curves().position_to_zoom(self.zoom)
+
+    def update(self):
+        now = time.time()
+        with self.lock:
+            dt = now - self.last_update
+            self.last_update = now
+            moved = False
+            if self.zoom_target is not None:
+                step = self.direct_rate * dt
+                if abs(self.zoom_target - self.zoom) <= step:
+                    self.zoom, self.zoom_target = self.zoom_target, None
+                    self.complete("zoom")
+                else:
+                    self.zoom += math.copysign(step, self.zoom_target - self.zoom)
+                moved = True
+            elif self.zoom_velocity:
+                zoom = min(max(self.zoom + self.zoom_velocity * dt, 0), ZOOM_MAX)
+                moved = zoom != self.zoom
+                self.zoom = zoom
+            if moved and self.focus_auto:
+                self.af_until = now + self.af_hunt_time      # Contrast AF keeps hunting while the image changes
+                self.af_settle = True
+
+            if self.focus_auto or self.af_until:
+                if now < self.af_until:
+                    phase = 2 * math.pi * (now % 0.8) / 0.8
+                    goal = self.true_focus() + self.af_hunt_amplitude * math.sin(phase)
+                elif self.af_settle:
+                    goal = self.true_focus()
+                else:
+                    goal = self.focus
+                self.move_focus(goal, dt)
+                if self.af_settle and now >= self.af_until and abs(self.focus - self.true_focus()) < 1:
+                    self.af_settle = False
+                    self.complete("af")
+                    if not self.focus_auto:
+                        self.af_until = 0
+            elif self.focus_target is not None:
+                if self.move_focus(self.focus_target, dt):
+                    self.focus_target = None
+                    self.complete("focus")
+
+    def move_focus(self, goal, dt):
+        step = self.focus_rate * dt
+        if abs(goal - self.focus) <= step:
+            self.focus = goal
+            return True
+        self.focus += math.copysign(step, goal - self.focus)
+        return False
+
+    # ---------------------------------------------------------------- VISCA
+
+    def complete(self, motor):
+        for socket, waiting in list(self.sockets.items()):
+            if waiting == motor:
+                del self.sockets[socket]
+                self.stats["completions"] += 1
+                self.pending_replies.append(bytes([0x90, 0x50 | socket, 0xFF]))
+
+    def flush_replies(self):
+        with self.lock:
+            replies, self.pending_replies = self.pending_replies, []
+        for reply in replies:
+            self.write(reply)
+
+    def open_socket(self, motor):
+        '''
+        Socket for a new command. A motion command cancels the previous one of the same motor.
+        Returns (socket, cancelled socket) or (None, None) when both sockets are busy
+        '''
+        cancelled = next((socket for socket, waiting in self.sockets.items() if waiting == motor), None)
+        free = [socket for socket in (1, 2) if socket not in self.sockets]
+        if not free and cancelled is None:
+            return None, None
+        if cancelled is not None:
+            del self.sockets[cancelled]
+        socket = free[0] if free else cancelled
+        self.sockets[socket] = motor
+        return socket, cancelled
+
+    @staticmethod
+    def nibbles_value(data):
+        return (data[0] & 0xF) << 12 | (data[1] & 0xF) << 8 | (data[2] & 0xF) << 4 | (data[3] & 0xF)
+
+    def handle(self, message):
+        self.command_log.append((time.time(), message))
+        if self.random.random() < self.drop_rate:
+            self.stats["dropped"] += 1
+            return
+        if message[:3] == b'\x81\x09\x04' and len(message) == 5 and message[3] in (0x47, 0x48):
+            self.stats["inquiries"] += 1
+            with self.lock:
+                value = int(round(self.zoom if message[3] == 0x47 else self.focus))
+            self.write(bytes([0x90, 0x50, (value >> 12) & 0xF, (value >> 8) & 0xF, (value >> 4) & 0xF, value & 0xF, 0xFF]))
+            return
+        if message[:3] != b'\x81\x01\x04' or len(message) < 6:
+            self.stats["syntax_errors"] += 1
+            self.write(b'\x90\x60\x02\xFF')
+            return
+
+        self.stats["commands"] += 1
+        command, args = message[3], message[4:-1]
+        with self.lock:
+            if command == 0x07 and len(args) == 1:
+                motor, action = "zoom", ("speed", args[0])
+            elif command == 0x47 and len(args) == 4:
+                motor, action = "zoom", ("direct", self.nibbles_value(args), None)
+            elif command == 0x47 and len(args) == 8:
+                motor, action = "zoom", ("direct", self.nibbles_value(args), self.nibbles_value(args[4:]))
+            elif command == 0x48 and len(args) == 4:
+                motor, action = "focus", ("focus", self.nibbles_value(args))
+            elif command == 0x38 and len(args) == 1 and args[0] in (0x02, 0x03):
+                motor, action = None, ("mode", args[0] == 0x02)
+            elif command == 0x18 and args == b'\x01':
+                motor, action = "af", ("af",)
+            else:
+                motor, action = None, None
+            if action is None:
+                socket = cancelled = None
+            else:
+                socket, cancelled = self.open_socket(motor or "mode")
+        if action is None:
+            self.stats["syntax_errors"] += 1
+            self.write(b'\x90\x60\x02\xFF')
+            return
+        if socket is None:
+            self.stats["buffer_full"] += 1
+            self.write(b'\x90\x60\x03\xFF')
+            return
+        self.stats["acks"] += 1
+        self.write(bytes([0x90, 0x40 | socket, 0xFF]))
+        if cancelled is not None:
+            self.stats["cancelled"] += 1
+            self.write(bytes([0x90, 0x60 | cancelled, 0x04, 0xFF]))
+
+        with self.lock:
+            done = self.apply(action)
+            if done:
+                del self.sockets[socket]
+                self.stats["completions"] += 1
+                self.pending_replies.append(bytes([0x90, 0x50 | socket, 0xFF]))
+        self.flush_replies()
+
+    def apply(self, action):
+        '''
+        Starts an action, returns True when it completes straight away
+        '''
+        kind = action[0]
+        if kind == "speed":
+            value = action[1]
+            self.zoom_target = None
+            if value == 0x00:
+                self.zoom_velocity = 0.0
+            elif value in (0x02, 0x03):
+                self.zoom_velocity = self.speed_rates[2] * (1 if value == 0x02 else -1)
+            elif value & 0xF0 in (0x20, 0x30) and value & 0x0F <= 7:
+                self.zoom_velocity = self.speed_rates[value & 0x0F] * (1 if value & 0xF0 == 0x20 else -1)
+            return True
+        if kind == "direct":
+            self.zoom_velocity = 0.0
+            self.zoom_target = float(min(action[1], ZOOM_MAX))
+            if action[2] is not None and not self.focus_auto:
+                self.focus_target = float(action[2])
+            return False
+        if kind == "focus":
+            if self.focus_auto:
+                return True     # Ignored in autofocus, like the camera
+            self.focus_target = float(action[1])
+            return False
+        if kind == "mode":
+            self.focus_auto = action[1]
+            self.focus_target = None
+            return True
+        if kind == "af":
+            if self.focus_auto:
+                return True
+            self.af_until = time.time() + self.af_hunt_time
+            self.af_settle = True
+            return False
+        return True
+
+
+if __name__ == "__main__":
+    emulator = ViscaEmulator()
+    port = emulator.start()
+    print(f"VISCA zoom emulator running on {port}")
+    print("Attach the driver with Zoom_CBN8125.SoarCameraZoomFocus(port=...). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"Zoom {emulator.zoom_level():.2f}x focus {emulator.focus:.0f} sharp {emulator.is_sharp()} {emulator.stats}")
+    except KeyboardInterrupt:
+        emulator.stop()
@@ -6,6 +6,7 @@ from logging.handlers import RotatingFileHandler
 import os
 import time
 import shutil
+import SessionManifest
 
 R = 6371 * 1000 # METERS
 
@@ -121,26 +122,18 @@ def is_surfer_incoming(camera_angle, surfer_course, threshold=np.radians(30)):
 
 def delete_old_videos(path: str, days: int = 7):
     """
-    Delete subfolders in `path` that are older than `days` days.
-    Each subfolder can contain video files or other data.
+    Delete the sessions (video folder and manifest) in `path` whose last clip is older than `days` days.
+    Sessions come from the session index, the video folders aren't listed.
     """
-    if not os.path.isdir(path):
-        raise ValueError(f"{path} is not a valid directory")
-
     now = time.time()
     cutoff = now - (days * 86400)  # days → seconds
 
-    for folder in os.listdir(path):
-        folder_path = os.path.join(path, folder)
-        if not os.path.isdir(folder_path):
-            continue  # only care about subfolders
-
-        # use folder's last modification time
-        folder_mtime = os.path.getmtime(folder_path)
-
-        if folder_mtime < cutoff:
-            print(f"Deleting old folder: {folder_path}")
-            shutil.rmtree(folder_path, ignore_errors=True)
+    index = SessionManifest.SessionIndex(videos_directory=path)
+    for session in index.sessions():
+        if session.get("updated", session.get("created", now)) < cutoff:
+            print(f"Deleting old folder: {os.path.join(path, session['session'])}")
+            index.delete(session["session"])
+    index.compact()
             
 import os
 